@@ -1,11 +1,13 @@
 from fastapi import FastAPI, Query, HTTPException, UploadFile, File, status
 from fastapi import Depends
-from main_dg import orthophoto_process, orthophoto_process_single_image, orthophoto_process_custom_input
+from main_dg import orthophoto_process, orthophoto_process_single_image, orthophoto_process_custom_input, warmup
 from fastapi.responses import FileResponse, RedirectResponse
 import uvicorn
 import os
 import zipfile
 import uuid
+import hashlib
+import threading
 from enum import Enum
 
 
@@ -32,24 +34,49 @@ class DroneTag(str, Enum):
     SUNLIGHT = "SUNLIGHT"
     VTOL = "VTOL"
 
+class Interpolation(str, Enum):
+    NEAREST = "nearest"
+    BILINEAR = "bilinear"
+    BICUBIC = "bicubic"
+    AREA = "area"
+
+class OutputProfile(str, Enum):
+    GTIFF = "GTiff"
+    COG_JPEG = "COG-JPEG"
+    COG_WEBP = "COG-WEBP"
+    COG_DEFLATE = "COG-DEFLATE"
+    COG_ZSTD = "COG-ZSTD"
+    COG_LZW = "COG-LZW"
+
+# output_format and compression of main_dg for the output profiles
+OUTPUT_PROFILES = {
+    OutputProfile.GTIFF: {"output_format": "GTiff"},
+    OutputProfile.COG_JPEG: {"output_format": "COG", "compression": "JPEG"},
+    OutputProfile.COG_WEBP: {"output_format": "COG", "compression": "WEBP"},
+    OutputProfile.COG_DEFLATE: {"output_format": "COG", "compression": "DEFLATE"},
+    OutputProfile.COG_ZSTD: {"output_format": "COG", "compression": "ZSTD"},
+    OutputProfile.COG_LZW: {"output_format": "COG", "compression": "LZW"},
+}
+
+# distortion: Brown-Conrady (k1, k2, k3, p1, p2) of the camera calibration, all zeros for a pinhole camera
 DEFAULT_PARAMS = {
-    DroneType.DJI_MAVIC_Pro_Platinum: {"ground_height": 0, "sensor_width": 6.16, "epsg": 5186, "gsd": 0},
-    DroneType.DJI_PHANTOM_4: {"ground_height": 0, "sensor_width": 13.2, "epsg": 5186, "gsd": 0},
-    DroneType.DJI_ZENMUSE_M300_P1: {"ground_height": 0, "sensor_width": 15.9, "epsg": 5186, "gsd": 0},
-    # DroneType.SUNLIGHT: {"ground_height": 0, "sensor_width": 0, "epsg": 5186, "gsd": 0},
-    DroneType.VTOL_HALLA_AR0234: {"ground_height": 0, "sensor_width": 5.76, "epsg": 5186, "gsd": 0},
-    DroneType.VTOL_HALLA_B0240: {"ground_height": 0, "sensor_width": 6.287, "epsg": 5186, "gsd": 0},
+    DroneType.DJI_MAVIC_Pro_Platinum: {"ground_height": 0, "sensor_width": 6.16, "epsg": 5186, "gsd": 0, "distortion": (0, 0, 0, 0, 0)},
+    DroneType.DJI_PHANTOM_4: {"ground_height": 0, "sensor_width": 13.2, "epsg": 5186, "gsd": 0, "distortion": (0, 0, 0, 0, 0)},
+    DroneType.DJI_ZENMUSE_M300_P1: {"ground_height": 0, "sensor_width": 15.9, "epsg": 5186, "gsd": 0, "distortion": (0, 0, 0, 0, 0)},
+    # DroneType.SUNLIGHT: {"ground_height": 0, "sensor_width": 0, "epsg": 5186, "gsd": 0, "distortion": (0, 0, 0, 0, 0)},
+    DroneType.VTOL_HALLA_AR0234: {"ground_height": 0, "sensor_width": 5.76, "epsg": 5186, "gsd": 0, "distortion": (0, 0, 0, 0, 0)},
+    DroneType.VTOL_HALLA_B0240: {"ground_height": 0, "sensor_width": 6.287, "epsg": 5186, "gsd": 0, "distortion": (0, 0, 0, 0, 0)},
 }
 
 DEFAULT_PARAMS_input_type = {
-    DroneType_input_type.DJI_MAVIC_Pro_Platinum: {"ground_height": 0, "sensor_width": 6.16, "epsg": 5186, "gsd": 0, "focal_length": 4.98},
-    DroneType_input_type.DJI_PHANTOM_4: {"ground_height": 0, "sensor_width": 13.2, "epsg": 5186, "gsd": 0, "focal_length": 8.8},
-    DroneType_input_type.DJI_ZENMUSE_M300_P1_fc_24: {"ground_height": 0, "sensor_width": 15.9, "epsg": 5186, "gsd": 0, "focal_length": 24},
-    DroneType_input_type.DJI_ZENMUSE_M300_P1_fc_35: {"ground_height": 0, "sensor_width": 15.9, "epsg": 5186, "gsd": 0, "focal_length": 35},
-    DroneType_input_type.DJI_ZENMUSE_M300_P1_fc_50: {"ground_height": 0, "sensor_width": 15.9, "epsg": 5186, "gsd": 0, "focal_length": 50},
-    # DroneType.SUNLIGHT: {"ground_height": 0, "sensor_width": 0, "epsg": 5186, "gsd": 0, "focal_length": 5.0},
-    DroneType_input_type.VTOL_HALLA_AR0234: {"ground_height": 0, "sensor_width": 5.76, "epsg": 5186, "gsd": 0, "focal_length": 3.6},
-    DroneType_input_type.VTOL_HALLA_B0240: {"ground_height": 0, "sensor_width": 6.287, "epsg": 5186, "gsd": 0, "focal_length": 6},
+    DroneType_input_type.DJI_MAVIC_Pro_Platinum: {"ground_height": 0, "sensor_width": 6.16, "epsg": 5186, "gsd": 0, "focal_length": 4.98, "distortion": (0, 0, 0, 0, 0)},
+    DroneType_input_type.DJI_PHANTOM_4: {"ground_height": 0, "sensor_width": 13.2, "epsg": 5186, "gsd": 0, "focal_length": 8.8, "distortion": (0, 0, 0, 0, 0)},
+    DroneType_input_type.DJI_ZENMUSE_M300_P1_fc_24: {"ground_height": 0, "sensor_width": 15.9, "epsg": 5186, "gsd": 0, "focal_length": 24, "distortion": (0, 0, 0, 0, 0)},
+    DroneType_input_type.DJI_ZENMUSE_M300_P1_fc_35: {"ground_height": 0, "sensor_width": 15.9, "epsg": 5186, "gsd": 0, "focal_length": 35, "distortion": (0, 0, 0, 0, 0)},
+    DroneType_input_type.DJI_ZENMUSE_M300_P1_fc_50: {"ground_height": 0, "sensor_width": 15.9, "epsg": 5186, "gsd": 0, "focal_length": 50, "distortion": (0, 0, 0, 0, 0)},
+    # DroneType.SUNLIGHT: {"ground_height": 0, "sensor_width": 0, "epsg": 5186, "gsd": 0, "focal_length": 5.0, "distortion": (0, 0, 0, 0, 0)},
+    DroneType_input_type.VTOL_HALLA_AR0234: {"ground_height": 0, "sensor_width": 5.76, "epsg": 5186, "gsd": 0, "focal_length": 3.6, "distortion": (0, 0, 0, 0, 0)},
+    DroneType_input_type.VTOL_HALLA_B0240: {"ground_height": 0, "sensor_width": 6.287, "epsg": 5186, "gsd": 0, "focal_length": 6, "distortion": (0, 0, 0, 0, 0)},
 }
 
 DRONE_TYPE_TO_TAG_MAP = {
@@ -66,33 +93,87 @@ DRONE_TYPE_TO_TAG_MAP = {
 def custom_drone_params(drone_type: DroneType = Query(...),
                         ground_height: float = Query(0, description="Ground height in meters / unit: m"),
                         epsg: int = Query(5186, description="EPSG code for the geographic coordinate system / editable"),
-                        gsd: float = Query(0, description="Ground Sampling Distance in meters")):
+                        gsd: float = Query(0, description="Ground Sampling Distance in meters"),
+                        interpolation: Interpolation = Query(Interpolation.NEAREST, description="Resampling method")):
     return {
         "ground_height": ground_height if ground_height is not None else DEFAULT_PARAMS[drone_type]["ground_height"],
         "sensor_width": DEFAULT_PARAMS[drone_type]["sensor_width"],  # This will always use the default value
         "epsg": epsg if epsg is not None else DEFAULT_PARAMS[drone_type]["epsg"],
-        "gsd": gsd if gsd is not None else DEFAULT_PARAMS[drone_type]["gsd"]
+        "gsd": gsd if gsd is not None else DEFAULT_PARAMS[drone_type]["gsd"],
+        "interpolation": interpolation.value,
+        "distortion": DEFAULT_PARAMS[drone_type]["distortion"]
     }
 
 def custom_drone_params_single_image(drone_type: DroneType = Query(...),
                         ground_height: float = Query(0, description="Ground height in meters / unit: m"),
                         epsg: int = Query(5186, description="EPSG code for the geographic coordinate system / editable"),
-                        gsd: float = Query(0, description="Ground Sampling Distance in meters")):
+                        gsd: float = Query(0, description="Ground Sampling Distance in meters"),
+                        interpolation: Interpolation = Query(Interpolation.NEAREST, description="Resampling method")):
     return {
         "ground_height": ground_height if ground_height is not None else DEFAULT_PARAMS[drone_type]["ground_height"],
         "sensor_width": DEFAULT_PARAMS[drone_type]["sensor_width"],  # This will always use the default value
         "epsg": epsg if epsg is not None else DEFAULT_PARAMS[drone_type]["epsg"],
-        "gsd": gsd if gsd is not None else DEFAULT_PARAMS[drone_type]["gsd"]
+        "gsd": gsd if gsd is not None else DEFAULT_PARAMS[drone_type]["gsd"],
+        "interpolation": interpolation.value,
+        "distortion": DEFAULT_PARAMS[drone_type]["distortion"]
     }
 
+def lens_distortion_params(k1: float = Query(0, description="Radial distortion k1 of the camera calibration (Brown-Conrady, OpenCV convention)"),
+                           k2: float = Query(0, description="Radial distortion k2"),
+                           k3: float = Query(0, description="Radial distortion k3"),
+                           p1: float = Query(0, description="Tangential distortion p1"),
+                           p2: float = Query(0, description="Tangential distortion p2")):
+    # (k1, k2, k3, p1, p2), all zeros for a pinhole camera
+    return (k1, k2, k3, p1, p2)
+
 app = FastAPI()
+app.state.ready = False
+
+def warmup_app():
+    # JIT kernels (cached on disk after the first start), GDAL drivers and coordinate systems
+    warmup_time = warmup()
+    print(f"Warm-up done in {warmup_time:.2f} s")
+    app.state.ready = True
+
+@app.on_event("startup")
+async def startup():
+    # Warm up in the background; /ready reports when it is done
+    threading.Thread(target=warmup_app, daemon=True).start()
+
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    if not app.state.ready:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Warming up")
+    return {"ready": True}
+
+def save_dem(dem_file: UploadFile, dem_gsd=None):
+    # Optional DEM (GeoTIFF, or PLY/OBJ with the spacing of its grid) of the area, used instead of the ground height
+    # Saved by its content (and spacing), so that the same DEM is saved once and the DEM store built next to it
+    # (see module.Dem) is reused by the next requests
+    if dem_file is None:
+        return None
+    content = dem_file.file.read()
+    key = hashlib.sha256(content).hexdigest()
+    if dem_gsd is not None:
+        key += f"_{dem_gsd:g}"
+    dem_location = f"/data/dem_{key}{os.path.splitext(dem_file.filename)[1].lower()}"
+    if not os.path.exists(dem_location):
+        upload_location = f"{dem_location}.{uuid.uuid4()}"
+        with open(upload_location, "wb") as buffer:
+            buffer.write(content)
+        os.replace(upload_location, dem_location)
+    return dem_location
 
 @app.post("/Orthophoto/", tags=["Metadata - Datasets format - zip format"])
 async def Input_datasets_format(
     drone_type: DroneType,
     params: dict = Depends(custom_drone_params),
-    zip_file: UploadFile = File(...)):
-    return await process_datasets(params, zip_file)
+    zip_file: UploadFile = File(...),
+    dem_file: UploadFile = File(None, description="Optional DEM (GeoTIFF, or PLY/OBJ with dem_gsd) instead of the ground height"),
+    true_ortho: bool = Query(False, description="True orthophoto: leave the pixels occluded by the DEM (a DSM) as nodata"),
+    dem_gsd: float = Query(None, description="Grid spacing of a PLY/OBJ DEM file / unit: m"),
+    output_profile: OutputProfile = Query(OutputProfile.GTIFF, description="Output file: GeoTIFF, or Cloud-Optimized GeoTIFF of a compression")):
+    return await process_datasets(params, zip_file, dem_file, true_ortho, output_profile, dem_gsd)
 
 @app.post("/Orthophoto/custom/", tags=["Metadata - Datasets format - zip format"])
 async def Input_datasets_custom_format(
@@ -100,22 +181,33 @@ async def Input_datasets_custom_format(
     ground_height: float = Query(0, description="Ground height in meters / unit: m"),
     sensor_width: float = Query(6.3, description="Sensor width in millimeters / unit: mm, Mavic"),
     epsg: int = Query(5186, description="EPSG code for the geographic coordinate system / editable"),
-    gsd: float = Query(0, description="Ground Sampling Distance in meters")):
+    gsd: float = Query(0, description="Ground Sampling Distance in meters"),
+    interpolation: Interpolation = Query(Interpolation.NEAREST, description="Resampling method"),
+    distortion: tuple = Depends(lens_distortion_params),
+    dem_file: UploadFile = File(None, description="Optional DEM (GeoTIFF, or PLY/OBJ with dem_gsd) instead of the ground height"),
+    true_ortho: bool = Query(False, description="True orthophoto: leave the pixels occluded by the DEM (a DSM) as nodata"),
+    dem_gsd: float = Query(None, description="Grid spacing of a PLY/OBJ DEM file / unit: m"),
+    output_profile: OutputProfile = Query(OutputProfile.GTIFF, description="Output file: GeoTIFF, or Cloud-Optimized GeoTIFF of a compression")):
 
     params = {
         "ground_height": ground_height,
         "sensor_width": sensor_width,
         "epsg": epsg,
-        "gsd": gsd
+        "gsd": gsd,
+        "interpolation": interpolation.value,
+        "distortion": distortion
     }
 
-    return await process_datasets(params, zip_file)
+    return await process_datasets(params, zip_file, dem_file, true_ortho, output_profile, dem_gsd)
 
-async def process_datasets(params: dict, zip_file: UploadFile):
+async def process_datasets(params: dict, zip_file: UploadFile, dem_file: UploadFile = None, true_ortho=False,
+                           output_profile=OutputProfile.GTIFF, dem_gsd=None):
     ground_height = params.get("ground_height")
     sensor_width = params.get("sensor_width")
     epsg = params.get("epsg")
     gsd = params.get("gsd")
+    interpolation = params.get("interpolation", Interpolation.NEAREST.value)
+    distortion = params.get("distortion")
 
     # Use default parameters based on drone type if specific values are not provided
     ground_height = ground_height if ground_height is not None else DEFAULT_PARAMS[drone_type]["ground_height"]
@@ -139,7 +231,9 @@ async def process_datasets(params: dict, zip_file: UploadFile):
     if not os.path.exists(output_folder_path):
         os.makedirs(output_folder_path)
 
-    output_folder = orthophoto_process(extraction_folder, ground_height, sensor_width, epsg, gsd, output_folder_path)
+    output_folder = orthophoto_process(extraction_folder, ground_height, sensor_width, epsg, gsd, output_folder_path,
+                                       interpolation, distortion=distortion, dem=save_dem(dem_file, dem_gsd),
+                                       dem_gsd=dem_gsd, true_ortho=true_ortho, **OUTPUT_PROFILES[output_profile])
     
     zip_output_name = os.path.join("/data", f"{unique_output_id}.zip")
     with zipfile.ZipFile(zip_output_name, 'w') as zipf:
@@ -158,9 +252,13 @@ async def download_files(unique_id: str):
 async def Input_single_image_default(
     drone_type: DroneType,
     params: dict = Depends(custom_drone_params_single_image),
-    image: UploadFile = File(...)):
+    image: UploadFile = File(...),
+    dem_file: UploadFile = File(None, description="Optional DEM (GeoTIFF, or PLY/OBJ with dem_gsd) instead of the ground height"),
+    true_ortho: bool = Query(False, description="True orthophoto: leave the pixels occluded by the DEM (a DSM) as nodata"),
+    dem_gsd: float = Query(None, description="Grid spacing of a PLY/OBJ DEM file / unit: m"),
+    output_profile: OutputProfile = Query(OutputProfile.GTIFF, description="Output file: GeoTIFF, or Cloud-Optimized GeoTIFF of a compression")):
 
-    return await process_single_image(params, image)
+    return await process_single_image(params, image, dem_file, true_ortho, output_profile, dem_gsd)
 
 @app.post("/Orthophoto//custom/", tags=["Metadata format - Single image"])
 async def Input_single_image_custom(
@@ -168,32 +266,47 @@ async def Input_single_image_custom(
     ground_height: float = Query(0, description="Ground height in meters / unit: m"),
     sensor_width: float = Query(6.3, description="Sensor width in millimeters / unit: mm, Mavic"),
     epsg: int = Query(5186, description="EPSG code for the geographic coordinate system / editable"),
-    gsd: float = Query(0, description="Ground Sampling Distance in meters")):
+    gsd: float = Query(0, description="Ground Sampling Distance in meters"),
+    interpolation: Interpolation = Query(Interpolation.NEAREST, description="Resampling method"),
+    distortion: tuple = Depends(lens_distortion_params),
+    dem_file: UploadFile = File(None, description="Optional DEM (GeoTIFF, or PLY/OBJ with dem_gsd) instead of the ground height"),
+    true_ortho: bool = Query(False, description="True orthophoto: leave the pixels occluded by the DEM (a DSM) as nodata"),
+    dem_gsd: float = Query(None, description="Grid spacing of a PLY/OBJ DEM file / unit: m"),
+    output_profile: OutputProfile = Query(OutputProfile.GTIFF, description="Output file: GeoTIFF, or Cloud-Optimized GeoTIFF of a compression")):
 
     params = {
         "ground_height": ground_height,
         "sensor_width": sensor_width,
         "epsg": epsg,
-        "gsd": gsd
+        "gsd": gsd,
+        "interpolation": interpolation.value,
+        "distortion": distortion
     }
 
-    return await process_single_image(params, image)
+    return await process_single_image(params, image, dem_file, true_ortho, output_profile, dem_gsd)
 
-async def process_single_image(params: dict, image: UploadFile):
-    image_location = f"/data/{image.filename}"
-    with open(image_location, "wb") as buffer:
-        buffer.write(image.file.read())
+async def process_single_image(params: dict, image: UploadFile, dem_file: UploadFile = None, true_ortho=False,
+                               output_profile=OutputProfile.GTIFF, dem_gsd=None):
+    # The metadata and the pixels are read from the upload in memory, without writing the image to disk
+    image_buffer = await image.read()
 
     output_folder_path = "/data/outputs_single"
     if not os.path.exists(output_folder_path):
         os.makedirs(output_folder_path)
 
-    output_image_path = orthophoto_process_single_image(image_location, 
+    output_image_path = orthophoto_process_single_image(image_buffer,
                                                         params['ground_height'],
                                                         params['sensor_width'], 
                                                         params['epsg'], 
                                                         params['gsd'], 
-                                                        output_folder_path)
+                                                        output_folder_path,
+                                                        params['interpolation'],
+                                                        distortion=params.get('distortion'),
+                                                        dem=save_dem(dem_file, dem_gsd),
+                                                        dem_gsd=dem_gsd,
+                                                        true_ortho=true_ortho,
+                                                        image_name=image.filename,
+                                                        **OUTPUT_PROFILES[output_profile])
 
     unique_image_name = os.path.basename(output_image_path)
     if not unique_image_name.endswith('.tif'):
@@ -218,7 +331,13 @@ async def input_single_image_with_input(
     altitude: float = Query(..., description="Unit: m"),
     roll: float = Query(..., description="Unit: degrees"),
     pitch: float = Query(..., description="Unit: degrees"),
-    yaw: float = Query(..., description="Unit: degrees")
+    yaw: float = Query(..., description="Unit: degrees"),
+    interpolation: Interpolation = Query(Interpolation.NEAREST, description="Resampling method"),
+    lens_distortion: tuple = Depends(lens_distortion_params),
+    dem_file: UploadFile = File(None, description="Optional DEM (GeoTIFF, or PLY/OBJ with dem_gsd) instead of the ground height"),
+    true_ortho: bool = Query(False, description="True orthophoto: leave the pixels occluded by the DEM (a DSM) as nodata"),
+    dem_gsd: float = Query(None, description="Grid spacing of a PLY/OBJ DEM file / unit: m"),
+    output_profile: OutputProfile = Query(OutputProfile.GTIFF, description="Output file: GeoTIFF, or Cloud-Optimized GeoTIFF of a compression")
 ):
 
     sensor_width = DEFAULT_PARAMS_input_type[drone_type]["sensor_width"]
@@ -226,6 +345,8 @@ async def input_single_image_with_input(
     focal_length_mm = DEFAULT_PARAMS_input_type[drone_type]["focal_length"]
     focal_length = round(focal_length_mm / 1000, 2)
     tag = DRONE_TYPE_TO_TAG_MAP[drone_type]
+    # The coefficients of the request, if any, instead of those of the drone type
+    distortion = lens_distortion if any(lens_distortion) else DEFAULT_PARAMS_input_type[drone_type]["distortion"]
 
     params = {
         "ground_height": ground_height,
@@ -239,26 +360,26 @@ async def input_single_image_with_input(
         "roll": roll,
         "pitch": pitch,
         "yaw": yaw,
-        "tag": tag
+        "tag": tag,
+        "interpolation": interpolation.value,
+        "distortion": distortion
     }
 
-    return await process_single_image_with_custom_input(params, image)
-
-async def process_single_image_with_custom_input(params: dict, image: UploadFile):
-    image_location = f"/data/{image.filename}"
-    
-    if not os.path.exists(os.path.dirname(image_location)):
-        os.makedirs(os.path.dirname(image_location))
+    return await process_single_image_with_custom_input(params, image, dem_file, true_ortho,
+                                                       output_profile, dem_gsd)
 
-    with open(image_location, "wb") as buffer:
-        buffer.write(image.file.read())
+async def process_single_image_with_custom_input(params: dict, image: UploadFile, dem_file: UploadFile = None,
+                                                 true_ortho=False, output_profile=OutputProfile.GTIFF,
+                                                 dem_gsd=None):
+    # The pixels are decoded from the upload in memory, without writing the image to disk
+    image_buffer = await image.read()
 
     output_folder_path = "/data/outputs_single"
     if not os.path.exists(output_folder_path):
         os.makedirs(output_folder_path)
 
     try:
-        output_image_path = orthophoto_process_custom_input(image_location, 
+        output_image_path = orthophoto_process_custom_input(image_buffer,
                                                             params['longitude'],
                                                             params['latitude'],
                                                             params['altitude'],
@@ -271,7 +392,14 @@ async def process_single_image_with_custom_input(params: dict, image: UploadFile
                                                             params['epsg'], 
                                                             params['gsd'], 
                                                             output_folder_path,
-                                                            tag=params["tag"])
+                                                            tag=params["tag"],
+                                                            interpolation=params["interpolation"],
+                                                            distortion=params["distortion"],
+                                                            dem=save_dem(dem_file, dem_gsd),
+                                                            dem_gsd=dem_gsd,
+                                                            true_ortho=true_ortho,
+                                                            image_name=image.filename,
+                                                            **OUTPUT_PROFILES[output_profile])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
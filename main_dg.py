@@ -1,91 +1,133 @@
 import os
+import json
+import struct
+import queue
+import threading
+import itertools
+import multiprocessing
+import numba
+import cv2
 import numpy as np
 import time
+from collections import deque
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from module.ExifData import *
 from module.EoData import *
-from module.Boundary import boundary
-from module.BackprojectionResample import rectify_plane_parallel, createGeoTiff
+from module.Boundary import footprint, footprint_dem, footprint_rays, footprint_spans, polygon_bbox
+from module.Dem import DemStore, open_dem, dem_statistics
+from module.Catalog import Catalog, scan_image
+from module.Video import read_telemetry, video_poses
+from module.BackprojectionResample import rectify, rectify_tiled, createGeoTiffInterleaved, createGeoTiffFootprint, \
+    createMappedOutput, createCOG, warmup_kernels, projection_wkt, band_order, \
+    MappingCache, snap_boundary
+from osgeo import gdal
 from rich.console import Console
 from rich.table import Table
 
-def orthophoto_process(input_folder, ground_height, sensor_width, epsg, gsd, output_folder_path):
-    console = Console()
-
-    if not os.path.exists(output_folder_path):
-        os.mkdir(output_folder_path)
-
-    results = []
-
-    for root, dirs, files in os.walk(input_folder):
-        files.sort()
-        for file in files:
-            image_start_time = time.time()
-            filename = os.path.splitext(file)[0]
-            extension = os.path.splitext(file)[1].lower()
-            file_path = os.path.join(root, file)
-            # dst = os.path.join(output_folder, filename + ".tif")
-            dst = os.path.join(output_folder_path, filename)
-
-            if extension == '.jpg':
-                print('Georeferencing - ' + file)
-                start_time = time.time()
-                image = cv2.imread(file_path, -1)
-
-                # 1. Extract metadata from the image
-                focal_length, orientation, eo, maker = get_metadata(file_path)
-                restored_image = restoreOrientation(image, orientation)
-
-                image_rows = restored_image.shape[0]
-                image_cols = restored_image.shape[1]
-
-                pixel_size = sensor_width / image_cols  # Convert from mm to m
-                pixel_size /= 1000
-
-                eo = geographic2plane(eo, epsg)
-                opk = rpy_to_opk(eo[3:], maker)
-                eo[3:] = opk * np.pi / 180
-                R = Rot3D(eo)
-
-                georef_time = time.time() - start_time
-
-                # 2. Compute DEM & GSD
-                print('DEM & GSD')
-                start_time = time.time()
-                bbox = boundary(restored_image, eo, R, ground_height, pixel_size, focal_length)
-                
-                if gsd == 0:
-                    gsd = (pixel_size * (eo[2] - ground_height)) / focal_length
-                
-                boundary_cols = int((bbox[1, 0] - bbox[0, 0]) / gsd)
-                boundary_rows = int((bbox[3, 0] - bbox[2, 0]) / gsd)
-
-                dem_time = time.time() - start_time
-
-                # 3. Rectify & Resample
-                print('Rectify & Resampling')
-                start_time = time.time()
-                b, g, r, a = rectify_plane_parallel(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height,
-                                                    R, focal_length, pixel_size, image)
-                rectify_time = time.time() - start_time
-
-                # 4. Create GeoTiff
-                print('Save the image in GeoTiff')
-                start_time = time.time()
-                createGeoTiff(b, g, r, a, bbox, gsd, epsg, boundary_rows, boundary_cols, dst)
-                write_time = time.time() - start_time
-
-                processing_time = time.time() - image_start_time
-
-                results.append({
-                    "filename": filename,
-                    "georef_time": round(georef_time, 5),
-                    "dem_time": round(dem_time, 5),
-                    "rectify_time": round(rectify_time, 5),
-                    "write_time": round(write_time, 5),
-                    "processing_time": round(processing_time, 5)
-                })
+def warmup(epsg=5186):
+    # Numba kernels, GDAL drivers and coordinate systems, before the first image
+    start_time = time.time()
+    warmup_kernels()
+    gdal.AllRegister()
+    for driver in ['GTiff', 'ENVI', 'MEM']:
+        gdal.GetDriverByName(driver)
+    projection_wkt(epsg)
+    warmup_transformation(epsg)     # shared by all the threads
+    return time.time() - start_time
+
+def ground_footprint(image, eo, R, ground_height, pixel_size, focal_length, distortion=None, dem=None,
+                     true_ortho=False):
+    # Footprint polygon, its bbox, the reference height for the GSD and the DEM under the footprint -
+    # on the plane of ground_height, or on a gridded DEM (mean height under the footprint)
+    # On a DEM, the footprint between its lowest and highest terrain also covers the ground hidden behind the relief,
+    # which the orthophoto maps too - a true orthophoto leaves it as nodata, so the rays of the border are enough
+    if dem is None:
+        polygon = footprint(image, eo, R, ground_height, pixel_size, focal_length, distortion)
+        return polygon, polygon_bbox(polygon), ground_height, None
+
+    polygon = footprint_dem(image, eo, R, dem, pixel_size, focal_length, distortion)
+    bbox = polygon_bbox(polygon)
+    if isinstance(dem, DemStore):
+        dem = dem.window(bbox)  # only the tiles under the footprint
+    if true_ortho:
+        polygon = footprint_rays(image, eo, R, dem, pixel_size, focal_length, distortion)
+        bbox = polygon_bbox(polygon)
+    return polygon, bbox, dem_statistics(dem, bbox)[1], dem
+
+def decode_image(image_path, orientation, eo, ground_height, sensor_width, focal_length, gsd, dem=None,
+                 image_size=None):
+    # Decode the image reduced (1/2, 1/4, 1/8) if the gsd of the orthophoto is that much coarser than the native GSD
+    # The native GSD is taken at the highest ground, so that the decoded image still resolves the gsd everywhere
+    # image_size: rows, cols of the image if known, e.g. from the catalog
+    rows, cols = get_image_size(image_path) if image_size is None else image_size
+    cols = restored_cols((rows, cols), orientation)
+    highest = ground_height if dem is None else dem_statistics(dem)[2]
+    scale = decode_scale(gsd, sensor_width / cols / 1000, eo[2] - highest, focal_length)
+    return read_image(image_path, scale)
+
+def rectify_image(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size, image,
+                  epsg, dst, interpolation="nearest", spans=None, output_format="GTiff", tiled=False,
+                  memory_budget=None, precision="float64", distortion=None, max_error=None, dem=None,
+                  true_ortho=False, mapping_cache=None):
+    # 3. Rectify & Resample - the orthophoto to write, or None if the tiled output already wrote it
+    true_ortho = true_ortho and dem is not None  # only with a DEM
+    if tiled and output_format == "COG":
+        raise Exception(" * An invalid output format!!! Not GTiff for the tiled output")
+    if tiled:
+        # Stream fixed-size tiles into a tiled GeoTiff, with O(tile) memory for the orthophoto (not the source image)
+        print('Rectify & Resampling - streaming tiles into the GeoTiff')
+        rectify_time, write_time = rectify_tiled(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height, R,
+                                                 focal_length, pixel_size, image, epsg, dst, interpolation,
+                                                 spans=spans, memory_budget=memory_budget, precision=precision,
+                                                 distortion=distortion, max_error=max_error, dem=dem,
+                                                 true_ortho=true_ortho)
+        return None, rectify_time, write_time
 
+    print('Rectify & Resampling')
+    start_time = time.time()
+    # ENVI: rectify straight into the memory-mapped output file
+    out = None
+    if output_format == "ENVI":
+        _, band_map = band_order(image)
+        out = createMappedOutput(bbox, gsd, epsg, boundary_rows, boundary_cols, dst, band_map.shape[0] + 1,
+                                 image.dtype)
+    ortho = rectify(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height,
+                    R, focal_length, pixel_size, image, interpolation, spans=spans, out=out, precision=precision,
+                    distortion=distortion, max_error=max_error, dem=dem, true_ortho=true_ortho,
+                    mapping_cache=mapping_cache)
+    return ortho, time.time() - start_time, 0.
+
+def write_image(ortho, bbox, gsd, epsg, dst, spans=None, crop=False, output_format="GTiff", compression="DEFLATE"):
+    # 4. Create GeoTiff
+    print('Save the image in GeoTiff')
+    start_time = time.time()
+    if output_format == "ENVI":
+        ortho.flush()
+    elif output_format == "COG":
+        createCOG(ortho, bbox, gsd, epsg, dst, compression, spans if crop else None)
+    elif crop:
+        createGeoTiffFootprint(ortho, bbox, gsd, epsg, spans, dst)
+    else:
+        createGeoTiffInterleaved(ortho, bbox, gsd, epsg, dst)
+    return time.time() - start_time
+
+def rectify_and_write(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size, image,
+                      epsg, dst, interpolation="nearest", spans=None, crop=False, output_format="GTiff",
+                      tiled=False, memory_budget=None, precision="float64", distortion=None, max_error=None,
+                      dem=None, true_ortho=False, compression="DEFLATE", mapping_cache=None):
+    # output_format: GTiff, ENVI (memory-mapped) or COG (Cloud-Optimized GeoTIFF of the compression)
+    ortho, rectify_time, write_time = rectify_image(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height, R,
+                                                    focal_length, pixel_size, image, epsg, dst, interpolation, spans,
+                                                    output_format, tiled, memory_budget, precision, distortion,
+                                                    max_error, dem, true_ortho, mapping_cache)
+    if ortho is not None:
+        write_time = write_image(ortho, bbox, gsd, epsg, dst, spans, crop, output_format, compression)
+    return rectify_time, write_time
+
+def print_results(results):
     # Display results in a table
+    console = Console()
     table = Table(show_header=True, header_style="bold magenta")
     table.add_column("Image", style="dim", width=12)
     table.add_column("Georeferencing", justify="right")
@@ -106,10 +148,533 @@ def orthophoto_process(input_folder, ground_height, sensor_width, epsg, gsd, out
 
     console.print(table)
 
+def prescan_folder(input_folder, epsg, ground_height, sensor_width, catalog=None, workers=None):
+    # 0. Prescan the georeferencing of all the images in parallel, or reuse it from the catalog
+    file_paths = []
+    for root, dirs, files in os.walk(input_folder):
+        files.sort()
+        file_paths += [os.path.join(root, file) for file in files if os.path.splitext(file)[1].lower() == '.jpg']
+    start_time = time.time()
+    catalog = Catalog(os.path.join(input_folder, 'orthophoto_catalog.sqlite') if catalog is None else catalog)
+    records = catalog.prescan(file_paths, epsg, ground_height, sensor_width, workers)
+    catalog.close()
+    print('Prescan - %d images, %.5f seconds' % (len(file_paths), time.time() - start_time))
+    return file_paths, records
+
+def decode_stage(file_path, record, ground_height, sensor_width, gsd, dem):
+    # 1. Decode an image of the catalog - the image, when its processing started and the decoding time
+    start_time = time.time()
+    image = decode_image(file_path, record['orientation'], record['eo'], ground_height, sensor_width,
+                         record['focal_length'], gsd, dem, (record['rows'], record['cols']))
+    return image, start_time, time.time() - start_time
+
+def georeference_record(image, record, ground_height, sensor_width, gsd, distortion=None, dem=None,
+                        true_ortho=False):
+    # Georeferencing of a decoded image of the catalog: R with its orientation, pixel size, footprint (bbox,
+    # reference height, DEM under it), the gsd (automatic for 0), the size of the orthophoto and its spans
+    focal_length, orientation, eo = record['focal_length'], record['orientation'], record['eo']
+    R = orientation_rotation(orientation) @ record['R']     # the image is sampled as stored
+
+    pixel_size = sensor_width / restored_cols(image.shape, orientation)  # Convert from mm to m
+    pixel_size /= 1000
+
+    polygon, bbox, reference_height, dem = ground_footprint(image, eo, R, ground_height, pixel_size, focal_length,
+                                                            distortion, dem, true_ortho)
+    if gsd == 0:
+        gsd = (pixel_size * (eo[2] - reference_height)) / focal_length
+
+    boundary_cols = int((bbox[1, 0] - bbox[0, 0]) / gsd)
+    boundary_rows = int((bbox[3, 0] - bbox[2, 0]) / gsd)
+    spans = footprint_spans(polygon, bbox, boundary_rows, boundary_cols, gsd)
+    return R, pixel_size, bbox, reference_height, dem, gsd, boundary_rows, boundary_cols, spans
+
+def write_stage(writes, results, errors):
+    # 4. Write the orthophotos of the queue until None, and complete their results
+    # After an error the queue is still drained, so that the rectify stage never blocks on it
+    while True:
+        item = writes.get()
+        if item is None:
+            return
+        ortho, write_args, result, image_start_time = item
+        if errors:
+            continue
+        try:
+            if ortho is not None:
+                result["write_time"] = round(write_image(ortho, *write_args), 5)
+            result["processing_time"] = round(time.time() - image_start_time, 5)
+            results.append(result)
+        except Exception as e:
+            errors.append(e)
+
+def orthophoto_process(input_folder, ground_height, sensor_width, epsg, gsd, output_folder_path, interpolation="nearest",
+                       crop=False, output_format="GTiff", tiled=False, memory_budget=None, precision="float64",
+                       distortion=None, max_error=None, dem=None, true_ortho=False, catalog=None, workers=None,
+                       compression="DEFLATE", queue_size=2, dem_gsd=None):
+    # dem: gridded DEM instead of ground_height - a path (GeoTIFF/PLY/OBJ, converted once into a DEM store),
+    # a DemStore or a loaded DEM (heights, geotransform), see module.Dem
+    # dem_gsd: spacing of the grid of a PLY/OBJ DEM - unit: m
+    # true_ortho: leave the pixels occluded by the DEM (a DSM) as nodata
+    # output_format: GTiff, ENVI or COG of the compression (JPEG/WEBP/DEFLATE/ZSTD/LZW)
+    # catalog: SQLite catalog of the georeferencing, reused by reruns (orthophoto_catalog.sqlite in the input folder
+    # by default), see module.Catalog - workers: threads of the prescan and the decoding
+    # queue_size: images decoded ahead of the rectification, and orthophotos waiting for the writer
+    dem = open_dem(dem, dem_gsd)
+
+    if not os.path.exists(output_folder_path):
+        os.mkdir(output_folder_path)
+
+    results = []
+
+    # 0. Prescan the georeferencing of all the images in parallel, or reuse it from the catalog
+    file_paths, records = prescan_folder(input_folder, epsg, ground_height, sensor_width, catalog, workers)
+
+    # Staged pipeline: 1. decode in a thread pool, 2-3. DEM & rectify on the Numba threads (this thread),
+    # 4. write in a writer thread - bounded queues between the stages, of queue_size images each
+    start_time = time.time()
+    decoder = ThreadPoolExecutor(max_workers=workers)
+    decodes = deque()
+    pending = iter(zip(file_paths, records))
+    writes = queue.Queue(maxsize=queue_size)
+    errors = []
+    writer = threading.Thread(target=write_stage, args=(writes, results, errors))
+    writer.start()
+    try:
+        for file_path, record in itertools.islice(pending, queue_size):
+            decodes.append((file_path, record, decoder.submit(decode_stage, file_path, record, ground_height,
+                                                              sensor_width, gsd, dem)))
+        while decodes and not errors:
+            file_path, record, decode = decodes.popleft()
+            for next_path, next_record in itertools.islice(pending, 1):
+                decodes.append((next_path, next_record, decoder.submit(decode_stage, next_path, next_record,
+                                                                       ground_height, sensor_width, gsd, dem)))
+
+            file = os.path.basename(file_path)
+            filename = os.path.splitext(file)[0]
+            # dst = os.path.join(output_folder, filename + ".tif")
+            dst = os.path.join(output_folder_path, filename)
+
+            print('Georeferencing - ' + file)
+            image, image_start_time, georef_time = decode.result()
+
+            # 1. Georeferencing from the catalog, 2. Compute DEM & GSD
+            print('DEM & GSD')
+            dem_start_time = time.time()
+            R, pixel_size, bbox, reference_height, dem_window, image_gsd, boundary_rows, boundary_cols, spans = \
+                georeference_record(image, record, ground_height, sensor_width, gsd, distortion, dem,
+                                    true_ortho)
+            dem_time = time.time() - dem_start_time
+
+            # 3. Rectify & Resample, then 4. Create GeoTiff in the writer thread
+            ortho, rectify_time, write_time = rectify_image(bbox, boundary_rows, boundary_cols, image_gsd,
+                                                            record['eo'], reference_height, R,
+                                                            record['focal_length'], pixel_size, image, epsg, dst,
+                                                            interpolation, spans, output_format, tiled,
+                                                            memory_budget, precision, distortion, max_error,
+                                                            dem_window, true_ortho)
+            result = {
+                "filename": filename,
+                "georef_time": round(georef_time, 5),
+                "dem_time": round(dem_time, 5),
+                "rectify_time": round(rectify_time, 5),
+                "write_time": round(write_time, 5)
+            }
+            writes.put((ortho, (bbox, image_gsd, epsg, dst, spans, crop, output_format, compression), result,
+                        image_start_time))
+    finally:
+        writes.put(None)
+        writer.join()
+        for _, _, decode in decodes:  # cancel_futures of shutdown() is only from Python 3.9
+            decode.cancel()
+        decoder.shutdown()
+    if errors:
+        raise errors[0]
+    print('Pipeline - %d images, %.5f seconds' % (len(results), time.time() - start_time))
+
+    print_results(results)
+
+    return output_folder_path
+
+def thread_budget(images, processes=None, threads=None):
+    # Processes and (Numba, OpenCV, GDAL) threads per process that split the cores without oversubscription
+    # By default, processes of 4 threads: a kernel on a small frame does not scale far beyond that
+    cores = os.cpu_count()
+    if processes is None:
+        processes = max(1, min(images, cores // (threads or 4)))
+    if threads is None:
+        threads = max(1, cores // processes)
+    return processes, threads
+
+def footprint_pixels(record, gsd, sensor_width, ground_height):
+    # Estimated size of the orthophoto of a catalog record, from its footprint on the plane - unit: px
+    if gsd == 0:
+        pixel_size = sensor_width / restored_cols((record['rows'], record['cols']), record['orientation']) / 1000
+        gsd = pixel_size * (record['eo'][2] - ground_height) / record['focal_length']
+    bbox = record['bbox']
+    return (bbox[1, 0] - bbox[0, 0]) * (bbox[3, 0] - bbox[2, 0]) / gsd ** 2
+
+# DEM of a worker process, opened once by batch_initializer and shared by its images (and their tile cache)
+batch_dem = None
+
+def batch_initializer(threads, dem=None):
+    # Thread budget of a worker process, and its DEM (a built DEM store, or a loaded DEM)
+    global batch_dem
+    numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
+    cv2.setNumThreads(threads)
+    gdal.SetConfigOption('GDAL_NUM_THREADS', str(threads))
+    batch_dem = open_dem(dem)
+
+def decode_shared(file_path, record, ground_height, sensor_width, gsd, dem):
+    # 1. Decode an image of the catalog into shared memory - the block, its (name, shape, dtype), when its
+    # processing started and the decoding time
+    image, image_start_time, georef_time = decode_stage(file_path, record, ground_height, sensor_width, gsd, dem)
+    block = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+    np.ndarray(image.shape, dtype=image.dtype, buffer=block.buf)[:] = image
+    return block, (block.name, image.shape, image.dtype.str), image_start_time, georef_time
+
+def batch_worker(image_block, file_path, record, output_folder_path, ground_height, sensor_width, epsg, gsd,
+                 interpolation, crop, output_format, precision, distortion, max_error, true_ortho, compression):
+    # 2. Compute DEM & GSD, 3. Rectify & Resample, 4. Create GeoTiff of an image in shared memory, in a worker
+    # The orthophoto is written by the worker, so that it never crosses the process boundary
+    block = shared_memory.SharedMemory(name=image_block[0])
+    try:
+        image = np.ndarray(image_block[1], dtype=image_block[2], buffer=block.buf)
+        filename = os.path.splitext(os.path.basename(file_path))[0]
+        dst = os.path.join(output_folder_path, filename)
+
+        start_time = time.time()
+        R, pixel_size, bbox, reference_height, dem_window, gsd, boundary_rows, boundary_cols, spans = \
+            georeference_record(image, record, ground_height, sensor_width, gsd, distortion, batch_dem, true_ortho)
+        dem_time = time.time() - start_time
+
+        ortho, rectify_time, write_time = rectify_image(bbox, boundary_rows, boundary_cols, gsd, record['eo'],
+                                                        reference_height, R, record['focal_length'], pixel_size,
+                                                        image, epsg, dst, interpolation, spans, output_format,
+                                                        precision=precision, distortion=distortion,
+                                                        max_error=max_error, dem=dem_window, true_ortho=true_ortho)
+        del image   # no view of the block may outlive it
+        write_time = write_image(ortho, bbox, gsd, epsg, dst, spans, crop, output_format, compression)
+        return {"filename": filename, "dem_time": round(dem_time, 5), "rectify_time": round(rectify_time, 5),
+                "write_time": round(write_time, 5)}
+    finally:
+        block.close()
+
+def orthophoto_process_batch(input_folder, ground_height, sensor_width, epsg, gsd, output_folder_path,
+                             interpolation="nearest", crop=False, output_format="GTiff", precision="float64",
+                             distortion=None, max_error=None, dem=None, true_ortho=False, catalog=None, workers=None,
+                             compression="DEFLATE", processes=None, threads=None, queue_size=2, dem_gsd=None):
+    # Batch of images on a process pool, for image-level parallelism on top of the parallel kernels
+    # - the images are decoded in a thread pool and handed to the processes in shared memory
+    # - processes x threads (Numba, OpenCV, GDAL) split the cores, see thread_budget
+    # - the images are processed longest-first, by the estimated size of their orthophotos
+    # dem: a path of a DEM (or a DEM store, dem_gsd of a PLY/OBJ), built here and opened once per process
+    # output_format: GTiff or COG
+    if output_format not in ["GTiff", "COG"]:
+        raise Exception(" * An invalid output format!!! Not GTiff/COG for the batch")
+
+    if not os.path.exists(output_folder_path):
+        os.mkdir(output_folder_path)
+
+    file_paths, records = prescan_folder(input_folder, epsg, ground_height, sensor_width, catalog, workers)
+    order = sorted(range(len(file_paths)), reverse=True,
+                   key=lambda n: footprint_pixels(records[n], gsd, sensor_width, ground_height))
+    processes, threads = thread_budget(len(file_paths), processes, threads)
+    print('Batch - %d processes of %d threads' % (processes, threads))
+
+    decode_dem = open_dem(dem, dem_gsd)
+    worker_dem = decode_dem.path if isinstance(decode_dem, DemStore) else decode_dem
+    results = {}
+    blocks = []     # shared memory of the decoded images, released when their results are collected
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as decoder, \
+            ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                initializer=batch_initializer, initargs=(threads, worker_dem)) as pool:
+        # At most processes + queue_size images decoded ahead, and as many in the processes
+        pending = iter(order)
+        decodes = deque()
+        running = deque()
+        try:
+            while True:
+                for n in itertools.islice(pending, processes + queue_size - len(decodes)):
+                    decodes.append((n, decoder.submit(decode_shared, file_paths[n], records[n], ground_height,
+                                                      sensor_width, gsd, decode_dem)))
+                if not decodes:
+                    break
+                n, decode = decodes.popleft()
+                block, image_block, image_start_time, georef_time = decode.result()
+                blocks.append(block)
+                print('Georeferencing - ' + os.path.basename(file_paths[n]))
+                running.append((n, block, image_start_time, georef_time,
+                                pool.submit(batch_worker, image_block, file_paths[n], records[n], output_folder_path,
+                                            ground_height, sensor_width, epsg, gsd, interpolation, crop,
+                                            output_format, precision, distortion, max_error, true_ortho,
+                                            compression)))
+
+                # Results of the finished images, or of the oldest one when too many are running
+                while running and (running[0][4].done() or len(running) > processes + queue_size or
+                                   not decodes):
+                    n, block, image_start_time, georef_time, future = running.popleft()
+                    result = future.result()
+                    block.close()
+                    block.unlink()
+                    blocks.remove(block)
+                    result["georef_time"] = round(georef_time, 5)
+                    result["processing_time"] = round(time.time() - image_start_time, 5)
+                    results[n] = result
+        finally:
+            for n, decode in decodes:
+                if not decode.cancel() and decode.exception() is None:
+                    blocks.append(decode.result()[0])
+            for block in blocks:
+                block.close()
+                block.unlink()
+    print('Batch - %d images, %.5f seconds' % (len(results), time.time() - start_time))
+
+    results = [results[n] for n in range(len(file_paths))]
+    print_results(results)
+
+    return output_folder_path
+
+def jpeg_complete(file_path):
+    # A JPEG is completely written once it ends with the EOI marker after the start of its scan (SOS)
+    # The segments before it are skipped by their lengths, as an EXIF thumbnail in APP1 ends with its own EOI
+    with open(file_path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return False
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return False
+            if marker[1] == 0xFF:   # fill byte
+                f.seek(-1, os.SEEK_CUR)
+                continue
+            if marker[1] == 0xDA:
+                break
+            length = f.read(2)
+            if len(length) < 2:
+                return False
+            f.seek(struct.unpack('>H', length)[0] - 2, os.SEEK_CUR)
+        scan = f.tell()
+        f.seek(0, os.SEEK_END)
+        if f.tell() < scan + 2:
+            return False
+        f.seek(-2, os.SEEK_END)
+        return f.read(2) == b'\xff\xd9'
+
+def latency_summary(latencies):
+    # p50 and p99 of the end-to-end latencies - unit: s
+    if not latencies:
+        return {"images": 0, "p50": None, "p99": None}
+    return {"images": len(latencies), "p50": round(float(np.percentile(latencies, 50)), 5),
+            "p99": round(float(np.percentile(latencies, 99)), 5)}
+
+def ingest_images(ingest_folder):
+    # Images (.jpg) directly in the ingest folder
+    return [entry for entry in os.scandir(ingest_folder)
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() == '.jpg']
+
+def watch_ingest(ingest_folder, done, ready, stop, poll_interval=0.05, settle_time=1.):
+    # Poll the ingest folder until stop, and queue (arrival, path) of every new image once it is completely written:
+    # once it ends with the EOI marker, or once its size is unchanged for settle_time - unit: s
+    seen = {}   # path: (arrival, size, time of the last size change)
+    while not stop.is_set():
+        now = time.time()
+        for entry in ingest_images(ingest_folder):
+            if entry.path in done:
+                continue
+            size = entry.stat().st_size
+            arrival, previous_size, changed = seen.get(entry.path, (now, -1, now))
+            if size != previous_size:
+                changed = now
+            seen[entry.path] = (arrival, size, changed)
+            if size > 2 and (jpeg_complete(entry.path) or now - changed >= settle_time):
+                ready.put((arrival, entry.path))
+                done.add(entry.path)
+                del seen[entry.path]
+        time.sleep(poll_interval)
+
+def orthophoto_process_watch(ingest_folder, ground_height, sensor_width, epsg, gsd, output_folder_path,
+                             interpolation="nearest", crop=False, output_format="GTiff", precision="float64",
+                             distortion=None, max_error=None, dem=None, true_ortho=False, compression="DEFLATE",
+                             latency_log=None, include_existing=False, poll_interval=0.05, settle_time=1.,
+                             idle_timeout=None, stop_event=None, dem_gsd=None):
+    # Watch an ingest folder (e.g. of a drone downlink or an SD-card sync) and process every new image as it lands
+    # - the folder is polled in a thread, so that the arrivals are timed while an image is processed
+    # - a latency record is appended to latency_log (latency.jsonl in the output folder by default) for every
+    #   image: its arrival, ready and done times and its end-to-end latency from arrival to the orthophoto on disk
+    # - until stop_event is set, or for idle_timeout without new images (unit: s) - watches forever by default
+    # include_existing: also process the images already in the folder when the watch starts
+    # Returns the number of images and the p50/p99 of their latencies
+    dem = open_dem(dem, dem_gsd)
+
+    if not os.path.exists(output_folder_path):
+        os.mkdir(output_folder_path)
+    if latency_log is None:
+        latency_log = os.path.join(output_folder_path, 'latency.jsonl')
+
+    done = set() if include_existing else set(entry.path for entry in ingest_images(ingest_folder))
+    ready = queue.Queue()
+    stop = threading.Event()
+    watcher = threading.Thread(target=watch_ingest, args=(ingest_folder, done, ready, stop, poll_interval,
+                                                         settle_time), daemon=True)
+    watcher.start()
+
+    latencies = []
+    idle_time = time.time()
+    try:
+        with open(latency_log, 'a') as log:
+            while not (stop_event is not None and stop_event.is_set()):
+                try:
+                    arrival, file_path = ready.get(timeout=poll_interval)
+                except queue.Empty:
+                    if idle_timeout is not None and time.time() - idle_time >= idle_timeout:
+                        break
+                    continue
+
+                ready_time = time.time()
+                file = os.path.basename(file_path)
+                filename = os.path.splitext(file)[0]
+                dst = os.path.join(output_folder_path, filename)
+                print('Georeferencing - ' + file)
+                record = {"filename": filename, "arrival": round(arrival, 5), "ready": round(ready_time, 5)}
+                try:
+                    # 1. Georeferencing, 2. Compute DEM & GSD, 3. Rectify & Resample, 4. Create GeoTiff
+                    image_record = scan_image(file_path, epsg)
+                    image, _, georef_time = decode_stage(file_path, image_record, ground_height, sensor_width,
+                                                         gsd, dem)
+                    start_time = time.time()
+                    R, pixel_size, bbox, reference_height, dem_window, image_gsd, boundary_rows, boundary_cols, \
+                        spans = georeference_record(image, image_record, ground_height, sensor_width, gsd,
+                                                    distortion, dem, true_ortho)
+                    dem_time = time.time() - start_time
+                    rectify_time, write_time = rectify_and_write(bbox, boundary_rows, boundary_cols, image_gsd,
+                                                                 image_record['eo'], reference_height, R,
+                                                                 image_record['focal_length'], pixel_size, image,
+                                                                 epsg, dst, interpolation, spans, crop,
+                                                                 output_format, precision=precision,
+                                                                 distortion=distortion, max_error=max_error,
+                                                                 dem=dem_window, true_ortho=true_ortho,
+                                                                 compression=compression)
+                    done_time = time.time()
+                    record.update({"done": round(done_time, 5), "latency": round(done_time - arrival, 5),
+                                   "georef_time": round(georef_time, 5), "dem_time": round(dem_time, 5),
+                                   "rectify_time": round(rectify_time, 5), "write_time": round(write_time, 5)})
+                    latencies.append(done_time - arrival)
+                except Exception as e:  # a broken image must not stop the watch
+                    record["error"] = str(e)
+                log.write(json.dumps(record) + '\n')
+                log.flush()
+                idle_time = time.time()
+    finally:
+        stop.set()
+        watcher.join()
+
+    summary = latency_summary(latencies)
+    print('Watch - %d images, latency p50 %s s, p99 %s s' % (summary["images"], summary["p50"], summary["p99"]))
+    return summary
+
+def orthophoto_process_video(video_path, telemetry_path, ground_height, sensor_width, focal_length, epsg, gsd,
+                             output_folder_path, step=1, tag="DJI", interpolation="nearest", crop=False,
+                             output_format="GTiff", precision="float64", distortion=None, max_error=None, dem=None,
+                             true_ortho=False, compression="DEFLATE", gimbal=None, time_offset=0., temporal=None,
+                             dem_gsd=None):
+    # Orthophotos of every step-th frame of a drone video, with the poses interpolated from its telemetry
+    # (DJI SRT, or CSV flight log), see module.Video - the frames are streamed, never held as a whole video
+    # sensor_width: of the video frames - unit: mm, focal_length - unit: m
+    # gimbal: (roll, pitch, yaw) for a telemetry without gimbal angles - unit: deg
+    # temporal: (position - unit: m, rotation - unit: deg) tolerance of the pose between frames, to keep the control
+    # grid of the approximate mapping between them (see MappingCache) - the orthophotos are then on its grid,
+    # of the GSD of the first frame if gsd is 0
+    dem = open_dem(dem, dem_gsd)
+    mapping_cache = None
+    if temporal is not None:
+        if true_ortho:
+            raise Exception(" * An invalid temporal coherence!!! Not the approximate mapping of a true orthophoto")
+        mapping_cache = MappingCache(tolerance=(temporal[0], np.radians(temporal[1])))
+        max_error = 0.125 if max_error is None else max_error
+
+    if not os.path.exists(output_folder_path):
+        os.mkdir(output_folder_path)
+
+    telemetry = read_telemetry(telemetry_path, gimbal)
+    name = os.path.splitext(os.path.basename(video_path))[0]
+
+    results = []
+    start_time = time.time()
+    frames = video_poses(video_path, telemetry, step, time_offset)
+    while True:
+        image_start_time = time.time()
+        frame = next(frames, None)
+        if frame is None:
+            break
+        index, frame_time, image, pose = frame
+        filename = '%s_%06d' % (name, index)
+        dst = os.path.join(output_folder_path, filename)
+        print('Georeferencing - %s (%.3f s)' % (filename, frame_time))
+
+        # 1. Georeferencing of the interpolated pose
+        eo = geographic2plane(pose, epsg)
+        eo[3:] = rpy_to_opk(eo[3:], tag) * np.pi / 180
+        R = Rot3D(eo)
+
+        pixel_size = sensor_width / image.shape[1]  # Convert from mm to m
+        pixel_size /= 1000
+
+        georef_time = time.time() - image_start_time
+
+        # 2. Compute DEM & GSD
+        dem_start_time = time.time()
+        polygon, bbox, reference_height, dem_window = ground_footprint(image, eo, R, ground_height, pixel_size,
+                                                                       focal_length, distortion, dem, true_ortho)
+        frame_gsd = gsd
+        if frame_gsd == 0:
+            frame_gsd = (pixel_size * (eo[2] - reference_height)) / focal_length
+            if mapping_cache is not None:
+                gsd = frame_gsd
+        if mapping_cache is not None:
+            bbox = snap_boundary(bbox, frame_gsd, mapping_cache.step)
+            boundary_cols = int(round((bbox[1, 0] - bbox[0, 0]) / frame_gsd))
+            boundary_rows = int(round((bbox[3, 0] - bbox[2, 0]) / frame_gsd))
+        else:
+            boundary_cols = int((bbox[1, 0] - bbox[0, 0]) / frame_gsd)
+            boundary_rows = int((bbox[3, 0] - bbox[2, 0]) / frame_gsd)
+        spans = footprint_spans(polygon, bbox, boundary_rows, boundary_cols, frame_gsd)
+        dem_time = time.time() - dem_start_time
+
+        # 3. Rectify & Resample, 4. Create GeoTiff
+        rectify_time, write_time = rectify_and_write(bbox, boundary_rows, boundary_cols, frame_gsd, eo,
+                                                     reference_height, R, focal_length, pixel_size, image, epsg,
+                                                     dst, interpolation, spans, crop, output_format,
+                                                     precision=precision, distortion=distortion,
+                                                     max_error=max_error, dem=dem_window, true_ortho=true_ortho,
+                                                     compression=compression, mapping_cache=mapping_cache)
+
+        results.append({
+            "filename": filename,
+            "georef_time": round(georef_time, 5),
+            "dem_time": round(dem_time, 5),
+            "rectify_time": round(rectify_time, 5),
+            "write_time": round(write_time, 5),
+            "processing_time": round(time.time() - image_start_time, 5)
+        })
+
+    processing_time = time.time() - start_time
+    print('Video - %d frames, %.5f seconds, %.2f frames/s' % (len(results), processing_time,
+                                                             len(results) / max(processing_time, 1e-9)))
+    if mapping_cache is not None:
+        print('Mapping cache - %d full, %d incremental frames' % (mapping_cache.frames["full"],
+                                                                  mapping_cache.frames["incremental"]))
+    print_results(results)
+
     return output_folder_path
 
-def orthophoto_process_single_image(image_path, ground_height, sensor_width, epsg, gsd, output_folder_path):
+def orthophoto_process_single_image(image_path, ground_height, sensor_width, epsg, gsd, output_folder_path,
+                                    interpolation="nearest", crop=False, output_format="GTiff", tiled=False,
+                                    memory_budget=None, precision="float64", distortion=None, max_error=None,
+                                    dem=None, true_ortho=False, image_name=None, compression="DEFLATE",
+                                    dem_gsd=None):
     console = Console()
+
+    dem = open_dem(dem, dem_gsd)
     
     # Check if output_folder_path exists, if not, create it
     if not os.path.exists(output_folder_path):
@@ -117,58 +682,50 @@ def orthophoto_process_single_image(image_path, ground_height, sensor_width, eps
 
     results = []
 
-    filename = os.path.splitext(os.path.basename(image_path))[0]
+    # image_path: a path, or an in-memory buffer of the image (e.g. an upload) with its image_name ("image" by default)
+    if image_name is None:
+        image_name = image_path if isinstance(image_path, str) else "image"
+    filename = os.path.splitext(os.path.basename(image_name))[0]
     dst = os.path.join(output_folder_path, filename)
     
-    print('Georeferencing - ' + image_path)
+    print('Georeferencing - ' + image_name)
     image_start_time = time.time()
-    image = cv2.imread(image_path, -1)
 
     # 1. Extract metadata from the image
     start_time = time.time()
     focal_length, orientation, eo, maker = get_metadata(image_path)
-    restored_image = restoreOrientation(image, orientation)
-
-    image_rows = restored_image.shape[0]
-    image_cols = restored_image.shape[1]
+    image = decode_image(image_path, orientation, eo, ground_height, sensor_width, focal_length, gsd, dem)
 
-    pixel_size = sensor_width / image_cols  # Convert from mm to m
+    pixel_size = sensor_width / restored_cols(image.shape, orientation)  # Convert from mm to m
     pixel_size /= 1000
 
     eo = geographic2plane(eo, epsg)
     opk = rpy_to_opk(eo[3:], maker)
     eo[3:] = opk * np.pi / 180
-    R = Rot3D(eo)
+    R = orientation_rotation(orientation) @ Rot3D(eo)    # the image is sampled as stored
 
     georef_time = time.time() - start_time
 
     # 2. Compute DEM & GSD
     print('DEM & GSD')
     start_time = time.time()
-    bbox = boundary(restored_image, eo, R, ground_height, pixel_size, focal_length)
+    polygon, bbox, ground_height, dem = ground_footprint(image, eo, R, ground_height, pixel_size,
+                                                         focal_length, distortion, dem, true_ortho)
     
     if gsd == 0:
         gsd = (pixel_size * (eo[2] - ground_height)) / focal_length
     
     boundary_cols = int((bbox[1, 0] - bbox[0, 0]) / gsd)
     boundary_rows = int((bbox[3, 0] - bbox[2, 0]) / gsd)
+    spans = footprint_spans(polygon, bbox, boundary_rows, boundary_cols, gsd)
 
     dem_time = time.time() - start_time
 
-    # 3. Rectify & Resample
-    print('Rectify & Resampling')
-    start_time = time.time()
-    b, g, r, a = rectify_plane_parallel(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height,
-                                        R, focal_length, pixel_size, image)
-    rectify_time = time.time() - start_time
-
-    # 4. Create GeoTiff
-    print('Save the image in GeoTiff')
-    start_time = time.time()
-
-    createGeoTiff(b, g, r, a, bbox, gsd, epsg, boundary_rows, boundary_cols, dst)
-
-    write_time = time.time() - start_time
+    # 3. Rectify & Resample, 4. Create GeoTiff
+    rectify_time, write_time = rectify_and_write(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height,
+                                                 R, focal_length, pixel_size, image, epsg, dst,
+                                                 interpolation, spans, crop, output_format, tiled, memory_budget,
+                                                 precision, distortion, max_error, dem, true_ortho, compression)
 
     processing_time = time.time() - image_start_time
 
@@ -238,26 +795,35 @@ def rpy_to_opk(rpy, tag="DJI"):
         raise Exception(" * An invalid type of hostname!!! Not DJI/SUNLIGHT/VTOL")
 
 def orthophoto_process_custom_input(image_path, longitude, latitude, altitude, focal_length_input, roll, pitch, yaw, 
-                                    ground_height, sensor_width, epsg, gsd, output_folder_path, tag="DJI"):
+                                    ground_height, sensor_width, epsg, gsd, output_folder_path, tag="DJI",
+                                    interpolation="nearest", crop=False, output_format="GTiff", tiled=False,
+                                    memory_budget=None, precision="float64", distortion=None, max_error=None,
+                                    dem=None, true_ortho=False, image_name=None, compression="DEFLATE",
+                                    dem_gsd=None):
     console = Console()
 
+    dem = open_dem(dem, dem_gsd)
+
     if not os.path.exists(output_folder_path):
         os.mkdir(output_folder_path)
 
     results = []
 
-    filename = os.path.splitext(os.path.basename(image_path))[0]
+    # image_path: a path, or an in-memory buffer of the image (e.g. an upload) with its image_name ("image" by default)
+    if image_name is None:
+        image_name = image_path if isinstance(image_path, str) else "image"
+    filename = os.path.splitext(os.path.basename(image_name))[0]
     dst = os.path.join(output_folder_path, filename)
     
-    print('Georeferencing - ' + image_path)
+    print('Georeferencing - ' + image_name)
     image_start_time = time.time()
-    image = cv2.imread(image_path, -1)
 
     omega, phi, kappa = rpy_to_opk(np.array([roll, pitch, yaw]), tag)
 
     eo = np.array([longitude, latitude, altitude, omega, phi, kappa])
     eo[3:] *= np.pi / 180
     R = Rot3D(eo)
+    image = decode_image(image_path, 1, eo, ground_height, sensor_width, focal_length_input, gsd, dem)
 
     image_rows = image.shape[0]
     image_cols = image.shape[1]
@@ -268,25 +834,22 @@ def orthophoto_process_custom_input(image_path, longitude, latitude, altitude, f
 
     print('DEM & GSD')
     start_time = time.time()
-    bbox = boundary(image, eo, R, ground_height, pixel_size, focal_length_input)
+    polygon, bbox, ground_height, dem = ground_footprint(image, eo, R, ground_height, pixel_size,
+                                                         focal_length_input, distortion, dem, true_ortho)
     if gsd == 0:
         gsd = (pixel_size * (eo[2] - ground_height)) / focal_length_input
     boundary_cols = int((bbox[1, 0] - bbox[0, 0]) / gsd)
     boundary_rows = int((bbox[3, 0] - bbox[2, 0]) / gsd)
+    spans = footprint_spans(polygon, bbox, boundary_rows, boundary_cols, gsd)
     dem_time = time.time() - start_time
 
-    print('Rectify & Resampling')
-    start_time = time.time()
-    b, g, r, a = rectify_plane_parallel(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length_input, pixel_size, image)
-    rectify_time = time.time() - start_time
     print(f"Destination: {dst}")
     print(f"Rows: {boundary_rows}, Cols: {boundary_cols}")
-    print('Save the image in GeoTiff')
     print(f"bbox: {bbox}, gsd: {gsd}, epsg: {epsg}")
-    start_time = time.time()
-    createGeoTiff(b, g, r, a, bbox, gsd, epsg, boundary_rows, boundary_cols, dst)
-
-    write_time = time.time() - start_time
+    rectify_time, write_time = rectify_and_write(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height,
+                                                 R, focal_length_input, pixel_size, image, epsg, dst,
+                                                 interpolation, spans, crop, output_format, tiled, memory_budget,
+                                                 precision, distortion, max_error, dem, true_ortho, compression)
 
     processing_time = time.time() - image_start_time
     results.append({
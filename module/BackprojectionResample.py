@@ -2,10 +2,115 @@ import numpy as np
 from numba import jit, prange
 from osgeo import gdal, osr
 import cv2
+import time
+import itertools
+from functools import lru_cache
+from module.Boundary import footprint_window
+from module.Distortion import lens_distortion, distortion_lut, distort
+from module.Dem import dem_height, ray_dem
+from module.Occlusion import occlusion_zbuffer, visible
 
+# Resampling methods of the kernels
+INTERPOLATION = {"nearest": 0, "bilinear": 1, "bicubic": 2, "area": 3}
+# ... and their OpenCV counterparts for the homography backend (no area for warps)
+INTERPOLATION_CV2 = {"nearest": cv2.INTER_NEAREST, "bilinear": cv2.INTER_LINEAR, "bicubic": cv2.INTER_CUBIC}
+# Compressions of the Cloud-Optimized GeoTIFF output and their creation options (JPEG/WEBP: uint8 only)
+COG_COMPRESSION = {"JPEG": ['COMPRESS=JPEG', 'QUALITY=90'], "WEBP": ['COMPRESS=WEBP', 'QUALITY=90'],
+                   "DEFLATE": ['COMPRESS=DEFLATE', 'PREDICTOR=YES'], "ZSTD": ['COMPRESS=ZSTD', 'PREDICTOR=YES'],
+                   "LZW": ['COMPRESS=LZW', 'PREDICTOR=YES']}
+# Data types of the images (and orthophotos) and their GDAL counterparts
+GDAL_TYPES = {np.dtype(np.uint8): gdal.GDT_Byte, np.dtype(np.uint16): gdal.GDT_UInt16,
+              np.dtype(np.float32): gdal.GDT_Float32}
 
-@jit(nopython=True, parallel=True)
-def rectify_plane_parallel(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size, image):
+
+@jit(nopython=True, cache=True)
+def cubic_weight(t):
+    # Keys kernel with a = -0.75, the same as OpenCV
+    t = abs(t)
+    if t < 1.:
+        return (1.25 * t - 2.25) * t * t + 1.
+    elif t < 2.:
+        return ((-0.75 * t + 3.75) * t - 6.) * t + 3.
+    return 0.
+
+@jit(nopython=True, cache=True)
+def interpolate(image, x, y, band, interpolation, area_size):
+    # (x, y): continuous image coordinates, pixel (row, col) covers [col, col + 1) x [row, row + 1)
+    rows = image.shape[0]
+    cols = image.shape[1]
+
+    if interpolation == 0:      # Nearest Neighbor
+        return float(image[int(y), int(x), band])
+
+    elif interpolation == 1:    # Bilinear
+        xs = x - 0.5
+        ys = y - 0.5
+        col0 = int(np.floor(xs))
+        row0 = int(np.floor(ys))
+        dx = xs - col0
+        dy = ys - row0
+        c0 = min(max(col0, 0), cols - 1)
+        c1 = min(max(col0 + 1, 0), cols - 1)
+        r0 = min(max(row0, 0), rows - 1)
+        r1 = min(max(row0 + 1, 0), rows - 1)
+        top = (1 - dx) * image[r0, c0, band] + dx * image[r0, c1, band]
+        bottom = (1 - dx) * image[r1, c0, band] + dx * image[r1, c1, band]
+        return (1 - dy) * top + dy * bottom
+
+    elif interpolation == 2:    # Bicubic
+        xs = x - 0.5
+        ys = y - 0.5
+        col0 = int(np.floor(xs))
+        row0 = int(np.floor(ys))
+        dx = xs - col0
+        dy = ys - row0
+        value = 0.
+        for i in range(-1, 3):
+            r = min(max(row0 + i, 0), rows - 1)
+            wy = cubic_weight(i - dy)
+            for j in range(-1, 3):
+                c = min(max(col0 + j, 0), cols - 1)
+                value += wy * cubic_weight(j - dx) * image[r, c, band]
+        return value
+
+    else:                       # Area - mean of the source pixels under the output pixel
+        half = area_size / 2
+        c0 = max(int(x - half), 0)
+        c1 = min(int(x + half), cols - 1)
+        r0 = max(int(y - half), 0)
+        r1 = min(int(y + half), rows - 1)
+        value = 0.
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                value += image[r, c, band]
+        return value / ((r1 - r0 + 1) * (c1 - c0 + 1))
+
+@jit(nopython=True, cache=True)
+def saturate_uint8(value):
+    return np.uint8(min(max(value + 0.5, 0.), 255.))
+
+@jit(nopython=True, cache=True)
+def saturate(value, value_range):
+    # value_range: (min, max, rounding) of the output data type, see band_range()
+    return min(max(value + value_range[2], value_range[0]), value_range[1])
+
+def band_range(dtype):
+    # Alpha (opaque) value and the value range of an output data type
+    # Integers are rounded and saturated, floats are kept as they are
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return dtype.type(info.max), np.array([info.min, info.max, 0.5])
+    return dtype.type(1.), np.array([-np.inf, np.inf, 0.])
+
+def area_size_plane(gsd, eo, ground_height, focal_length, pixel_size):
+    # Source pixels per output pixel along a side, at the principal point
+    return max(gsd / (pixel_size * (eo[2] - ground_height) / focal_length), 1.)
+
+
+@jit(nopython=True, parallel=True, cache=True, nogil=True)
+def rectify_plane_parallel(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size,
+                           image, band_map, alpha, value_range, interpolation=0, area_size=1., spans=None, out=None,
+                           lut=None, lut_grid=None):
     # 1. projection
     proj_coords_x = 0.
     proj_coords_y = 0.
@@ -23,14 +128,22 @@ def rectify_plane_parallel(boundary, boundary_rows, boundary_cols, gsd, eo, grou
     # 3. resample
     coord_ICS_col = 0
     coord_ICS_row = 0
-    # Define channels of an orthophoto
-    b = np.zeros(shape=(boundary_rows, boundary_cols), dtype=np.uint8)
-    g = np.zeros(shape=(boundary_rows, boundary_cols), dtype=np.uint8)
-    r = np.zeros(shape=(boundary_rows, boundary_cols), dtype=np.uint8)
-    a = np.zeros(shape=(boundary_rows, boundary_cols), dtype=np.uint8)
+    # Define an orthophoto - pixel-interleaved bands of band_map (source band per output band) + alpha,
+    # in the data type of the image. A given buffer (e.g. memory-mapped output file) has to be zero-filled
+    if out is None:
+        ortho = np.zeros(shape=(boundary_rows, boundary_cols, band_map.shape[0] + 1), dtype=image.dtype)
+    else:
+        ortho = out
 
     for row in prange(boundary_rows):
-        for col in range(boundary_cols):
+        # Only the pixels in the footprint, if spans are given
+        col_start = 0
+        col_end = boundary_cols
+        if spans is not None:
+            col_start = spans[row, 0]
+            col_end = spans[row, 1]
+
+        for col in range(col_start, col_end):
             # 1. projection
             proj_coords_x = boundary[0, 0] + col * gsd - eo[0]
             proj_coords_y = boundary[3, 0] - row * gsd - eo[1]
@@ -50,24 +163,772 @@ def rectify_plane_parallel(boundary, boundary_rows, boundary_cols, gsd, eo, grou
             coord_CCS_px_y = -plane_coord_CCS_y / pixel_size
 
             # 3. resample
-            # Nearest Neighbor
-            coord_ICS_col = int(image.shape[1] / 2 + coord_CCS_px_x)  # column
-            coord_ICS_row = int(image.shape[0] / 2 + coord_CCS_px_y)  # row
+            coord_ICS_x = image.shape[1] / 2 + coord_CCS_px_x  # column
+            coord_ICS_y = image.shape[0] / 2 + coord_CCS_px_y  # row
+            if lut is not None:
+                # Lens distortion, see distortion_lut()
+                coord_ICS_x, coord_ICS_y = distort(lut, lut_grid, coord_ICS_x, coord_ICS_y)
+            coord_ICS_col = int(coord_ICS_x)
+            coord_ICS_row = int(coord_ICS_y)
 
             if coord_ICS_col < 0 or coord_ICS_col >= image.shape[1]:      # column
                 continue
             elif coord_ICS_row < 0 or coord_ICS_row >= image.shape[0]:    # row
                 continue
+            elif interpolation == 0:
+                # Nearest Neighbor - every band at the same mapping, in the output order (e.g. BGR to RGB)
+                for k in range(band_map.shape[0]):
+                    ortho[row, col, k] = image[coord_ICS_row, coord_ICS_col, band_map[k]]
+                ortho[row, col, band_map.shape[0]] = alpha
             else:
-                b[row, col] = image[coord_ICS_row, coord_ICS_col][0]
-                g[row, col] = image[coord_ICS_row, coord_ICS_col][1]
-                r[row, col] = image[coord_ICS_row, coord_ICS_col][2]
-                a[row, col] = 255
+                for k in range(band_map.shape[0]):
+                    ortho[row, col, k] = saturate(interpolate(image, coord_ICS_x, coord_ICS_y, band_map[k],
+                                                              interpolation, area_size), value_range)
+                ortho[row, col, band_map.shape[0]] = alpha
 
-    return b, g, r, a
+    return ortho
+
+
+@jit(nopython=True, parallel=True, cache=True, nogil=True)
+def rectify_plane_parallel_f32(origin, boundary_rows, boundary_cols, gsd, R, focal_px, image, band_map, alpha,
+                               value_range, interpolation=0, area_size=1., spans=None, out=None, lut=None,
+                               lut_grid=None):
+    # Single precision version of rectify_plane_parallel
+    # Coordinates are relative to a local origin - (X min, Y max, ground height) minus the perspective center,
+    # which keeps them small enough for float32, see local_origin()
+    # origin, gsd, R, focal_px(= focal_length / pixel_size): float32
+    half_cols = np.float32(image.shape[1] / 2)
+    half_rows = np.float32(image.shape[0] / 2)
+
+    if out is None:
+        ortho = np.zeros(shape=(boundary_rows, boundary_cols, band_map.shape[0] + 1), dtype=image.dtype)
+    else:
+        ortho = out
+
+    for row in prange(boundary_rows):
+        col_start = 0
+        col_end = boundary_cols
+        if spans is not None:
+            col_start = spans[row, 0]
+            col_end = spans[row, 1]
+
+        # 1. projection - unit: m
+        proj_coords_y = origin[1] - np.float32(row) * gsd
+        proj_coords_z = origin[2]
+
+        for col in range(col_start, col_end):
+            proj_coords_x = origin[0] + np.float32(col) * gsd
+
+            # 2. back-projection - unit: m
+            coord_CCS_m_x = R[0, 0] * proj_coords_x + R[0, 1] * proj_coords_y + R[0, 2] * proj_coords_z
+            coord_CCS_m_y = R[1, 0] * proj_coords_x + R[1, 1] * proj_coords_y + R[1, 2] * proj_coords_z
+            coord_CCS_m_z = R[2, 0] * proj_coords_x + R[2, 1] * proj_coords_y + R[2, 2] * proj_coords_z
+
+            # Convert CCS to Pixel Coordinate System - unit: px
+            scale = focal_px / coord_CCS_m_z
+            coord_ICS_x = half_cols - coord_CCS_m_x * scale  # column
+            coord_ICS_y = half_rows + coord_CCS_m_y * scale  # row
+            if lut is not None:
+                coord_ICS_x, coord_ICS_y = distort(lut, lut_grid, coord_ICS_x, coord_ICS_y)
+            coord_ICS_col = int(coord_ICS_x)
+            coord_ICS_row = int(coord_ICS_y)
+
+            # 3. resample
+            if coord_ICS_col < 0 or coord_ICS_col >= image.shape[1]:      # column
+                continue
+            elif coord_ICS_row < 0 or coord_ICS_row >= image.shape[0]:    # row
+                continue
+            elif interpolation == 0:
+                # Nearest Neighbor - every band at the same mapping, in the output order (e.g. BGR to RGB)
+                for k in range(band_map.shape[0]):
+                    ortho[row, col, k] = image[coord_ICS_row, coord_ICS_col, band_map[k]]
+                ortho[row, col, band_map.shape[0]] = alpha
+            else:
+                for k in range(band_map.shape[0]):
+                    ortho[row, col, k] = saturate(interpolate(image, coord_ICS_x, coord_ICS_y, band_map[k],
+                                                              interpolation, area_size), value_range)
+                ortho[row, col, band_map.shape[0]] = alpha
+
+    return ortho
+
+def local_origin(boundary, eo, ground_height):
+    # Upper-left corner of the orthophoto relative to the perspective center, in float64 before rounding to float32
+    return np.array([boundary[0, 0] - eo[0], boundary[3, 0] - eo[1], ground_height - eo[2]], dtype=np.float32)
+
+
+@jit(nopython=True, cache=True, inline='always')
+def project_camera(proj_coords_x, proj_coords_y, proj_coords_z, R, focal_length, pixel_size, image_rows, image_cols):
+    # Ground coordinates relative to the perspective center - unit: m -> pinhole image coordinates - unit: px,
+    # and the camera z - unit: m
+    coord_CCS_m_x = R[0, 0] * proj_coords_x + R[0, 1] * proj_coords_y + R[0, 2] * proj_coords_z
+    coord_CCS_m_y = R[1, 0] * proj_coords_x + R[1, 1] * proj_coords_y + R[1, 2] * proj_coords_z
+    coord_CCS_m_z = R[2, 0] * proj_coords_x + R[2, 1] * proj_coords_y + R[2, 2] * proj_coords_z
+
+    scale = coord_CCS_m_z / (-focal_length)
+    return (image_cols / 2 + coord_CCS_m_x / scale / pixel_size, image_rows / 2 - coord_CCS_m_y / scale / pixel_size,
+            coord_CCS_m_z)
+
+@jit(nopython=True, cache=True, inline='always')
+def map_ground(row, col, boundary, gsd, eo, ground_height, R, focal_length, pixel_size, image_rows, image_cols,
+               lut=None, lut_grid=None, dem=None, dem_geotransform=None, zbuffer=None, zbuffer_grid=None):
+    # Ground-to-image mapping of an output pixel, the same as in rectify_plane_parallel - unit: px
+    # The ground height comes from the DEM if given, the plane of ground_height otherwise
+    # Ground points hidden behind the Z-buffer, if given, map to (-1, -1) - see module.Occlusion
+    proj_coords_x = boundary[0, 0] + col * gsd
+    proj_coords_y = boundary[3, 0] - row * gsd
+    if dem is not None:
+        proj_coords_z = dem_height(dem, dem_geotransform, proj_coords_x, proj_coords_y) - eo[2]
+    else:
+        proj_coords_z = ground_height - eo[2]
+    coord_ICS_x, coord_ICS_y, coord_CCS_m_z = project_camera(proj_coords_x - eo[0], proj_coords_y - eo[1],
+                                                              proj_coords_z, R, focal_length, pixel_size,
+                                                              image_rows, image_cols)
+    if zbuffer is not None and not visible(zbuffer, zbuffer_grid, coord_ICS_x, coord_ICS_y, -coord_CCS_m_z):
+        return -1., -1.
+    if lut is not None:
+        coord_ICS_x, coord_ICS_y = distort(lut, lut_grid, coord_ICS_x, coord_ICS_y)
+    return coord_ICS_x, coord_ICS_y
+
+@jit(nopython=True, cache=True, inline='always')
+def sample(ortho, row, col, image, x, y, band_map, alpha, value_range, interpolation, area_size):
+    # Resample every band of the image at (x, y) into the pixel (row, col) of the orthophoto
+    if int(x) < 0 or int(x) >= image.shape[1] or int(y) < 0 or int(y) >= image.shape[0]:
+        return
+    if interpolation == 0:
+        for k in range(band_map.shape[0]):
+            ortho[row, col, k] = image[int(y), int(x), band_map[k]]
+    else:
+        for k in range(band_map.shape[0]):
+            ortho[row, col, k] = saturate(interpolate(image, x, y, band_map[k], interpolation, area_size),
+                                          value_range)
+    ortho[row, col, band_map.shape[0]] = alpha
+
+@jit(nopython=True, cache=True, inline='always')
+def bilinear_cell(coords, r0, c0, size, corner_x, corner_y):
+    # Bilinear interpolation of the corners (upper left, upper right, lower left, lower right) into
+    # coords[r0:r0 + size, c0:c0 + size], incrementally along the rows
+    for i in range(size):
+        v = i / size
+        x = (1 - v) * corner_x[0] + v * corner_x[2]
+        y = (1 - v) * corner_y[0] + v * corner_y[2]
+        dx = ((1 - v) * corner_x[1] + v * corner_x[3] - x) / size
+        dy = ((1 - v) * corner_y[1] + v * corner_y[3] - y) / size
+        for j in range(size):
+            coords[r0 + i, c0 + j, 0] = x
+            coords[r0 + i, c0 + j, 1] = y
+            x += dx
+            y += dy
+
+@jit(nopython=True, cache=True, inline='always')
+def dem_lines(boundary_origin, gsd, dem_origin, dem_spacing, start, size):
+    # The first and the spacing of the lines through the centers of the DEM pixels, along one axis of the cell
+    # [start, start + size) of the orthophoto, and their number inside it - unit: px (of the cell)
+    spacing = abs(dem_spacing) / gsd
+    first = (dem_origin + 0.5 * dem_spacing - boundary_origin) / gsd - start
+    first -= np.floor(first / spacing) * spacing
+    if first == 0.:
+        first = spacing
+    return first, spacing, max(int(np.ceil((size - first) / spacing)), 0)
+
+@jit(nopython=True, cache=True)
+def dem_error(row, col, size, corner_x, corner_y, boundary, gsd, eo, ground_height, R, focal_length, pixel_size,
+              image_rows, image_cols, lut, lut_grid, dem, dem_geotransform):
+    # Largest error of the bilinear interpolation of the corners at the corners of the DEM patches in the cell:
+    # the nodes of the DEM inside it and the crossings of its edges by the lines between them - unit: px
+    # The heights are bilinear in every patch, so are their errors, whose extremes are at these corners
+    # A DEM denser than 4 px leaves the cell to be split (inf)
+    first_u, spacing_u, lines_u = dem_lines(boundary[0, 0], gsd, dem_geotransform[0], dem_geotransform[1], col, size)
+    first_v, spacing_v, lines_v = dem_lines(-boundary[3, 0], gsd, -dem_geotransform[3], -dem_geotransform[5], row,
+                                            size)
+    if 4 * lines_u > size or 4 * lines_v > size:
+        return np.inf
+
+    error = 0.
+    for i in range(lines_v + 2):
+        v = 0. if i == 0 else (size if i == lines_v + 1 else first_v + (i - 1) * spacing_v)
+        for j in range(lines_u + 2):
+            u = 0. if j == 0 else (size if j == lines_u + 1 else first_u + (j - 1) * spacing_u)
+            if (i == 0 or i == lines_v + 1) and (j == 0 or j == lines_u + 1):
+                continue    # the corners of the cell
+            x, y = map_ground(row + v, col + u, boundary, gsd, eo, ground_height, R, focal_length, pixel_size,
+                              image_rows, image_cols, lut, lut_grid, dem, dem_geotransform)
+            u_cell = u / size
+            v_cell = v / size
+            x_approx = (1 - v_cell) * ((1 - u_cell) * corner_x[0] + u_cell * corner_x[1]) + \
+                       v_cell * ((1 - u_cell) * corner_x[2] + u_cell * corner_x[3])
+            y_approx = (1 - v_cell) * ((1 - u_cell) * corner_y[0] + u_cell * corner_y[1]) + \
+                       v_cell * ((1 - u_cell) * corner_y[2] + u_cell * corner_y[3])
+            error = max(error, abs(x - x_approx), abs(y - y_approx))
+    return error
+
+@jit(nopython=True, cache=True)
+def approx_cell(coords, stack, row0, col0, step, max_error, boundary, gsd, eo, ground_height, R, focal_length,
+                pixel_size, image_rows, image_cols, lut=None, lut_grid=None, dem=None, dem_geotransform=None):
+    # Source coordinates of the cell [row0, row0 + step) x [col0, col0 + step) into coords[0:step, 0:step]
+    # The exact mapping is computed at the corners and interpolated bilinearly in between, if the error
+    # at the center and the midpoints of the edges is within max_error - unit: px
+    # With a DEM, also at the corners of the DEM patches in the cell, where its bilinear heights bend (see
+    # dem_error()): the error is then bounded up to the perspective and the lens distortion, smooth over a cell
+    # Otherwise the cell is split into four, down to cells of 4 px, which are mapped exactly
+    # stack: work space of at least (3 x log2(step) + 1) x 3
+    stack[0, 0] = 0
+    stack[0, 1] = 0
+    stack[0, 2] = step
+    top = 1
+    corner_x = np.empty(4)
+    corner_y = np.empty(4)
+    while top > 0:
+        top -= 1
+        r0 = stack[top, 0]
+        c0 = stack[top, 1]
+        size = stack[top, 2]
+
+        if size <= 4:
+            for i in range(size):
+                for j in range(size):
+                    coords[r0 + i, c0 + j, 0], coords[r0 + i, c0 + j, 1] = \
+                        map_ground(row0 + r0 + i, col0 + c0 + j, boundary, gsd, eo, ground_height, R, focal_length,
+                                   pixel_size, image_rows, image_cols, lut, lut_grid, dem, dem_geotransform)
+            continue
+
+        # Corners: upper left, upper right, lower left, lower right
+        for k in range(4):
+            corner_x[k], corner_y[k] = map_ground(row0 + r0 + (k // 2) * size, col0 + c0 + (k % 2) * size,
+                                                  boundary, gsd, eo, ground_height, R, focal_length, pixel_size,
+                                                  image_rows, image_cols, lut, lut_grid, dem, dem_geotransform)
+
+        error = 0.
+        for (u, v) in ((0.5, 0.5), (0., 0.5), (1., 0.5), (0.5, 0.), (0.5, 1.)):
+            x, y = map_ground(row0 + r0 + v * size, col0 + c0 + u * size, boundary, gsd, eo, ground_height, R,
+                              focal_length, pixel_size, image_rows, image_cols, lut, lut_grid, dem, dem_geotransform)
+            x_approx = (1 - v) * ((1 - u) * corner_x[0] + u * corner_x[1]) + \
+                       v * ((1 - u) * corner_x[2] + u * corner_x[3])
+            y_approx = (1 - v) * ((1 - u) * corner_y[0] + u * corner_y[1]) + \
+                       v * ((1 - u) * corner_y[2] + u * corner_y[3])
+            error = max(error, abs(x - x_approx), abs(y - y_approx))
+        if dem is not None and error <= max_error:
+            error = max(error, dem_error(row0 + r0, col0 + c0, size, corner_x, corner_y, boundary, gsd, eo,
+                                         ground_height, R, focal_length, pixel_size, image_rows, image_cols, lut,
+                                         lut_grid, dem, dem_geotransform))
+
+        if error > max_error:
+            half = size // 2
+            for k in range(4):
+                stack[top, 0] = r0 + (k // 2) * half
+                stack[top, 1] = c0 + (k % 2) * half
+                stack[top, 2] = half
+                top += 1
+            continue
+
+        bilinear_cell(coords, r0, c0, size, corner_x, corner_y)
+
+@jit(nopython=True, parallel=True, cache=True, nogil=True)
+def rectify_dem_parallel(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size,
+                         image, band_map, alpha, value_range, interpolation=0, area_size=1., spans=None, out=None,
+                         lut=None, lut_grid=None, dem=None, dem_geotransform=None, zbuffer=None, zbuffer_grid=None):
+    # rectify_plane_parallel with the height of every output pixel interpolated from a gridded DEM, see map_ground()
+    # With a Z-buffer of the DEM (true orthophoto), the occluded pixels are left as nodata
+    if out is None:
+        ortho = np.zeros(shape=(boundary_rows, boundary_cols, band_map.shape[0] + 1), dtype=image.dtype)
+    else:
+        ortho = out
+
+    for row in prange(boundary_rows):
+        col_start = 0
+        col_end = boundary_cols
+        if spans is not None:
+            col_start = spans[row, 0]
+            col_end = spans[row, 1]
+
+        for col in range(col_start, col_end):
+            x, y = map_ground(row, col, boundary, gsd, eo, ground_height, R, focal_length, pixel_size,
+                              image.shape[0], image.shape[1], lut, lut_grid, dem, dem_geotransform, zbuffer, zbuffer_grid)
+            sample(ortho, row, col, image, x, y, band_map, alpha, value_range, interpolation, area_size)
+
+    return ortho
+
+@jit(nopython=True, parallel=True, cache=True, nogil=True)
+def rectify_approx(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size,
+                   image, band_map, alpha, value_range, interpolation=0, area_size=1., spans=None, out=None,
+                   lut=None, lut_grid=None, dem=None, dem_geotransform=None, step=16, max_error=0.125):
+    # rectify_plane_parallel/rectify_dem_parallel with an approximate mapping on a control grid of step px,
+    # see approx_cell() - step: a power of two
+    if out is None:
+        ortho = np.zeros(shape=(boundary_rows, boundary_cols, band_map.shape[0] + 1), dtype=image.dtype)
+    else:
+        ortho = out
+
+    cell_rows = (boundary_rows + step - 1) // step
+    cell_cols = (boundary_cols + step - 1) // step
+    for cell_row in prange(cell_rows):
+        coords = np.empty(shape=(step, step, 2))
+        stack = np.empty(shape=(64, 3), dtype=np.int64)
+        row_start = cell_row * step
+        row_end = min(row_start + step, boundary_rows)
+
+        for cell_col in range(cell_cols):
+            col_start = cell_col * step
+            col_end = min(col_start + step, boundary_cols)
+
+            # Only the cells in the footprint, if spans are given
+            if spans is not None:
+                inside = False
+                for row in range(row_start, row_end):
+                    if spans[row, 0] < col_end and spans[row, 1] > col_start and spans[row, 0] < spans[row, 1]:
+                        inside = True
+                        break
+                if not inside:
+                    continue
+
+            approx_cell(coords, stack, row_start, col_start, step, max_error, boundary, gsd, eo, ground_height, R,
+                        focal_length, pixel_size, image.shape[0], image.shape[1], lut, lut_grid, dem,
+                        dem_geotransform)
+
+            for row in range(row_start, row_end):
+                start = col_start
+                end = col_end
+                if spans is not None:
+                    start = max(start, spans[row, 0])
+                    end = min(end, spans[row, 1])
+                for col in range(start, end):
+                    sample(ortho, row, col, image, coords[row - row_start, col - col_start, 0],
+                           coords[row - row_start, col - col_start, 1], band_map, alpha, value_range,
+                           interpolation, area_size)
+
+    return ortho
+
+@jit(nopython=True, parallel=True, cache=True, nogil=True)
+def lattice_heights(heights, row0, col0, spacing, ground_height, dem=None, dem_geotransform=None):
+    # Ground heights of the nodes (row0 + i, col0 + j) of a lattice anchored at the ground origin,
+    # at (X, Y) = ((col0 + j) x spacing, -(row0 + i) x spacing) - unit: m
+    # Only the missing (NaN) nodes are computed, and with a DEM only those between the centers of its pixels
+    # (the others are left missing, as the DEM is clamped there)
+    x_min = x_max = y_min = y_max = 0.
+    if dem is not None:
+        x_min = dem_geotransform[0] + 0.5 * dem_geotransform[1]
+        x_max = dem_geotransform[0] + (dem.shape[1] - 0.5) * dem_geotransform[1]
+        y_max = dem_geotransform[3] + 0.5 * dem_geotransform[5]
+        y_min = dem_geotransform[3] + (dem.shape[0] - 0.5) * dem_geotransform[5]
+    for i in prange(heights.shape[0]):
+        y = -(row0 + i) * spacing
+        for j in range(heights.shape[1]):
+            if not np.isnan(heights[i, j]):
+                continue
+            x = (col0 + j) * spacing
+            if dem is None:
+                heights[i, j] = ground_height
+            elif x_min <= x <= x_max and y_min <= y <= y_max:
+                heights[i, j] = dem_height(dem, dem_geotransform, x, y)
+
+@jit(nopython=True, cache=True, inline='always')
+def map_lattice(height, row, col, boundary, gsd, eo, ground_height, R, focal_length, pixel_size, image_rows,
+                image_cols, lut, lut_grid, dem, dem_geotransform):
+    # map_ground() of an output pixel at the cached ground height of its node, the exact mapping if missing
+    if np.isnan(height):
+        return map_ground(row, col, boundary, gsd, eo, ground_height, R, focal_length, pixel_size, image_rows,
+                          image_cols, lut, lut_grid, dem, dem_geotransform)
+    x, y, _ = project_camera(boundary[0, 0] + col * gsd - eo[0], boundary[3, 0] - row * gsd - eo[1], height - eo[2],
+                             R, focal_length, pixel_size, image_rows, image_cols)
+    if lut is not None:
+        x, y = distort(lut, lut_grid, x, y)
+    return x, y
+
+@jit(nopython=True, parallel=True, cache=True, nogil=True)
+def rectify_coherent(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size,
+                     image, band_map, alpha, value_range, interpolation, area_size, spans, out, lut, lut_grid, dem,
+                     dem_geotransform, step, max_error, heights, nodes, errors, incremental):
+    # rectify_approx() on the control grid of a MappingCache (the views of the frame)
+    # heights: ground heights of the nodes and the midpoints, every step / 2 px, nodes: source coordinates of the
+    # nodes under the previous pose, updated to this one, errors: interpolation error of every cell, updated
+    # (-1: mapped by approx_cell(), NaN: unknown) - unit: px
+    # incremental: a cell whose previous error plus the variation of the displacement of its corners is within
+    # max_error is interpolated as it is, the others are checked like approx_cell() (with the corners of the DEM
+    # patches), and those above max_error are mapped by approx_cell()
+    # The reuse is a heuristic, not a bound: it takes the displacement between two close poses (see the tolerance
+    # of MappingCache) as bilinear over a cell, and only the full checks bound the error
+    if out is None:
+        ortho = np.zeros(shape=(boundary_rows, boundary_cols, band_map.shape[0] + 1), dtype=image.dtype)
+    else:
+        ortho = out
+
+    cell_rows = (boundary_rows + step - 1) // step
+    cell_cols = (boundary_cols + step - 1) // step
+    half = step // 2
+    image_rows = image.shape[0]
+    image_cols = image.shape[1]
+
+    # 1. Nodes under this pose
+    mapped = np.empty(shape=(cell_rows + 1, cell_cols + 1, 2))
+    for i in prange(cell_rows + 1):
+        for j in range(cell_cols + 1):
+            mapped[i, j, 0], mapped[i, j, 1] = map_lattice(heights[2 * i, 2 * j], i * step, j * step, boundary, gsd,
+                                                           eo, ground_height, R, focal_length, pixel_size,
+                                                           image_rows, image_cols, lut, lut_grid, dem,
+                                                           dem_geotransform)
+
+    # 2. Cells
+    for cell_row in prange(cell_rows):
+        coords = np.empty(shape=(step, step, 2))
+        stack = np.empty(shape=(64, 3), dtype=np.int64)
+        corner_x = np.empty(4)
+        corner_y = np.empty(4)
+        row_start = cell_row * step
+        row_end = min(row_start + step, boundary_rows)
+
+        for cell_col in range(cell_cols):
+            col_start = cell_col * step
+            col_end = min(col_start + step, boundary_cols)
+
+            # Only the cells in the footprint, if spans are given
+            if spans is not None:
+                inside = False
+                for row in range(row_start, row_end):
+                    if spans[row, 0] < col_end and spans[row, 1] > col_start and spans[row, 0] < spans[row, 1]:
+                        inside = True
+                        break
+                if not inside:
+                    errors[cell_row, cell_col] = np.nan  # its nodes move on without it
+                    continue
+
+            # Corners: upper left, upper right, lower left, lower right
+            low_x = low_y = np.inf
+            high_x = high_y = -np.inf
+            for k in range(4):
+                i = cell_row + k // 2
+                j = cell_col + k % 2
+                corner_x[k] = mapped[i, j, 0]
+                corner_y[k] = mapped[i, j, 1]
+                low_x = min(low_x, corner_x[k] - nodes[i, j, 0])
+                high_x = max(high_x, corner_x[k] - nodes[i, j, 0])
+                low_y = min(low_y, corner_y[k] - nodes[i, j, 1])
+                high_y = max(high_y, corner_y[k] - nodes[i, j, 1])
+
+            error = np.inf
+            if incremental and errors[cell_row, cell_col] >= 0:
+                error = errors[cell_row, cell_col] + max(high_x - low_x, high_y - low_y)  # NaN if unknown
+            if not error <= max_error:
+                error = 0.
+                for (u, v) in ((1, 1), (0, 1), (2, 1), (1, 0), (1, 2)):
+                    x, y = map_lattice(heights[2 * cell_row + v, 2 * cell_col + u], row_start + v * half,
+                                       col_start + u * half, boundary, gsd, eo, ground_height, R, focal_length,
+                                       pixel_size, image_rows, image_cols, lut, lut_grid, dem, dem_geotransform)
+                    x_approx = (1 - v / 2) * ((1 - u / 2) * corner_x[0] + u / 2 * corner_x[1]) + \
+                        v / 2 * ((1 - u / 2) * corner_x[2] + u / 2 * corner_x[3])
+                    y_approx = (1 - v / 2) * ((1 - u / 2) * corner_y[0] + u / 2 * corner_y[1]) + \
+                        v / 2 * ((1 - u / 2) * corner_y[2] + u / 2 * corner_y[3])
+                    error = max(error, abs(x - x_approx), abs(y - y_approx))
+                if dem is not None and error <= max_error:
+                    error = max(error, dem_error(row_start, col_start, step, corner_x, corner_y, boundary, gsd, eo,
+                                                 ground_height, R, focal_length, pixel_size, image_rows, image_cols,
+                                                 lut, lut_grid, dem, dem_geotransform))
+
+            if error <= max_error:
+                bilinear_cell(coords, 0, 0, step, corner_x, corner_y)
+                errors[cell_row, cell_col] = error
+            else:
+                approx_cell(coords, stack, row_start, col_start, step, max_error, boundary, gsd, eo, ground_height,
+                            R, focal_length, pixel_size, image_rows, image_cols, lut, lut_grid, dem,
+                            dem_geotransform)
+                errors[cell_row, cell_col] = -1.
+
+            for row in range(row_start, row_end):
+                start = col_start
+                end = col_end
+                if spans is not None:
+                    start = max(start, spans[row, 0])
+                    end = min(end, spans[row, 1])
+                for col in range(start, end):
+                    sample(ortho, row, col, image, coords[row - row_start, col - col_start, 0],
+                           coords[row - row_start, col - col_start, 1], band_map, alpha, value_range,
+                           interpolation, area_size)
+
+    # 3. The nodes of this pose for the next frame
+    for i in prange(cell_rows + 1):
+        for j in range(cell_cols + 1):
+            nodes[i, j, 0] = mapped[i, j, 0]
+            nodes[i, j, 1] = mapped[i, j, 1]
+
+    return ortho
+
+def snap_boundary(boundary, gsd, step=16):
+    # Boundary grown to the multiples of step x gsd, on which the control grids of a MappingCache coincide
+    size = step * gsd
+    return np.array([[np.floor(boundary[0, 0] / size) * size], [np.ceil(boundary[1, 0] / size) * size],
+                     [np.floor(boundary[2, 0] / size) * size], [np.ceil(boundary[3, 0] / size) * size]])
+
+class MappingCache:
+    # Control grid of rectify_approx() kept between consecutive frames (e.g. of a video), for temporal coherence
+    # The nodes are anchored to the ground, every step x gsd (see snap_boundary()), so that they coincide between
+    # frames: their ground heights are sampled from the DEM once, and reused as long as the frames stay on them
+    # A frame whose pose moved by less than tolerance (position - unit: m, rotation - unit: rad) since the last
+    # one updates the mapping incrementally, see rectify_coherent() (a heuristic within max_error for small pose
+    # changes) - the others are checked cell by cell
+    # margin: part of the frame added around it, when the cached grid is moved to a new frame
 
+    def __init__(self, step=16, tolerance=(0.5, np.radians(0.5)), margin=0.25):
+        if step < 2 or step & (step - 1) != 0:
+            raise Exception(" * An invalid control grid!!! Not a power of two")
+        self.step = step
+        self.tolerance = tolerance
+        self.margin = margin
+        self.key = None
+        self.window = None  # (row, col, rows, cols) of the cells, on the ground
+        self.heights = self.nodes = self.errors = None
+        self.eo = self.R = None
+        self.frames = {"full": 0, "incremental": 0}
 
-@jit(nopython=True)
+    def _move(self, window):
+        # Cached grid of the window, with what the current one has of it
+        heights = np.full((2 * window[2] + 1, 2 * window[3] + 1), np.nan)
+        nodes = np.full((window[2] + 1, window[3] + 1, 2), np.nan)
+        errors = np.full((window[2], window[3]), np.nan)
+        if self.window is not None:
+            row0, col0 = max(window[0], self.window[0]), max(window[1], self.window[1])
+            row1 = min(window[0] + window[2], self.window[0] + self.window[2])
+            col1 = min(window[1] + window[3], self.window[1] + self.window[3])
+            if row0 < row1 and col0 < col1:
+                dst = (slice(row0 - window[0], row1 - window[0]), slice(col0 - window[1], col1 - window[1]))
+                src = (slice(row0 - self.window[0], row1 - self.window[0]),
+                       slice(col0 - self.window[1], col1 - self.window[1]))
+                errors[dst] = self.errors[src]
+                dst, src = [(slice(a.start, a.stop + 1), slice(b.start, b.stop + 1)) for a, b in [dst, src]]
+                nodes[dst] = self.nodes[src]
+                dst, src = [(slice(2 * a.start, 2 * a.stop + 1), slice(2 * b.start, 2 * b.stop + 1))
+                            for a, b in [dst, src]]
+                heights[dst] = self.heights[src]
+        self.window = window
+        self.heights, self.nodes, self.errors = heights, nodes, errors
+
+    def frame(self, boundary, boundary_rows, boundary_cols, gsd, eo, R, ground_height, dem=None):
+        # Views of the cached grid on the frame, heights sampled, and whether to update it incrementally
+        size = self.step * gsd
+        row, col = -boundary[3, 0] / size, boundary[0, 0] / size
+        if abs(row - round(row)) > 1e-6 or abs(col - round(col)) > 1e-6:
+            raise Exception(" * An invalid boundary!!! Not on the control grid of the mapping cache, "
+                            "see snap_boundary()")
+        window = (int(round(row)), int(round(col)), (boundary_rows + self.step - 1) // self.step,
+                  (boundary_cols + self.step - 1) // self.step)
+
+        # A new GSD or a new plane resets the cache
+        key = (gsd, ground_height if dem is None else None)
+        if key != self.key:
+            self.key = key
+            self.window = self.eo = self.R = None
+        if self.window is None or window[0] < self.window[0] or window[1] < self.window[1] or \
+                window[0] + window[2] > self.window[0] + self.window[2] or \
+                window[1] + window[3] > self.window[1] + self.window[3]:
+            rows, cols = int(np.ceil(window[2] * self.margin)), int(np.ceil(window[3] * self.margin))
+            self._move((window[0] - rows, window[1] - cols, window[2] + 2 * rows, window[3] + 2 * cols))
+
+        row0, col0 = window[0] - self.window[0], window[1] - self.window[1]
+        heights = self.heights[2 * row0:2 * (row0 + window[2]) + 1, 2 * col0:2 * (col0 + window[3]) + 1]
+        nodes = self.nodes[row0:row0 + window[2] + 1, col0:col0 + window[3] + 1]
+        errors = self.errors[row0:row0 + window[2], col0:col0 + window[3]].copy()
+        self.errors[:] = np.nan  # the nodes on the edge of the frame move on without the cells outside it
+        self.errors[row0:row0 + window[2], col0:col0 + window[3]] = errors
+        errors = self.errors[row0:row0 + window[2], col0:col0 + window[3]]
+        heights_dem, dem_geotransform = (None, None) if dem is None else dem
+        lattice_heights(heights, 2 * window[0], 2 * window[1], size / 2, ground_height, heights_dem,
+                        dem_geotransform)
+
+        incremental = False
+        if self.eo is not None:
+            rotation = np.arccos(np.clip((np.trace(np.dot(R, self.R.T)) - 1) / 2, -1., 1.))
+            incremental = np.linalg.norm(eo[0:3] - self.eo[0:3]) <= self.tolerance[0] and \
+                rotation <= self.tolerance[1]
+        self.eo, self.R = np.array(eo[0:3], dtype=np.float64), np.array(R, dtype=np.float64)
+        self.frames["incremental" if incremental else "full"] += 1
+        return heights, nodes, errors, incremental
+
+
+def homography_plane(boundary, gsd, eo, ground_height, R, focal_length, pixel_size, image_rows, image_cols):
+    # On a constant-height plane, ground-to-image is a 3x3 homography
+    # Output pixel (col, row) -> ground coordinates relative to the perspective center - unit: m
+    A = np.array([[gsd, 0., boundary[0, 0] - eo[0]],
+                  [0., -gsd, boundary[3, 0] - eo[1]],
+                  [0., 0., ground_height - eo[2]]])
+
+    # Camera coordinates - unit: m -> image coordinates - unit: px
+    # OpenCV puts pixel centers on integers, so shift by half a pixel to match the truncation in the kernels
+    K = np.array([[-focal_length / pixel_size, 0., image_cols / 2 - 0.5],
+                  [0., focal_length / pixel_size, image_rows / 2 - 0.5],
+                  [0., 0., 1.]])
+
+    H = np.dot(K, np.dot(R, A))
+    return H / H[2, 2]
+
+def affine_plane(H, boundary_rows, boundary_cols, tolerance):
+    # Fit an affine transform on a 3 x 3 grid of the output and accept it
+    # only if it stays within the tolerance of the homography - unit: px
+    cols, rows = np.meshgrid(np.linspace(0, boundary_cols, 3), np.linspace(0, boundary_rows, 3))
+    grid = np.vstack((cols.ravel(), rows.ravel(), np.ones(9)))
+
+    proj = np.dot(H, grid)
+    exact = proj[0:2] / proj[2]
+
+    affine = np.linalg.lstsq(grid.transpose(), exact.transpose(), rcond=None)[0].transpose()  # 2 x 3
+    error = np.max(np.abs(np.dot(affine, grid) - exact))
+    if error > tolerance:
+        return None
+    return affine
+
+def footprint_mask(H, boundary_rows, boundary_cols, image_rows, image_cols, dtype=np.uint8, alpha=255):
+    # Alpha band: the image border mapped into the orthophoto is a convex quadrilateral
+    corners = np.array([[-0.5, image_cols - 0.5, image_cols - 0.5, -0.5],
+                        [-0.5, -0.5, image_rows - 0.5, image_rows - 0.5],
+                        [1., 1., 1., 1.]])
+    proj = np.dot(np.linalg.inv(H), corners)
+    polygon = (proj[0:2] / proj[2]).transpose()
+
+    a = np.zeros(shape=(boundary_rows, boundary_cols), dtype=dtype)
+    cv2.fillConvexPoly(a, np.round(polygon * 256).astype(np.int32), float(alpha), lineType=cv2.LINE_8, shift=8)
+    return a
+
+def rectify_plane_homography(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length,
+                             pixel_size, image, band_map, interpolation="nearest", out=None, affine_tolerance=0.125):
+    H = homography_plane(boundary, gsd, eo, ground_height, R, focal_length, pixel_size,
+                         image.shape[0], image.shape[1])
+
+    # Near-nadir frames have negligible perspective terms, so the cheaper affine warp is enough
+    # The edges are replicated, as the kernels clamp their samples to the image (the alpha is the footprint)
+    flags = INTERPOLATION_CV2[interpolation] | cv2.WARP_INVERSE_MAP
+    affine = affine_plane(H, boundary_rows, boundary_cols, affine_tolerance)
+    if affine is None:
+        ortho = cv2.warpPerspective(image, H, (boundary_cols, boundary_rows), flags=flags,
+                                    borderMode=cv2.BORDER_REPLICATE)
+    else:
+        ortho = cv2.warpAffine(image, affine, (boundary_cols, boundary_rows), flags=flags,
+                               borderMode=cv2.BORDER_REPLICATE)
+
+    # Pixel-interleaved bands + alpha, written in place into the given buffer
+    if out is None:
+        out = np.empty(shape=(boundary_rows, boundary_cols, band_map.shape[0] + 1), dtype=image.dtype)
+    if np.array_equal(band_map, [2, 1, 0]):
+        out = cv2.cvtColor(ortho, cv2.COLOR_BGR2RGBA, dst=out)
+    else:
+        out[:, :, :-1] = ortho.reshape(boundary_rows, boundary_cols, -1)[:, :, band_map]
+    alpha, _ = band_range(image.dtype)
+    out[:, :, -1] = footprint_mask(H, boundary_rows, boundary_cols, image.shape[0], image.shape[1],
+                                   image.dtype, alpha)
+    out[out[:, :, -1] == 0] = 0     # nodata outside the footprint, as in the kernels
+
+    return out
+
+def band_order(image, band_map=None):
+    # Images as rows x cols x bands, and the source band of every output band
+    # Default: BGR(OpenCV) to RGB for 3 bands, the bands as they are otherwise (e.g. multispectral)
+    if image.ndim == 2:
+        image = image[:, :, np.newaxis]     # single band, e.g. thermal
+    if image.dtype not in GDAL_TYPES:
+        raise Exception(" * An invalid image data type!!! Not uint8/uint16/float32")
+    if band_map is None:
+        band_map = [2, 1, 0] if image.shape[2] == 3 else range(image.shape[2])
+    band_map = np.asarray(band_map, dtype=np.int64)
+    if np.any(band_map < 0) or np.any(band_map >= image.shape[2]):
+        raise Exception(" * An invalid band map!!! Not in 0 ~ %d" % (image.shape[2] - 1))
+    return image, band_map
+
+def stack_bands(images):
+    # Band-registered images of a multispectral rig (one pose) -> one rows x cols x bands image,
+    # so that every band is rectified in a single pass
+    if len(set(image.shape[0:2] for image in images)) != 1 or len(set(image.dtype for image in images)) != 1:
+        raise Exception(" * Invalid band images!!! Not the same size and data type")
+    return np.dstack(images)
+
+def rectify(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size, image,
+            interpolation="nearest", backend="auto", spans=None, out=None, precision="float64", band_map=None,
+            distortion=None, max_error=None, grid_step=16, dem=None, true_ortho=False, zbuffer=None,
+            mapping_cache=None):
+    # max_error: approximate mapping on a control grid of grid_step px (a power of two) within max_error px,
+    # instead of the exact mapping of every pixel (None) - numba only
+    # mapping_cache: MappingCache of the control grid between consecutive frames, of its step instead of grid_step
+    # (the boundary on its grid, see snap_boundary()) - approximate mapping only
+    # dem: gridded DEM (heights, geotransform), see module.Dem - ground_height is then the reference height
+    # for the GSD, e.g. the mean height under the footprint
+    # true_ortho: pixels occluded in the image by the DEM (a DSM) are left as nodata, with the Z-buffer of the DEM
+    # (zbuffer, or computed from the DEM, see module.Occlusion) - exact mapping only
+    if interpolation not in INTERPOLATION:
+        raise Exception(" * An invalid interpolation!!! Not nearest/bilinear/bicubic/area")
+    if precision not in ["float64", "float32"]:
+        raise Exception(" * An invalid precision!!! Not float64/float32")
+    if max_error is not None and (grid_step < 1 or grid_step & (grid_step - 1) != 0):
+        raise Exception(" * An invalid control grid!!! Not a power of two")
+    if true_ortho and (dem is None or max_error is not None):
+        raise Exception(" * An invalid true orthophoto!!! Not a DEM with the exact mapping")
+    if mapping_cache is not None and max_error is None:
+        raise Exception(" * An invalid mapping cache!!! Not the approximate mapping")
+    image, band_map = band_order(image, band_map)
+    distortion = lens_distortion(distortion)
+
+    # auto: a constant ground height is a plane DEM, which OpenCV warps as a homography
+    # (only for a pinhole camera - lens distortion is not a homography - in float64)
+    if backend == "auto":
+        # OpenCV remaps only sizes below SHRT_MAX, and up to 4 channels
+        if dem is None and distortion is None and max_error is None and precision == "float64" and \
+                interpolation in INTERPOLATION_CV2 and image.shape[2] <= 4 and \
+                max(boundary_rows, boundary_cols, image.shape[0], image.shape[1]) < 32767:
+            backend = "opencv"
+        else:
+            backend = "numba"
+
+    if backend == "opencv":
+        if distortion is not None or dem is not None:
+            raise Exception(" * An invalid rectification backend!!! Not numba for the lens distortion or a DEM")
+        if precision != "float64":
+            raise Exception(" * An invalid rectification backend!!! Not numba for float32")
+        return rectify_plane_homography(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height,
+                                        R, focal_length, pixel_size, image, band_map, interpolation, out)
+    elif backend == "numba":
+        area_size = area_size_plane(gsd, eo, ground_height, focal_length, pixel_size)
+        alpha, value_range = band_range(image.dtype)
+        lut = lut_grid = None
+        if distortion is not None:
+            lut, lut_grid = distortion_lut(distortion, focal_length / pixel_size, image.shape[0], image.shape[1])
+        heights = dem_geotransform = None
+        if dem is not None:
+            heights, dem_geotransform = dem
+        if mapping_cache is not None:
+            grid_heights, nodes, errors, incremental = mapping_cache.frame(boundary, boundary_rows, boundary_cols,
+                                                                           gsd, eo, R, ground_height, dem)
+            return rectify_coherent(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height,
+                                    R, focal_length, pixel_size, image, band_map, alpha, value_range,
+                                    INTERPOLATION[interpolation], area_size, spans, out, lut, lut_grid,
+                                    heights, dem_geotransform, mapping_cache.step, max_error, grid_heights, nodes,
+                                    errors, incremental)
+        if max_error is not None:
+            # The control grid is computed in float64 for both precisions
+            return rectify_approx(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height,
+                                  R, focal_length, pixel_size, image, band_map, alpha, value_range,
+                                  INTERPOLATION[interpolation], area_size, spans, out, lut, lut_grid,
+                                  heights, dem_geotransform, grid_step, max_error)
+        if dem is not None:
+            zbuffer_grid = None
+            if true_ortho:
+                if zbuffer is None:
+                    zbuffer = occlusion_zbuffer(dem, eo, R, focal_length, pixel_size, image.shape[0], image.shape[1])
+                zbuffer, zbuffer_grid = zbuffer
+            else:
+                zbuffer = None
+            return rectify_dem_parallel(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height,
+                                        R, focal_length, pixel_size, image, band_map, alpha, value_range,
+                                        INTERPOLATION[interpolation], area_size, spans, out, lut, lut_grid,
+                                        heights, dem_geotransform, zbuffer, zbuffer_grid)
+        if precision == "float32":
+            if lut is not None:
+                lut, lut_grid = lut.astype(np.float32), lut_grid.astype(np.float32)
+            return rectify_plane_parallel_f32(local_origin(boundary, eo, ground_height), boundary_rows, boundary_cols,
+                                              np.float32(gsd), R.astype(np.float32),
+                                              np.float32(focal_length / pixel_size), image, band_map, alpha,
+                                              value_range, INTERPOLATION[interpolation], area_size, spans, out,
+                                              lut, lut_grid)
+        return rectify_plane_parallel(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height,
+                                      R, focal_length, pixel_size, image, band_map, alpha, value_range,
+                                      INTERPOLATION[interpolation], area_size, spans, out, lut, lut_grid)
+    else:
+        raise Exception(" * An invalid rectification backend!!! Not auto/opencv/numba")
+
+
+@jit(nopython=True, cache=True)
 def rectify_plane(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size, image):
     # 1. projection
     # 2. back-projection
@@ -122,9 +983,10 @@ def rectify_plane(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height
     return b, g, r, a
 
 
-@jit(nopython=True)
-def projectedCoord(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height):
-    proj_coords = np.empty(shape=(3, boundary_rows * boundary_cols))
+@jit(nopython=True, cache=True)
+def projectedCoord(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height, dtype=np.float64):
+    # Coordinates are relative to the perspective center(local origin), so float32 keeps the precision
+    proj_coords = np.empty(shape=(3, boundary_rows * boundary_cols), dtype=dtype)
     i = 0
     for row in range(boundary_rows):
         for col in range(boundary_cols):
@@ -135,47 +997,95 @@ def projectedCoord(boundary, boundary_rows, boundary_cols, gsd, eo, ground_heigh
     return proj_coords
 
 def backProjection(coord, R, focal_length, pixel_size, image_size):
-    coord_CCS_m = np.dot(R, coord)  # unit: m     3 x (row x col)
-    scale = (coord_CCS_m[2]) / (-focal_length)  # 1 x (row x col)
+    # Computed in the precision of coord (float64 or float32)
+    dtype = coord.dtype
+    coord_CCS_m = np.dot(R.astype(dtype), coord)  # unit: m     3 x (row x col)
+    scale = (coord_CCS_m[2]) / dtype.type(-focal_length)  # 1 x (row x col)
     plane_coord_CCS = coord_CCS_m[0:2] / scale  # 2 x (row x col)
 
     # Convert CCS to Pixel Coordinate System
-    coord_CCS_px = plane_coord_CCS / pixel_size  # unit: px
+    coord_CCS_px = plane_coord_CCS / dtype.type(pixel_size)  # unit: px
     coord_CCS_px[1] = -coord_CCS_px[1]
 
-    coord_out = image_size[::-1] / 2 + coord_CCS_px  # 2 x (row x col)
+    coord_out = (image_size[::-1] / 2).astype(dtype) + coord_CCS_px  # 2 x (row x col)
 
     return coord_out
 
-@jit(nopython=True)
-def resample(coord, boundary_rows, boundary_cols, image):
+@jit(nopython=True, parallel=True, cache=True)
+def resample(coord, boundary_rows, boundary_cols, image, interpolation=0, area_size=1.):
     # Define channels of an orthophoto
     b = np.zeros(shape=(boundary_rows, boundary_cols), dtype=np.uint8)
     g = np.zeros(shape=(boundary_rows, boundary_cols), dtype=np.uint8)
     r = np.zeros(shape=(boundary_rows, boundary_cols), dtype=np.uint8)
     a = np.zeros(shape=(boundary_rows, boundary_cols), dtype=np.uint8)
 
-    rows = np.reshape(coord[1], (boundary_rows, boundary_cols))
-    cols = np.reshape(coord[0], (boundary_rows, boundary_cols))
-
-    rows = rows.astype(np.int16)
-    #rows = np.int16(rows)
-    cols = cols.astype(np.int16)
-
-    for row in range(boundary_rows):
+    for row in prange(boundary_rows):
         for col in range(boundary_cols):
-            if cols[row, col] < 0 or cols[row, col] >= image.shape[1]:
+            x = coord[0, row * boundary_cols + col]
+            y = coord[1, row * boundary_cols + col]
+            if int(x) < 0 or int(x) >= image.shape[1]:
                 continue
-            elif rows[row, col] < 0 or rows[row, col] >= image.shape[0]:
+            elif int(y) < 0 or int(y) >= image.shape[0]:
                 continue
+            elif interpolation == 0:
+                # Nearest Neighbor
+                b[row, col] = image[int(y), int(x)][0]
+                g[row, col] = image[int(y), int(x)][1]
+                r[row, col] = image[int(y), int(x)][2]
+                a[row, col] = 255
             else:
-                b[row, col] = image[rows[row, col], cols[row, col]][0]
-                g[row, col] = image[rows[row, col], cols[row, col]][1]
-                r[row, col] = image[rows[row, col], cols[row, col]][2]
+                b[row, col] = saturate_uint8(interpolate(image, x, y, 0, interpolation, area_size))
+                g[row, col] = saturate_uint8(interpolate(image, x, y, 1, interpolation, area_size))
+                r[row, col] = saturate_uint8(interpolate(image, x, y, 2, interpolation, area_size))
                 a[row, col] = 255
 
     return b, g, r, a
 
+@lru_cache(maxsize=None)
+def projection_wkt(epsg):
+    # Define the projected coordinate system once per EPSG code
+    srs = osr.SpatialReference()  # establish encoding
+    srs.ImportFromEPSG(epsg)
+    return srs.ExportToWkt()
+
+def warmup_kernels(dtypes=(np.uint8, np.uint16)):
+    # Compile (or load from the on-disk cache) the kernels for the signatures used in production,
+    # so that the first request does not pay for the JIT compilation
+    boundary = np.array([[0.], [16.], [0.], [16.]])
+    eo = np.array([8., 8., 100., 0., 0., 0.])
+    R = np.eye(3)
+    spans = np.tile(np.array([0, 16], dtype=np.int64), (16, 1))
+    video_boundary = np.array([[0.], [64.], [0.], [64.]])
+    video_spans = np.tile(np.array([0, 64], dtype=np.int64), (64, 1))
+    dem = (np.zeros(shape=(2, 2), dtype=np.float32), np.array([0., 8., 0., 16., 0., -8.]))
+    for dtype in dtypes:
+        image = np.zeros(shape=(16, 16, 3), dtype=dtype)
+        # in-memory, then tiled & memory-mapped outputs - with and without the lens distortion
+        for out, distortion in itertools.product([None, np.zeros(shape=(16, 16, 4), dtype=dtype)],
+                                                 [None, (-0.1, 0., 0., 0., 0.)]):
+            for precision in ["float64", "float32"]:
+                for interpolation in INTERPOLATION:
+                    rectify(boundary, 16, 16, 1., eo, 0., R, 0.01, 0.01 * 16 / 100, image, interpolation, "numba",
+                            spans, out, precision, distortion=distortion)
+            # approximate mapping and DEM
+            for max_error in [None, 0.125]:
+                rectify(boundary, 16, 16, 1., eo, 0., R, 0.01, 0.01 * 16 / 100, image, "nearest", "numba",
+                        spans, out, distortion=distortion, max_error=max_error, dem=dem)
+            # true orthophoto
+            rectify(boundary, 16, 16, 1., eo, 0., R, 0.01, 0.01 * 16 / 100, image, "nearest", "numba",
+                    spans, out, distortion=distortion, dem=dem, true_ortho=True)
+            rectify(boundary, 16, 16, 1., eo, 0., R, 0.01, 0.01 * 16 / 100, image, "nearest", "numba",
+                    spans, out, distortion=distortion, max_error=0.125)
+            # control grid kept between video frames, of several cells: the views of the cache are strided
+            video_out = None if out is None else np.zeros(shape=(64, 64, 4), dtype=dtype)
+            for frame_dem in [None, dem]:
+                rectify(video_boundary, 64, 64, 1., eo, 0., R, 0.01, 0.01 * 16 / 100, image, "nearest", "numba",
+                        video_spans, video_out, distortion=distortion, max_error=0.125, dem=frame_dem,
+                        mapping_cache=MappingCache())
+        rectify(boundary, 16, 16, 1., eo, 0., R, 0.01, 0.01 * 16 / 100, image, "nearest", "opencv")
+    # footprints on a DEM
+    ray_dem(dem, eo[np.newaxis, 0:3], np.array([[0., 0., -1.]]))
+
 def createGeoTiff(b, g, r, a, boundary, gsd, epsg, rows, cols, dst):
     # https://stackoverflow.com/questions/33537599/how-do-i-write-create-a-geotiff-rgb-image-file-in-python
     geotransform = (boundary[0], gsd, 0, boundary[3], 0, -gsd)
@@ -185,10 +1095,8 @@ def createGeoTiff(b, g, r, a, boundary, gsd, epsg, rows, cols, dst):
     dst_ds.SetGeoTransform(geotransform)  # specify coords
 
     # Define the projected coordinate system
-    srs = osr.SpatialReference()  # establish encoding
-    srs.ImportFromEPSG(epsg)
 
-    dst_ds.SetProjection(srs.ExportToWkt())  # export coords to file
+    dst_ds.SetProjection(projection_wkt(epsg))  # export coords to file
     dst_ds.GetRasterBand(1).WriteArray(r)  # write r-band to the raster
     dst_ds.GetRasterBand(2).WriteArray(g)  # write g-band to the raster
     dst_ds.GetRasterBand(3).WriteArray(b)  # write b-band to the raster
@@ -197,6 +1105,197 @@ def createGeoTiff(b, g, r, a, boundary, gsd, epsg, rows, cols, dst):
     dst_ds.FlushCache()  # write to disk
     dst_ds = None
 
+def tile_size_for_budget(memory_budget, bands=4, itemsize=1):
+    # The largest tile (multiple of 16 for GeoTIFF blocks) whose working set fits in the budget - unit: byte
+    # Working set: the output tile and a warped tile of the same size, besides the source image
+    tile_size = int(np.sqrt(memory_budget / (2 * bands * itemsize)) // 16 * 16)
+    return max(tile_size, 16)
+
+def rectify_tiled(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size, image,
+                  epsg, dst, interpolation="nearest", backend="auto", spans=None, tile_size=512, memory_budget=None,
+                  precision="float64", band_map=None, distortion=None, max_error=None, dem=None, true_ortho=False):
+    # Rectify fixed-size output tiles and stream each of them into a block of a tiled GeoTIFF,
+    # so that the memory for the orthophoto is O(tile) instead of O(orthophoto)
+    # Only the output is tiled: the decoded source image is still held in full by the caller
+    image, band_map = band_order(image, band_map)
+    zbuffer = None
+    if true_ortho and dem is not None:
+        # One Z-buffer for all the tiles
+        zbuffer = occlusion_zbuffer(dem, eo, R, focal_length, pixel_size, image.shape[0], image.shape[1])
+    bands = band_map.shape[0] + 1
+    itemsize = image.dtype.itemsize
+    if memory_budget is not None:
+        tile_size = tile_size_for_budget(memory_budget, bands, itemsize)
+    tile_size = min(tile_size, max(16, (max(boundary_rows, boundary_cols) + 15) // 16 * 16))
+
+    geotransform = (boundary[0, 0], gsd, 0, boundary[3, 0], 0, -gsd)
+    options = ['TILED=YES', 'BLOCKXSIZE=%d' % tile_size, 'BLOCKYSIZE=%d' % tile_size, 'SPARSE_OK=TRUE',
+               'INTERLEAVE=PIXEL']
+    dst_ds = gdal.GetDriverByName('GTiff').Create(dst + '.tif', boundary_cols, boundary_rows, bands,
+                                                  GDAL_TYPES[image.dtype], options=options)
+    dst_ds.SetGeoTransform(geotransform)  # specify coords
+
+    # Define the projected coordinate system
+    dst_ds.SetProjection(projection_wkt(epsg))  # export coords to file
+
+    rectify_time = 0.
+    write_time = 0.
+    buffer = np.empty(shape=(tile_size * tile_size * bands,), dtype=image.dtype)   # reused by every tile
+    tile_boundary = boundary.copy()
+    for row in range(0, boundary_rows, tile_size):
+        tile_rows = min(tile_size, boundary_rows - row)
+        for col in range(0, boundary_cols, tile_size):
+            tile_cols = min(tile_size, boundary_cols - col)
+
+            tile_spans = None
+            if spans is not None:
+                tile_spans = np.clip(spans[row:row + tile_rows] - col, 0, tile_cols)
+                if not np.any(tile_spans[:, 1] > tile_spans[:, 0]):
+                    continue    # outside the footprint - left sparse
+
+            start_time = time.time()
+            tile_boundary[0, 0] = boundary[0, 0] + col * gsd
+            tile_boundary[3, 0] = boundary[3, 0] - row * gsd
+            tile = buffer[:tile_rows * tile_cols * bands].reshape(tile_rows, tile_cols, bands)
+            tile[:] = 0
+            tile = rectify(tile_boundary, tile_rows, tile_cols, gsd, eo, ground_height, R, focal_length, pixel_size,
+                           image, interpolation, backend, tile_spans, tile, precision, band_map, distortion, max_error,
+                           dem=dem, true_ortho=true_ortho, zbuffer=zbuffer)
+            rectify_time += time.time() - start_time
+
+            start_time = time.time()
+            dst_ds.WriteRaster(col, row, tile_cols, tile_rows, tile, buf_type=GDAL_TYPES[image.dtype],
+                               band_list=list(range(1, bands + 1)), buf_pixel_space=bands * itemsize,
+                               buf_line_space=bands * itemsize * tile_cols, buf_band_space=itemsize)
+            write_time += time.time() - start_time
+
+    start_time = time.time()
+    dst_ds.FlushCache()  # write to disk
+    dst_ds = None
+    write_time += time.time() - start_time
+
+    return rectify_time, write_time
+
+def createGeoTiffInterleaved(ortho, boundary, gsd, epsg, dst):
+    # Write the pixel-interleaved orthophoto (rows x cols x bands) with a single call
+    rows, cols, bands = ortho.shape
+    geotransform = (boundary[0, 0], gsd, 0, boundary[3, 0], 0, -gsd)
+
+    dst_ds = gdal.GetDriverByName('GTiff').Create(dst + '.tif', cols, rows, bands, GDAL_TYPES[ortho.dtype],
+                                                  options=['INTERLEAVE=PIXEL'])
+    dst_ds.SetGeoTransform(geotransform)  # specify coords
+
+    # Define the projected coordinate system
+    dst_ds.SetProjection(projection_wkt(epsg))  # export coords to file
+
+    ortho = np.ascontiguousarray(ortho)
+    itemsize = ortho.dtype.itemsize
+    dst_ds.WriteRaster(0, 0, cols, rows, ortho, buf_type=GDAL_TYPES[ortho.dtype], band_list=list(range(1, bands + 1)),
+                       buf_pixel_space=bands * itemsize, buf_line_space=bands * itemsize * cols,
+                       buf_band_space=itemsize)
+
+    dst_ds.FlushCache()  # write to disk
+    dst_ds = None
+
+def createMappedOutput(boundary, gsd, epsg, rows, cols, dst, bands=4, dtype=np.uint8):
+    # Uncompressed, pixel-interleaved ENVI raster (dst.img + dst.hdr), memory-mapped
+    # so that the rectifier writes straight into the file
+    geotransform = (boundary[0, 0], gsd, 0, boundary[3, 0], 0, -gsd)
+
+    dtype = np.dtype(dtype)
+    dst_ds = gdal.GetDriverByName('ENVI').Create(dst + '.img', cols, rows, bands, GDAL_TYPES[dtype],
+                                                 options=['INTERLEAVE=BIP'])
+    dst_ds.SetGeoTransform(geotransform)  # specify coords
+
+    # Define the projected coordinate system
+    dst_ds.SetProjection(projection_wkt(epsg))  # export coords to file
+
+    dst_ds.FlushCache()  # write the header
+    dst_ds = None
+
+    # Extend the file to its full (zero-filled, sparse) size
+    with open(dst + '.img', 'r+b') as f:
+        f.truncate(rows * cols * bands * dtype.itemsize)
+
+    return np.memmap(dst + '.img', dtype=dtype, mode='r+', shape=(rows, cols, bands))
+
+def createGeoTiffFootprint(ortho, boundary, gsd, epsg, spans, dst, block_size=256):
+    # Crop to the tight window of the footprint and write a sparse, tiled GeoTIFF:
+    # blocks outside the footprint are never written, take no bytes and read back as nodata
+    row_start, row_end, col_start, col_end = footprint_window(spans)
+    if row_end == row_start or col_end == col_start:
+        raise Exception(" * An invalid footprint!!! Not a single pixel on the orthophoto grid for %s" % dst)
+    rows = row_end - row_start
+    cols = col_end - col_start
+    geotransform = (boundary[0, 0] + col_start * gsd, gsd, 0, boundary[3, 0] - row_start * gsd, 0, -gsd)
+
+    options = ['TILED=YES', 'BLOCKXSIZE=%d' % block_size, 'BLOCKYSIZE=%d' % block_size, 'SPARSE_OK=TRUE', 'ALPHA=YES']
+    bands = ortho.shape[2]
+    itemsize = ortho.dtype.itemsize
+    dst_ds = gdal.GetDriverByName('GTiff').Create(dst + '.tif', cols, rows, bands, GDAL_TYPES[ortho.dtype],
+                                                  options=options)
+    dst_ds.SetGeoTransform(geotransform)  # specify coords
+
+    # Define the projected coordinate system
+    dst_ds.SetProjection(projection_wkt(epsg))  # export coords to file
+
+    for block_row in range(row_start, row_end, block_size):
+        block_rows = min(block_size, row_end - block_row)
+        block_spans = spans[block_row:block_row + block_rows]
+        block_spans = block_spans[block_spans[:, 1] > block_spans[:, 0]]
+        if block_spans.shape[0] == 0:
+            continue
+        for block_col in range(col_start, col_end, block_size):
+            block_cols = min(block_size, col_end - block_col)
+            if block_col >= np.max(block_spans[:, 1]) or block_col + block_cols <= np.min(block_spans[:, 0]):
+                continue    # outside the footprint
+
+            # One interleaved write per block
+            block = np.ascontiguousarray(ortho[block_row:block_row + block_rows, block_col:block_col + block_cols])
+            dst_ds.WriteRaster(block_col - col_start, block_row - row_start, block_cols, block_rows, block,
+                               buf_type=GDAL_TYPES[ortho.dtype], band_list=list(range(1, bands + 1)),
+                               buf_pixel_space=bands * itemsize, buf_line_space=bands * itemsize * block_cols,
+                               buf_band_space=itemsize)
+
+    dst_ds.FlushCache()  # write to disk
+    dst_ds = None
+
+def createCOG(ortho, boundary, gsd, epsg, dst, compression="DEFLATE", spans=None, block_size=512):
+    # Cloud-Optimized GeoTIFF: tiled, compressed with all the CPUs, with internal overviews
+    # The alpha band is stored as a 1-bit internal mask, and the orthophoto is cropped to its footprint with spans
+    if compression not in COG_COMPRESSION:
+        raise Exception(" * An invalid compression!!! Not JPEG/WEBP/DEFLATE/ZSTD/LZW")
+    if compression in ["JPEG", "WEBP"] and ortho.dtype != np.uint8:
+        raise Exception(" * An invalid compression!!! Not DEFLATE/ZSTD/LZW for a %s orthophoto" % ortho.dtype)
+    row_start, row_end, col_start, col_end = 0, ortho.shape[0], 0, ortho.shape[1]
+    if spans is not None:
+        row_start, row_end, col_start, col_end = footprint_window(spans)
+        if row_end == row_start or col_end == col_start:
+            raise Exception(" * An invalid footprint!!! Not a single pixel on the orthophoto grid for %s" % dst)
+    ortho = ortho[row_start:row_end, col_start:col_end]
+    rows, cols, bands = ortho.shape
+    geotransform = (boundary[0, 0] + col_start * gsd, gsd, 0, boundary[3, 0] - row_start * gsd, 0, -gsd)
+
+    # The COG driver only copies a dataset: the color bands and the mask in memory first
+    src_ds = gdal.GetDriverByName('MEM').Create('', cols, rows, bands - 1, GDAL_TYPES[ortho.dtype])
+    src_ds.SetGeoTransform(geotransform)  # specify coords
+    src_ds.SetProjection(projection_wkt(epsg))  # export coords to file
+    color = np.ascontiguousarray(ortho[:, :, :-1])
+    itemsize = ortho.dtype.itemsize
+    src_ds.WriteRaster(0, 0, cols, rows, color, buf_type=GDAL_TYPES[ortho.dtype], band_list=list(range(1, bands)),
+                       buf_pixel_space=(bands - 1) * itemsize, buf_line_space=(bands - 1) * itemsize * cols,
+                       buf_band_space=itemsize)
+    src_ds.CreateMaskBand(gdal.GMF_PER_DATASET)
+    src_ds.GetRasterBand(1).GetMaskBand().WriteArray((ortho[:, :, -1] > 0).view(np.uint8) * np.uint8(255))
+
+    # Compression threads of GDAL_NUM_THREADS if set, e.g. by the batch runner, otherwise all the CPUs
+    num_threads = gdal.GetConfigOption('GDAL_NUM_THREADS', 'ALL_CPUS')
+    options = COG_COMPRESSION[compression] + ['BLOCKSIZE=%d' % block_size, 'NUM_THREADS=%s' % num_threads,
+                                              'OVERVIEWS=AUTO', 'OVERVIEW_RESAMPLING=AVERAGE', 'BIGTIFF=IF_SAFER']
+    dst_ds = gdal.GetDriverByName('COG').CreateCopy(dst + '.tif', src_ds, options=options)
+    dst_ds = None  # write to disk
+    src_ds = None
+
 def create_pnga_optical(b, g, r, a, boundary, gsd, epsg, dst):
     ## TODO: An option for generating an world file
     # https://stackoverflow.com/questions/42314272/imwrite-merged-image-writing-image-after-adding-alpha-channel-to-it-opencv-pyt
@@ -234,7 +1333,7 @@ def create_pnga_optical(b, g, r, a, boundary, gsd, epsg, dst):
     # f.write(xml)
     # f.close()
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def resampleThermal(coord, boundary_rows, boundary_cols, image):
     # Define channels of an orthophoto
     gray = np.zeros(shape=(boundary_rows, boundary_cols))
@@ -1,14 +1,13 @@
 import numpy as np
-# import trimesh
-import time
+from module.Distortion import lens_distortion, image_border, undistort_points
+from module.Dem import DemStore, dem_statistics, dem_crop, ray_dem
 
-def boundary(image, eo, R, dem, pixel_size, focal_length):
-    inverse_R = R.transpose()
-
-    image_vertex = getVertices(image, pixel_size, focal_length)  # shape: 3 x 4
+def boundary(image, eo, R, dem, pixel_size, focal_length, distortion=None):
+    proj_coordinates = footprint(image, eo, R, dem, pixel_size, focal_length, distortion)
 
-    proj_coordinates = projection(image_vertex, eo, inverse_R, dem)
+    return polygon_bbox(proj_coordinates)
 
+def polygon_bbox(proj_coordinates):
     bbox = np.empty(shape=(4, 1))
     bbox[0] = min(proj_coordinates[0, :])  # X min
     bbox[1] = max(proj_coordinates[0, :])  # X max
@@ -17,6 +16,70 @@ def boundary(image, eo, R, dem, pixel_size, focal_length):
 
     return bbox
 
+def footprint(image, eo, R, dem, pixel_size, focal_length, distortion=None):
+    inverse_R = R.transpose()
+
+    distortion = lens_distortion(distortion)
+    if distortion is None:
+        image_vertex = getVertices(image, pixel_size, focal_length)  # shape: 3 x 4
+    else:
+        # With lens distortion, the border of the image is curved on the ground
+        border = undistort_points(image_border(image.shape[0], image.shape[1]), distortion,
+                                  focal_length / pixel_size, image.shape[0], image.shape[1])
+        image_vertex = pcs2ccs(border, image.shape[0], image.shape[1], pixel_size, focal_length)  # shape: 3 x n
+
+    # Projected vertices of the image, in the order of getVertices (clockwise from the upper left)
+    return projection(image_vertex, eo, inverse_R, dem)  # shape: 2 x 4 (or n)
+
+def footprint_dem(image, eo, R, dem, pixel_size, focal_length, distortion=None):
+    # Conservative footprint on a gridded DEM (heights, geotransform): the footprints on the lowest and
+    # the highest terrain under the image, as one closed walk over both (footprint_spans takes the extent of each row)
+    # The height range of the whole DEM is narrowed to the terrain under its footprint once
+    low, _, high = dem_statistics(dem)
+    for _ in range(2):
+        lower = footprint(image, eo, R, low, pixel_size, focal_length, distortion)
+        upper = footprint(image, eo, R, high, pixel_size, focal_length, distortion)
+        polygon = np.hstack((lower, lower[:, :1], upper, upper[:, :1]))
+        low, _, high = dem_statistics(dem, polygon_bbox(polygon))
+    return polygon
+
+def footprint_spans(polygon, bbox, boundary_rows, boundary_cols, gsd, margin=1):
+    # Scanline fill of the footprint polygon on the orthophoto grid
+    # Returns [col_start, col_end) of the pixels in the footprint for every row, padded by a margin
+    cols_px = (polygon[0] - bbox[0, 0]) / gsd
+    rows_px = (bbox[3, 0] - polygon[1]) / gsd
+
+    row = np.arange(-margin, boundary_rows + margin, dtype=np.float64)
+    start = np.full(row.size, np.inf)
+    end = np.full(row.size, -np.inf)
+    for i in range(polygon.shape[1]):
+        r0, r1 = rows_px[i], rows_px[(i + 1) % polygon.shape[1]]
+        c0, c1 = cols_px[i], cols_px[(i + 1) % polygon.shape[1]]
+        if r0 == r1:
+            continue
+        t = (row - r0) / (r1 - r0)
+        inside = (t >= 0) & (t <= 1)
+        c = c0 + t * (c1 - c0)
+        start[inside] = np.minimum(start[inside], c[inside])
+        end[inside] = np.maximum(end[inside], c[inside])
+
+    # Pad rows with the spans of their neighbours, so that edges between scanlines are covered
+    start = np.min([start[k:k + boundary_rows] for k in range(2 * margin + 1)], axis=0)
+    end = np.max([end[k:k + boundary_rows] for k in range(2 * margin + 1)], axis=0)
+
+    spans = np.zeros(shape=(boundary_rows, 2), dtype=np.int64)
+    valid = start <= end
+    spans[valid, 0] = np.clip(np.floor(start[valid]) - margin, 0, boundary_cols)
+    spans[valid, 1] = np.clip(np.floor(end[valid]) + 1 + margin, 0, boundary_cols)
+    return spans
+
+def footprint_window(spans):
+    # Tight window (row_start, row_end, col_start, col_end) of the non-empty spans
+    rows = np.nonzero(spans[:, 1] > spans[:, 0])[0]
+    if rows.size == 0:
+        return 0, 0, 0, 0
+    return rows[0], rows[-1] + 1, np.min(spans[rows, 0]), np.max(spans[rows, 1])
+
 def getVertices(image, pixel_size, focal_length):
     rows = image.shape[0]
     cols = image.shape[1]
@@ -61,70 +124,27 @@ def pcs2ccs(bbox_px, rows, cols, pixel_size, focal_length):
 
     return bbox_camera
 
-def ray_tracing(image, eo, R, dem, vertices, pixel_size, focal_length):
-    # create rays
-    ray_origins = np.empty(shape=(4, 3))
-    ray_origins[:, 0] = eo[0]
-    ray_origins[:, 1] = eo[1]
-    ray_origins[:, 2] = eo[2]
-
-    # (1) ------------ (2)
-    #  |     image      |
-    #  |                |
-    # (4) ------------ (3)
-    image_vertex = getVertices(image, pixel_size, focal_length)  # shape: 3 x 4
-    direction_vectors = image_vertex.transpose()    # shape: 4 x 3
-    direction_vectors_rot = np.dot(R.transpose(), direction_vectors.transpose())  # Camera to Ground
-    ray_directions = direction_vectors_rot.transpose()
-
-    # run the mesh- ray test
-    locations, index_ray, index_tri = dem.ray.intersects_location(
-        ray_origins=ray_origins,
-        ray_directions=ray_directions)
-    bbox = np.empty(shape=(4, 1))
-    bbox[0] = min(locations[:, 0])  # X min
-    bbox[1] = max(locations[:, 0])  # X max
-    bbox[2] = min(locations[:, 1])  # Y min
-    bbox[3] = max(locations[:, 1])  # Y max
-
-    test_origins = np.array([[bbox[0, 0], bbox[3, 0], eo[2]],   # UL
-                             [bbox[1, 0], bbox[3, 0], eo[2]],   # UR
-                             [bbox[1, 0], bbox[2, 0], eo[2]],   # LR
-                             [bbox[0, 0], bbox[2, 0], eo[2]]])  # LL
-    test_directions = np.array([[0, 0, -1],
-                                [0, 0, -1],
-                                [0, 0, -1],
-                                [0, 0, -1]])
-    test_locations, test_index_ray, test_index_tri = dem.ray.intersects_location(
-        ray_origins=test_origins, ray_directions=test_directions)
-    coord_ul_mesh = test_locations[0]
-    coord_ur_mesh = test_locations[1]
-    coord_lr_mesh = test_locations[2]
-    coord_ll_mesh = test_locations[3]
-
-    dem_extracted = vertices[((vertices[:, 0] >= coord_ul_mesh[0]) & (vertices[:, 0] <= coord_ur_mesh[0])) &
-                             ((vertices[:, 1] >= coord_ll_mesh[1]) & (vertices[:, 1] <= coord_ul_mesh[1]))]
-
-    dem_extracted[:, 0] -= eo[0]
-    dem_extracted[:, 1] -= eo[1]
-    dem_extracted[:, 2] -= eo[2]
-
-    # ### Check for boundary
-    # # stack rays into line segments for visualization as Path3D
-    # ray_visualize = trimesh.load_path(np.hstack((
-    #     ray_origins,
-    #     ray_origins + ray_directions)).reshape(-1, 2, 3))
-    #
-    # # make mesh transparent- ish
-    # dem.visual.face_colors = [100, 100, 100, 100]
-    #
-    # # create a visualization scene with rays, hits, and mesh
-    # scene = trimesh.Scene([
-    #     dem,
-    #     ray_visualize,
-    #     trimesh.points.PointCloud(locations)])
-    #
-    # # display the scene
-    # scene.show()
-
-    return bbox, dem_extracted
+def footprint_rays(image, eo, R, dem, pixel_size, focal_length, distortion=None, samples=16):
+    # Footprint of the image on a gridded DEM (heights, geotransform) by casting the rays of its border
+    # Rays that miss the DEM are projected on the plane of its mean height
+    distortion = lens_distortion(distortion)
+    border = image_border(image.shape[0], image.shape[1], samples)
+    if distortion is not None:
+        border = undistort_points(border, distortion, focal_length / pixel_size, image.shape[0], image.shape[1])
+    image_vertex = pcs2ccs(border, image.shape[0], image.shape[1], pixel_size, focal_length)  # shape: 3 x n
+
+    ray_directions = np.dot(R.transpose(), image_vertex).transpose()  # Camera to Ground
+    ray_origins = np.broadcast_to(eo[0:3], ray_directions.shape)
+    locations = ray_dem(dem, ray_origins, ray_directions)
+
+    miss = np.isnan(locations[:, 0])
+    if np.any(miss):
+        locations[miss, 0:2] = projection(image_vertex[:, miss], eo, R.transpose(), dem_statistics(dem)[1]).transpose()
+    return locations[:, 0:2].transpose()  # shape: 2 x n
+
+def ray_tracing(image, eo, R, dem, pixel_size, focal_length, distortion=None):
+    # bbox of the footprint on the DEM (a gridded DEM or a DEM store) and the gridded DEM under it
+    if isinstance(dem, DemStore):
+        dem = dem.window(polygon_bbox(footprint_dem(image, eo, R, dem, pixel_size, focal_length, distortion)))
+    bbox = polygon_bbox(footprint_rays(image, eo, R, dem, pixel_size, focal_length, distortion))
+    return bbox, dem_crop(dem, bbox)
@@ -0,0 +1,112 @@
+import os
+import sqlite3
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from module.ExifData import get_metadata, get_image_size, orientation_rotation, restored_cols
+from module.EoData import geographic2plane, rpy_to_opk, Rot3D
+from module.Boundary import footprint, polygon_bbox
+
+# Per-flight catalog of the georeferencing of the images, in SQLite
+# Rows are keyed by the path of an image and valid while its size, mtime and the EPSG are unchanged
+# eo: (X, Y, Z, omega, phi, kappa) in the plane coordinates of the EPSG - unit: m, rad
+# R: rotation of eo, without the EXIF orientation (see orientation_rotation)
+# bbox: footprint on the plane of ground_height (X min, X max, Y min, Y max) - unit: m
+CATALOG_SCHEMA = '''CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY, size INTEGER, mtime REAL, epsg INTEGER,
+    focal_length REAL, orientation INTEGER, maker TEXT, rows INTEGER, cols INTEGER, eo BLOB, R BLOB,
+    ground_height REAL, sensor_width REAL, x_min REAL, x_max REAL, y_min REAL, y_max REAL)'''
+CATALOG_COLUMNS = ['path', 'size', 'mtime', 'epsg', 'focal_length', 'orientation', 'maker', 'rows', 'cols', 'eo', 'R',
+                   'ground_height', 'sensor_width', 'x_min', 'x_max', 'y_min', 'y_max']
+
+
+def scan_image(path, epsg):
+    # Georeferencing of an image, the same as in orthophoto_process
+    focal_length, orientation, eo, maker = get_metadata(path)
+    rows, cols = get_image_size(path)
+    eo = geographic2plane(eo, epsg)
+    opk = rpy_to_opk(eo[3:], maker)
+    eo[3:] = opk * np.pi / 180
+    return {'focal_length': focal_length, 'orientation': orientation, 'maker': maker, 'rows': rows, 'cols': cols,
+            'eo': eo, 'R': Rot3D(eo)}
+
+def image_footprint(record, ground_height, sensor_width):
+    # bbox of the footprint on the plane of ground_height, of the image as stored with its orientation in R
+    image = np.broadcast_to(np.uint8(0), (record['rows'], record['cols']))  # only the shape is used
+    pixel_size = sensor_width / restored_cols(image.shape, record['orientation']) / 1000  # unit: m/px
+    R = orientation_rotation(record['orientation']) @ record['R']
+    return polygon_bbox(footprint(image, record['eo'], R, ground_height, pixel_size, record['focal_length']))
+
+class Catalog:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(CATALOG_SCHEMA)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def get(self, path):
+        # Record of an image (a dict of CATALOG_COLUMNS, with eo, R and bbox as arrays), None if missing or stale
+        row = self.connection.execute('SELECT * FROM images WHERE path = ?', (os.path.abspath(path),)).fetchone()
+        if row is None:
+            return None
+        record = dict(zip(CATALOG_COLUMNS, row))
+        stat = os.stat(path)
+        if record['size'] != stat.st_size or record['mtime'] != stat.st_mtime:
+            return None
+        record['eo'] = np.frombuffer(record['eo'], dtype=np.float64).copy()
+        record['R'] = np.frombuffer(record['R'], dtype=np.float64).reshape(3, 3).copy()
+        record['bbox'] = np.array([[record['x_min']], [record['x_max']], [record['y_min']], [record['y_max']]])
+        return record
+
+    def prescan(self, paths, epsg, ground_height, sensor_width, workers=None):
+        # Records of the images, scanning the missing or stale ones in parallel
+        # Footprints of records on another ground_height or sensor_width are recomputed
+        records = {}
+        missing = []
+        for path in paths:
+            record = self.get(path)
+            if record is None or record['epsg'] != epsg:
+                missing.append(path)
+            else:
+                records[path] = record
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for path, record in zip(missing, executor.map(scan_image, missing, [epsg] * len(missing))):
+                stat = os.stat(path)
+                record.update({'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime,
+                               'epsg': epsg, 'ground_height': None, 'sensor_width': None})
+                records[path] = record
+
+        updated = []
+        for path in paths:
+            record = records[path]
+            if record['ground_height'] != ground_height or record['sensor_width'] != sensor_width:
+                record['bbox'] = image_footprint(record, ground_height, sensor_width)
+                record['ground_height'] = ground_height
+                record['sensor_width'] = sensor_width
+                record['x_min'], record['x_max'], record['y_min'], record['y_max'] = record['bbox'][:, 0]
+                updated.append(record)
+
+        placeholders = ', '.join('?' * len(CATALOG_COLUMNS))
+        self.connection.executemany('INSERT OR REPLACE INTO images VALUES (%s)' % placeholders,
+                                    [[self.column(record, column) for column in CATALOG_COLUMNS]
+                                     for record in updated])
+        self.connection.commit()
+        return [records[path] for path in paths]
+
+    @staticmethod
+    def column(record, column):
+        value = record[column]
+        if isinstance(value, np.ndarray):
+            return np.ascontiguousarray(value, dtype=np.float64).tobytes()
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    def query(self, x, y):
+        # Paths of the images whose footprint covers the point (x, y) - unit: m
+        rows = self.connection.execute('SELECT path FROM images WHERE x_min <= ? AND ? <= x_max AND '
+                                       'y_min <= ? AND ? <= y_max ORDER BY path', (x, x, y, y)).fetchall()
+        return [row[0] for row in rows]
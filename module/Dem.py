@@ -0,0 +1,434 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import numpy as np
+from numba import jit, prange
+from osgeo import gdal
+from functools import lru_cache
+from collections import OrderedDict
+try:
+    import trimesh   # PLY/OBJ DEMs
+except ImportError:
+    trimesh = None
+
+# A gridded DEM is a tuple (heights, geotransform)
+# heights: rows x cols, float32 - unit: m
+# geotransform: GDAL geotransform (X of the left edge, dx, 0, Y of the top edge, 0, -dy) - unit: m
+# Large DEMs are kept in a DemStore, which hands out the DEM under a footprint
+
+# Pyramids of the last DEMs of ray_dem(), see cached_pyramid()
+PYRAMID_CACHE_SIZE = 8
+pyramid_cache = OrderedDict()
+pyramid_lock = threading.Lock()
+
+
+def load_dem(source, geotransform=None, nodata=None):
+    # source: a GDAL raster (e.g. GeoTIFF), a .npy file or an array
+    # .npy files and arrays have to come with their geotransform
+    if isinstance(source, np.ndarray) or str(source).lower().endswith('.npy'):
+        if geotransform is None:
+            raise Exception(" * An invalid DEM!!! Not a raster with a geotransform")
+        heights = np.load(source) if not isinstance(source, np.ndarray) else source
+    else:
+        dem_ds = gdal.Open(str(source))
+        if dem_ds is None:
+            raise Exception(" * An invalid DEM!!! Not a GDAL raster")
+        band = dem_ds.GetRasterBand(1)
+        heights = band.ReadAsArray()
+        geotransform = dem_ds.GetGeoTransform()
+        if nodata is None:
+            nodata = band.GetNoDataValue()
+        dem_ds = None
+
+    if geotransform[2] != 0 or geotransform[4] != 0:
+        raise Exception(" * An invalid DEM!!! Not a north-up raster")
+    heights = np.array(heights, dtype=np.float32)
+
+    # Holes take the mean height, so that every position has a height
+    invalid = ~np.isfinite(heights)
+    if nodata is not None:
+        invalid |= heights == nodata
+    if np.all(invalid):
+        raise Exception(" * An invalid DEM!!! Not a single valid height")
+    heights[invalid] = np.mean(heights[~invalid])
+
+    return heights, np.array(geotransform, dtype=np.float64)
+
+def dem_window(dem, bbox, margin=1):
+    # Rows and columns [row_start, row_end) x [col_start, col_end) of the DEM under the bbox
+    heights, geotransform = dem
+    col_start = int(np.floor((bbox[0, 0] - geotransform[0]) / geotransform[1])) - margin
+    col_end = int(np.ceil((bbox[1, 0] - geotransform[0]) / geotransform[1])) + margin
+    row_start = int(np.floor((bbox[3, 0] - geotransform[3]) / geotransform[5])) - margin
+    row_end = int(np.ceil((bbox[2, 0] - geotransform[3]) / geotransform[5])) + margin
+
+    # Outside the DEM, the heights of its edges are used
+    row_start = min(max(row_start, 0), heights.shape[0] - 1)
+    row_end = min(max(row_end, row_start + 1), heights.shape[0])
+    col_start = min(max(col_start, 0), heights.shape[1] - 1)
+    col_end = min(max(col_end, col_start + 1), heights.shape[1])
+    return row_start, row_end, col_start, col_end
+
+def dem_crop(dem, bbox):
+    # Gridded DEM (heights, geotransform) under the bbox
+    row_start, row_end, col_start, col_end = dem_window(dem, bbox)
+    geotransform = dem[1].copy()
+    geotransform[0] += col_start * geotransform[1]
+    geotransform[3] += row_start * geotransform[5]
+    return dem[0][row_start:row_end, col_start:col_end], geotransform
+
+def dem_statistics(dem, bbox=None):
+    # Lowest, mean and highest heights of the DEM, under the bbox if given - unit: m
+    if isinstance(dem, DemStore):
+        return dem.statistics(bbox)
+    heights = dem[0]
+    if bbox is not None:
+        row_start, row_end, col_start, col_end = dem_window(dem, bbox)
+        heights = heights[row_start:row_end, col_start:col_end]
+    return float(np.min(heights)), float(np.mean(heights)), float(np.max(heights))
+
+@jit(nopython=True, cache=True, inline='always')
+def dem_height(heights, geotransform, x, y):
+    # Bilinear height at the ground coordinates (x, y) - unit: m
+    # Heights are at the centers of the DEM pixels and clamped to the edges of the DEM
+    col_f = (x - geotransform[0]) / geotransform[1] - 0.5
+    row_f = (y - geotransform[3]) / geotransform[5] - 0.5
+    col0 = int(np.floor(col_f))
+    row0 = int(np.floor(row_f))
+    dx = col_f - col0
+    dy = row_f - row0
+    c0 = min(max(col0, 0), heights.shape[1] - 1)
+    c1 = min(max(col0 + 1, 0), heights.shape[1] - 1)
+    r0 = min(max(row0, 0), heights.shape[0] - 1)
+    r1 = min(max(row0 + 1, 0), heights.shape[0] - 1)
+    top = (1 - dx) * heights[r0, c0] + dx * heights[r0, c1]
+    bottom = (1 - dx) * heights[r1, c0] + dx * heights[r1, c1]
+    return (1 - dy) * top + dy * bottom
+
+def dem_pyramid(heights):
+    # Min/max pyramid of the bilinear patches between the centers of the DEM pixels, for ray_dem()
+    # Level 0: lowest and highest corner of every patch, level k + 1: of 2 x 2 cells of level k
+    # pyramid: all levels packed, (lowest, highest) per cell, levels: (offset, rows, cols) of every level
+    if heights.shape[0] < 2 or heights.shape[1] < 2:
+        heights = np.pad(heights, ((0, max(2 - heights.shape[0], 0)), (0, max(2 - heights.shape[1], 0))), mode='edge')
+    levels = [(0, heights.shape[0] - 1, heights.shape[1] - 1)]
+    while levels[-1][1] > 1 or levels[-1][2] > 1:
+        levels.append((levels[-1][0] + levels[-1][1] * levels[-1][2],
+                       (levels[-1][1] + 1) // 2, (levels[-1][2] + 1) // 2))
+    levels = np.array(levels, dtype=np.int64)
+
+    pyramid = np.empty(shape=(levels[-1, 0] + 1, 2), dtype=np.float32)
+    pyramid_parallel(heights, pyramid, levels)
+    return heights, pyramid, levels
+
+@jit(nopython=True, parallel=True, cache=True, nogil=True)
+def pyramid_parallel(heights, pyramid, levels):
+    for row in prange(levels[0, 1]):
+        for col in range(levels[0, 2]):
+            corners = (heights[row, col], heights[row, col + 1], heights[row + 1, col], heights[row + 1, col + 1])
+            pyramid[row * levels[0, 2] + col, 0] = min(corners)
+            pyramid[row * levels[0, 2] + col, 1] = max(corners)
+    for level in range(1, levels.shape[0]):
+        below, rows_below, cols_below = levels[level - 1]
+        for row in prange(levels[level, 1]):
+            for col in range(levels[level, 2]):
+                lowest = np.inf
+                highest = -np.inf
+                for r in range(2 * row, min(2 * row + 2, rows_below)):
+                    for c in range(2 * col, min(2 * col + 2, cols_below)):
+                        lowest = min(lowest, pyramid[below + r * cols_below + c, 0])
+                        highest = max(highest, pyramid[below + r * cols_below + c, 1])
+                cell = levels[level, 0] + row * levels[level, 2] + col
+                pyramid[cell, 0] = lowest
+                pyramid[cell, 1] = highest
+
+@jit(nopython=True, cache=True)
+def patch_hit(heights, row, col, u0, v0, z0, du, dv, dz, t0, t1):
+    # First t in [t0, t1] where the ray meets the bilinear patch (row, col), -1 if none
+    # Along the ray the bilinear height is quadratic in t: f(t) = z - height, from f at both ends and the middle
+    f = np.empty(3)
+    for k in range(3):
+        t = t0 + 0.5 * k * (t1 - t0)
+        x = min(max(u0 + t * du - col, 0.), 1.)
+        y = min(max(v0 + t * dv - row, 0.), 1.)
+        top = (1 - x) * heights[row, col] + x * heights[row, col + 1]
+        bottom = (1 - x) * heights[row + 1, col] + x * heights[row + 1, col + 1]
+        f[k] = z0 + t * dz - ((1 - y) * top + y * bottom)
+    if f[0] <= 0:
+        return t0
+    a = 2 * f[0] - 4 * f[1] + 2 * f[2]
+    b = -3 * f[0] + 4 * f[1] - f[2]
+    s = 2.
+    if abs(a) < 1e-12:
+        if b < 0:
+            s = -f[0] / b
+    else:
+        discriminant = b * b - 4 * a * f[0]
+        if discriminant >= 0:
+            root = np.sqrt(discriminant)
+            for candidate in ((-b - root) / (2 * a), (-b + root) / (2 * a)):
+                if 0 <= candidate < s:
+                    s = candidate
+    if s > 1:
+        return -1.
+    return t0 + s * (t1 - t0)
+
+@jit(nopython=True, parallel=True, cache=True, nogil=True)
+def ray_dem_parallel(heights, geotransform, pyramid, levels, origins, directions):
+    # Intersections of the rays (origins + t * directions, n x 3) with the DEM by a descent of the min/max pyramid
+    # Cells that the ray passes above are skipped at the coarsest level that allows it - unit: m
+    # Rays that miss the DEM (or leave its extent first) return NaN
+    hits = np.full(origins.shape, np.nan)
+    top = levels.shape[0] - 1
+    rows = levels[0, 1]
+    cols = levels[0, 2]
+    for n in prange(origins.shape[0]):
+        # Ray in the coordinates of the patches: u (col), v (row) between the pixel centers, z - unit: px, px, m
+        u0 = (origins[n, 0] - geotransform[0]) / geotransform[1] - 0.5
+        v0 = (origins[n, 1] - geotransform[3]) / geotransform[5] - 0.5
+        z0 = origins[n, 2]
+        du = directions[n, 0] / geotransform[1]
+        dv = directions[n, 1] / geotransform[5]
+        dz = directions[n, 2]
+
+        # Clip the ray to the extent of the patches and to the highest terrain
+        t_start = 0.
+        t_end = np.inf
+        for axis in range(2):
+            p0, dp, size = (u0, du, cols) if axis == 0 else (v0, dv, rows)
+            if dp == 0:
+                if p0 < 0 or p0 > size:
+                    t_end = -1.
+            else:
+                t_start = max(t_start, min(-p0 / dp, (size - p0) / dp))
+                t_end = min(t_end, max(-p0 / dp, (size - p0) / dp))
+        highest = pyramid[levels[top, 0], 1]
+        if dz < 0:
+            t_start = max(t_start, (highest - z0) / dz)
+        elif z0 > highest:
+            t_end = -1.
+        if not t_start < t_end:
+            continue
+
+        t = t_start
+        level = top
+        while t < t_end:
+            size = 1 << level
+            u = u0 + t * du
+            v = v0 + t * dv
+            col = min(max(int(np.floor(u / size)), 0), levels[level, 2] - 1)
+            row = min(max(int(np.floor(v / size)), 0), levels[level, 1] - 1)
+            # Where the ray leaves the cell, nudged along the ray
+            t_exit = t_end
+            if du > 0:
+                t_exit = min(t_exit, ((col + 1) * size - u0) / du)
+            elif du < 0:
+                t_exit = min(t_exit, (col * size - u0) / du)
+            if dv > 0:
+                t_exit = min(t_exit, ((row + 1) * size - v0) / dv)
+            elif dv < 0:
+                t_exit = min(t_exit, (row * size - v0) / dv)
+            t_exit = max(t_exit, t + 1e-9)
+
+            cell = levels[level, 0] + row * levels[level, 2] + col
+            z_enter = z0 + t * dz
+            z_exit = z0 + t_exit * dz
+            if min(z_enter, z_exit) > pyramid[cell, 1]:
+                # Above the highest terrain of the cell: skip it, and try a coarser level for the next one
+                t = t_exit
+                level = min(level + 1, top)
+            elif level > 0 and z_enter >= pyramid[cell, 0]:
+                level -= 1
+            else:
+                # Below the lowest terrain of the cell, the ray is under the terrain where it enters
+                t_hit = t if z_enter < pyramid[cell, 0] else \
+                    patch_hit(heights, row, col, u0, v0, z0, du, dv, dz, t, min(t_exit, t_end))
+                if t_hit >= 0:
+                    hits[n, 0] = origins[n, 0] + t_hit * directions[n, 0]
+                    hits[n, 1] = origins[n, 1] + t_hit * directions[n, 1]
+                    hits[n, 2] = z0 + t_hit * dz
+                    break
+                t = t_exit
+    return hits
+
+def cached_pyramid(heights):
+    # dem_pyramid() of the heights, kept for the last DEMs by their identity (the DEMs are never modified in place,
+    # and the cache keeps them alive so that their identity is not reused)
+    with pyramid_lock:
+        entry = pyramid_cache.get(id(heights))
+        if entry is not None and entry[0] is heights:
+            pyramid_cache.move_to_end(id(heights))
+            return entry[1]
+    pyramid = dem_pyramid(heights)
+    with pyramid_lock:
+        pyramid_cache[id(heights)] = (heights, pyramid)
+        while len(pyramid_cache) > PYRAMID_CACHE_SIZE:
+            pyramid_cache.popitem(last=False)
+    return pyramid
+
+def ray_dem(dem, origins, directions):
+    # Intersections of rays (n x 3 origins and directions) with a gridded DEM (heights, geotransform) - unit: m
+    # The pyramid of the DEM is built on its first rays only, see cached_pyramid()
+    heights, pyramid, levels = cached_pyramid(dem[0])
+    return ray_dem_parallel(heights, dem[1], pyramid, levels,
+                            np.ascontiguousarray(origins, dtype=np.float64).reshape(-1, 3),
+                            np.ascontiguousarray(directions, dtype=np.float64).reshape(-1, 3))
+
+def dem_points(points, gsd):
+    # Points (n x 3, e.g. the vertices of a PLY/OBJ DEM) -> gridded DEM of the mean height per cell of gsd
+    x0 = np.floor(np.min(points[:, 0]) / gsd) * gsd
+    y0 = np.ceil(np.max(points[:, 1]) / gsd) * gsd
+    cols = int((np.max(points[:, 0]) - x0) / gsd) + 1
+    rows = int((y0 - np.min(points[:, 1])) / gsd) + 1
+
+    cells = ((y0 - points[:, 1]) / gsd).astype(np.int64) * cols + ((points[:, 0] - x0) / gsd).astype(np.int64)
+    count = np.bincount(cells, minlength=rows * cols)
+    heights = np.bincount(cells, weights=points[:, 2], minlength=rows * cols)
+    heights[count > 0] /= count[count > 0]
+    heights[count == 0] = np.nan    # holes take the mean height in load_dem()
+
+    return load_dem(heights.reshape(rows, cols), (x0, gsd, 0, y0, 0, -gsd))
+
+class DemStore:
+    # Gridded DEM converted once into square tiles of a memory-mapped file, with a tile index
+    # (lowest, mean and highest height of every tile) and an LRU cache of the tiles in use
+    # <path>/dem.json: geotransform, size and tile size, <path>/tiles.f32: tiles, <path>/index.npy: tile index
+
+    def __init__(self, path, cache_tiles=64):
+        with open(os.path.join(path, 'dem.json')) as f:
+            header = json.load(f)
+        self.path = path
+        self.geotransform = np.array(header['geotransform'], dtype=np.float64)
+        self.rows = header['rows']
+        self.cols = header['cols']
+        self.tile_size = header['tile_size']
+        self.index = np.load(os.path.join(path, 'index.npy'))
+        self.tiles = np.memmap(os.path.join(path, 'tiles.f32'), dtype=np.float32, mode='r',
+                               shape=self.index.shape[0:2] + (self.tile_size, self.tile_size))
+        self.tile = lru_cache(maxsize=cache_tiles)(self._read_tile)
+        self.tile_block = lru_cache(maxsize=4)(self._tile_block)
+
+    @staticmethod
+    def build(source, path, gsd=None, tile_size=256):
+        # source: a GDAL raster, a PLY/OBJ file (with the gsd of its grid - unit: m) or a loaded DEM
+        if isinstance(source, tuple) or os.path.splitext(str(source))[1].lower() in ['.ply', '.obj']:
+            if isinstance(source, tuple):
+                heights, geotransform = source
+            elif trimesh is None:
+                raise Exception(" * An invalid DEM!!! Not available without trimesh")
+            elif gsd is None:
+                raise Exception(" * An invalid DEM!!! Not a point DEM without its gsd")
+            else:
+                heights, geotransform = dem_points(np.asarray(trimesh.load(source).vertices), gsd)
+            rows, cols = heights.shape
+
+            def read(row, tile_rows):
+                return heights[row:row + tile_rows]
+        else:
+            # Read a strip of tiles at a time
+            dem_ds = gdal.Open(str(source))
+            if dem_ds is None:
+                raise Exception(" * An invalid DEM!!! Not a GDAL raster")
+            band = dem_ds.GetRasterBand(1)
+            geotransform = dem_ds.GetGeoTransform()
+            rows, cols = dem_ds.RasterYSize, dem_ds.RasterXSize
+            nodata = band.GetNoDataValue()
+            mean = band.ComputeStatistics(False)[2]
+
+            def read(row, tile_rows):
+                strip = band.ReadAsArray(0, row, cols, min(tile_rows, rows - row)).astype(np.float32)
+                invalid = ~np.isfinite(strip)
+                if nodata is not None:
+                    invalid |= strip == nodata
+                strip[invalid] = mean
+                return strip
+
+        os.makedirs(path, exist_ok=True)
+        tile_rows = (rows + tile_size - 1) // tile_size
+        tile_cols = (cols + tile_size - 1) // tile_size
+        tiles = np.memmap(os.path.join(path, 'tiles.f32'), dtype=np.float32, mode='w+',
+                          shape=(tile_rows, tile_cols, tile_size, tile_size))
+        index = np.empty(shape=(tile_rows, tile_cols, 3), dtype=np.float32)
+        for i in range(tile_rows):
+            strip = read(i * tile_size, tile_size)
+            # Tiles at the edges are padded with the edge heights, as dem_height() clamps to the edges
+            strip = np.pad(strip, ((0, tile_size - strip.shape[0]), (0, tile_cols * tile_size - strip.shape[1])),
+                           mode='edge')
+            for j in range(tile_cols):
+                tiles[i, j] = strip[:, j * tile_size:(j + 1) * tile_size]
+                index[i, j] = np.min(tiles[i, j]), np.mean(tiles[i, j]), np.max(tiles[i, j])
+        tiles.flush()
+        del tiles
+
+        np.save(os.path.join(path, 'index.npy'), index)
+        with open(os.path.join(path, 'dem.json'), 'w') as f:
+            json.dump({'geotransform': [float(g) for g in geotransform], 'rows': rows, 'cols': cols,
+                       'tile_size': tile_size}, f)
+
+    def _read_tile(self, i, j):
+        return np.array(self.tiles[i, j])
+
+    def tile_window(self, bbox=None):
+        # Tiles [i_start, i_end) x [j_start, j_end) under the bbox
+        if bbox is None:
+            return 0, self.index.shape[0], 0, self.index.shape[1]
+        shape = np.broadcast_to(np.float32(0), (self.rows, self.cols))
+        row_start, row_end, col_start, col_end = dem_window((shape, self.geotransform), bbox)
+        return (row_start // self.tile_size, (row_end - 1) // self.tile_size + 1,
+                col_start // self.tile_size, (col_end - 1) // self.tile_size + 1)
+
+    def statistics(self, bbox=None):
+        # Lowest, mean and highest heights of the tiles under the bbox, from the tile index - unit: m
+        i_start, i_end, j_start, j_end = self.tile_window(bbox)
+        index = self.index[i_start:i_end, j_start:j_end]
+        return float(np.min(index[:, :, 0])), float(np.mean(index[:, :, 1])), float(np.max(index[:, :, 2]))
+
+    def window(self, bbox):
+        # Gridded DEM (heights, geotransform) of the tiles under the bbox, from the tile cache
+        # The images on the same tiles share the heights, and so their pyramid for ray_dem()
+        window = self.tile_window(bbox)
+        heights = self.tile_block(*window)
+        i_start, _, j_start, _ = window
+        geotransform = self.geotransform.copy()
+        geotransform[0] += j_start * self.tile_size * geotransform[1]
+        geotransform[3] += i_start * self.tile_size * geotransform[5]
+        return heights, geotransform
+
+    def _tile_block(self, i_start, i_end, j_start, j_end):
+        size = self.tile_size
+        heights = np.empty(shape=((i_end - i_start) * size, (j_end - j_start) * size), dtype=np.float32)
+        for i in range(i_start, i_end):
+            for j in range(j_start, j_end):
+                heights[(i - i_start) * size:(i - i_start + 1) * size,
+                        (j - j_start) * size:(j - j_start + 1) * size] = self.tile(i, j)
+        return heights
+
+@lru_cache(maxsize=None)
+def open_dem_store(source, gsd=None):
+    # DEM store of a source file, converted next to it on the first use and shared by the images
+    # It is built in a directory of its own and then renamed, so that concurrent builds never mix
+    path = os.path.splitext(source)[0] + '.dem'
+    if not os.path.exists(os.path.join(path, 'dem.json')) or \
+            os.path.getmtime(os.path.join(path, 'dem.json')) < os.path.getmtime(source):
+        build_path = tempfile.mkdtemp(prefix=os.path.basename(path) + '.', dir=os.path.dirname(path))
+        try:
+            DemStore.build(source, build_path, gsd)
+            if os.path.exists(path):
+                shutil.rmtree(path, ignore_errors=True)     # outdated
+            os.replace(build_path, path)
+        except OSError:
+            if not os.path.exists(os.path.join(path, 'dem.json')):
+                raise
+        finally:
+            shutil.rmtree(build_path, ignore_errors=True)   # left only by a build that lost the race
+    return DemStore(path)
+
+def open_dem(dem, gsd=None):
+    # A path (a DEM file or a store), a DEM store or a loaded DEM (heights, geotransform) -> DEM for the rectifier
+    if isinstance(dem, str):
+        if os.path.isdir(dem):
+            return DemStore(dem)
+        return open_dem_store(os.path.abspath(dem), gsd)
+    return dem
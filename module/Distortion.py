@@ -0,0 +1,82 @@
+import numpy as np
+from numba import jit
+from functools import lru_cache
+
+# Brown-Conrady lens distortion (k1, k2, k3, p1, p2), in the convention of OpenCV
+# Normalized coordinates: x = (col - cols / 2) / focal_px, y = (row - rows / 2) / focal_px
+# with the principal point at the center of the image, as in the back-projection
+
+
+def lens_distortion(distortion):
+    # None for a pinhole camera (no or all-zero coefficients), a hashable tuple otherwise
+    if distortion is None or not np.any(distortion):
+        return None
+    if len(distortion) != 5:
+        raise Exception(" * An invalid lens distortion!!! Not (k1, k2, k3, p1, p2)")
+    return tuple(float(k) for k in distortion)
+
+def distort_normalized(x, y, distortion):
+    k1, k2, k3, p1, p2 = distortion
+    r2 = x * x + y * y
+    radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+    x_d = x * radial + 2 * p1 * x * y + p2 * (r2 + 2 * x * x)
+    y_d = y * radial + p1 * (r2 + 2 * y * y) + 2 * p2 * x * y
+    return x_d, y_d
+
+def undistort_normalized(x_d, y_d, distortion, iterations=20):
+    # Fixed-point iteration, the same as cv2.undistortPoints
+    k1, k2, k3, p1, p2 = distortion
+    x = x_d
+    y = y_d
+    for _ in range(iterations):
+        r2 = x * x + y * y
+        radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+        x = (x_d - 2 * p1 * x * y - p2 * (r2 + 2 * x * x)) / radial
+        y = (y_d - p1 * (r2 + 2 * y * y) - 2 * p2 * x * y) / radial
+    return x, y
+
+def image_border(rows, cols, samples=16):
+    # Points along the border of the image, clockwise from the upper left - unit: px
+    t = np.linspace(0., 1., samples, endpoint=False)
+    cols_px = np.concatenate((t * cols, np.full(samples, cols), (1 - t) * cols, np.zeros(samples)))
+    rows_px = np.concatenate((np.zeros(samples), t * rows, np.full(samples, rows), (1 - t) * rows))
+    return np.vstack((cols_px, rows_px))   # shape: 2 x (4 x samples)
+
+def undistort_points(points, distortion, focal_px, rows, cols):
+    # Image coordinates (2 x n) -> coordinates of a pinhole camera - unit: px
+    x, y = undistort_normalized((points[0] - cols / 2) / focal_px, (points[1] - rows / 2) / focal_px, distortion)
+    return np.vstack((x * focal_px + cols / 2, y * focal_px + rows / 2))
+
+@lru_cache(maxsize=16)
+def distortion_lut(distortion, focal_px, rows, cols, step=16):
+    # Lookup grid of the distortion per camera model: offsets (dx, dy) from pinhole to image coordinates - unit: px
+    # The grid covers the pinhole coordinates of the whole image, with a margin of two cells
+    # lut_grid: (x, y) of the first node and the spacing of the grid - unit: px
+    border = undistort_points(image_border(rows, cols), distortion, focal_px, rows, cols)
+    x0 = np.floor(np.min(border[0]) / step) * step - 2 * step
+    y0 = np.floor(np.min(border[1]) / step) * step - 2 * step
+    x = np.arange(x0, np.max(border[0]) + 3 * step, step)
+    y = np.arange(y0, np.max(border[1]) + 3 * step, step)
+    x, y = np.meshgrid(x, y)
+
+    x_d, y_d = distort_normalized((x - cols / 2) / focal_px, (y - rows / 2) / focal_px, distortion)
+    lut = np.dstack((x_d * focal_px + cols / 2 - x, y_d * focal_px + rows / 2 - y))
+    return lut, np.array([x0, y0, step], dtype=np.float64)
+
+@jit(nopython=True, cache=True)
+def distort(lut, lut_grid, x, y):
+    # Pinhole -> image coordinates by bilinear interpolation of the lookup grid - unit: px
+    # Outside of the grid, which is outside of the image, returns (-1, -1)
+    gx = (x - lut_grid[0]) / lut_grid[2]
+    gy = (y - lut_grid[1]) / lut_grid[2]
+    col = int(np.floor(gx))
+    row = int(np.floor(gy))
+    if col < 0 or col >= lut.shape[1] - 1 or row < 0 or row >= lut.shape[0] - 1:
+        return -1., -1.
+    dx = gx - col
+    dy = gy - row
+    offset_x = (1 - dy) * ((1 - dx) * lut[row, col, 0] + dx * lut[row, col + 1, 0]) + \
+               dy * ((1 - dx) * lut[row + 1, col, 0] + dx * lut[row + 1, col + 1, 0])
+    offset_y = (1 - dy) * ((1 - dx) * lut[row, col, 1] + dx * lut[row, col + 1, 1]) + \
+               dy * ((1 - dx) * lut[row + 1, col, 1] + dx * lut[row + 1, col + 1, 1])
+    return x + offset_x, y + offset_y
@@ -1,8 +1,16 @@
 import numpy as np
 import math
+import threading
+from contextlib import contextmanager
 from osgeo.osr import SpatialReference, CoordinateTransformation
 import osgeo
 
+# Coordinate transformations are not thread-safe: every thread borrows one of its own from the idle ones of the EPSG
+# (or creates one), and gives it back - so that they are reused by the next threads, e.g. the one of a warm-up by the
+# request and decoding threads, without a lock around the transformations themselves
+_transformations = {}   # EPSG: idle transformations
+_transformation_lock = threading.Lock()    # of the idle lists only
+
 def readEO(path):
     eo_line = np.genfromtxt(path, delimiter='\t',
                             dtype={'names': ('Image', 'Longitude', 'Latitude', 'Height', 'Omega', 'Phi', 'Kappa'),
@@ -18,7 +26,7 @@ def readEO(path):
 
     return eo
 
-def geographic2plane(eo, epsg=5186):
+def plane_transformation(epsg=5186):
     # Define the Plane Coordinate System (e.g. 5186)
     plane = SpatialReference()
     plane.ImportFromEPSG(epsg)
@@ -27,22 +35,41 @@ def geographic2plane(eo, epsg=5186):
     geographic = SpatialReference()
     geographic.ImportFromEPSG(4326)
 
-    coord_transformation = CoordinateTransformation(geographic, plane)
+    return CoordinateTransformation(geographic, plane)
+
+@contextmanager
+def borrowed_transformation(epsg=5186):
+    with _transformation_lock:
+        idle = _transformations.setdefault(epsg, [])
+        coord_transformation = idle.pop() if idle else None
+    if coord_transformation is None:
+        coord_transformation = plane_transformation(epsg)
+    try:
+        yield coord_transformation
+    finally:
+        with _transformation_lock:
+            _transformations[epsg].append(coord_transformation)
+
+def warmup_transformation(epsg=5186):
+    with borrowed_transformation(epsg):
+        pass
 
-    # Check the transformation for a point close to the centre of the projected grid
-    if int(osgeo.__version__[0]) >= 3:  # version 3.x
-        if str(epsg).startswith("51"):  # for Korean CRS only (temporarily) ... TODO: for whole CRS
-            # Transform(y,x) will return y, x (Northing, Easting)
-            yx = coord_transformation.TransformPoint(float(eo[1]), float(eo[0]))  # The order: Lat, Lon
-            eo[0:2] = yx[0:2][::-1]
-        else:
-            # Transform(y,x) will return x,y (Easting, Northing)
-            xy = coord_transformation.TransformPoint(float(eo[1]), float(eo[0]))  # The order: Lat, Lon
+def geographic2plane(eo, epsg=5186):
+    with borrowed_transformation(epsg) as coord_transformation:
+        # Check the transformation for a point close to the centre of the projected grid
+        if int(osgeo.__version__[0]) >= 3:  # version 3.x
+            if str(epsg).startswith("51"):  # for Korean CRS only (temporarily) ... TODO: for whole CRS
+                # Transform(y,x) will return y, x (Northing, Easting)
+                yx = coord_transformation.TransformPoint(float(eo[1]), float(eo[0]))  # The order: Lat, Lon
+                eo[0:2] = yx[0:2][::-1]
+            else:
+                # Transform(y,x) will return x,y (Easting, Northing)
+                xy = coord_transformation.TransformPoint(float(eo[1]), float(eo[0]))  # The order: Lat, Lon
+                eo[0:2] = xy[0:2]
+        else:  # version 2.x
+            # Transform(x,y) will return x,y (Easting, Northing)
+            xy = coord_transformation.TransformPoint(float(eo[0]), float(eo[1]))  # The order: Lon, Lat
             eo[0:2] = xy[0:2]
-    else:  # version 2.x
-        # Transform(x,y) will return x,y (Easting, Northing)
-        xy = coord_transformation.TransformPoint(float(eo[0]), float(eo[1]))  # The order: Lon, Lat
-        eo[0:2] = xy[0:2]
 
     return eo
 
@@ -1,7 +1,24 @@
+import io
+import re
+import struct
 import cv2
 import numpy as np
 import pyexiv2
 
+# Tags of get_metadata(), read from the APP1 segments of JPEGs without pyexiv2 - see read_jpeg_header()
+EXIF_TAGS = {'Image': {0x010F: 'Exif.Image.Make', 0x0112: 'Exif.Image.Orientation'},
+             'Photo': {0x920A: 'Exif.Photo.FocalLength'},
+             'GPSInfo': {0x0001: 'Exif.GPSInfo.GPSLatitudeRef', 0x0002: 'Exif.GPSInfo.GPSLatitude',
+                         0x0003: 'Exif.GPSInfo.GPSLongitudeRef', 0x0004: 'Exif.GPSInfo.GPSLongitude',
+                         0x0006: 'Exif.GPSInfo.GPSAltitude'}}
+EXIF_POINTERS = {0x8769: 'Photo', 0x8825: 'GPSInfo'}
+XMP_TAGS = ['Xmp.drone-dji.RelativeAltitude', 'Xmp.drone-dji.GimbalRollDegree', 'Xmp.drone-dji.GimbalPitchDegree',
+            'Xmp.drone-dji.GimbalYawDegree', 'Xmp.DLS.Roll', 'Xmp.DLS.Pitch', 'Xmp.DLS.Yaw']
+# Value after prefix:name in an XMP packet: an attribute (="value") or an element (>value<)
+XMP_VALUE = re.compile(r'\s*=\s*"([^"]*)"|>([^<]*)<')
+# Bytes per value of the TIFF types: BYTE, ASCII, SHORT, LONG, RATIONAL, SBYTE, UNDEFINED, SSHORT, SLONG, SRATIONAL
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8}
+
 
 def restoreOrientation(image, orientation):
     if orientation == 8:
@@ -15,6 +32,22 @@ def restoreOrientation(image, orientation):
 
     return restored_image
 
+def orientation_rotation(orientation):
+    # Rotation of the camera coordinates into those of the image as stored, for the EXIF orientation 3/6/8
+    # that restoreOrientation() would rotate the image by - R of the stored image: orientation_rotation() @ R
+    # so that the stored image is sampled directly, without a rotated copy
+    if orientation == 8:
+        return np.array([[0., -1., 0.], [1., 0., 0.], [0., 0., 1.]])
+    elif orientation == 6:
+        return np.array([[0., 1., 0.], [-1., 0., 0.], [0., 0., 1.]])
+    elif orientation == 3:
+        return np.diag([-1., -1., 1.])
+    return np.eye(3)
+
+def restored_cols(shape, orientation):
+    # Columns of the image of the shape (rows, cols, ...) restored by its orientation, for the pixel size
+    return shape[0] if orientation in [6, 8] else shape[1]
+
 def rotate(image, angle):
     # https://www.pyimagesearch.com/2017/01/02/rotate-images-correctly-with-opencv-and-python/
 
@@ -41,12 +74,166 @@ def rotate(image, angle):
     rotated_mat = cv2.warpAffine(image, rotation_mat, (bound_w, bound_h))
     return rotated_mat
 
-def get_metadata(input_file):
-    img = pyexiv2.Image(input_file)
+# cv2.imread flags of the reduced JPEG decodes (1/2, 1/4, 1/8 scale), decoded by libjpeg at the lower resolution
+# The EXIF orientation is left to restoreOrientation(), as with IMREAD_UNCHANGED
+IMREAD_REDUCED = {1: cv2.IMREAD_UNCHANGED,
+                  2: cv2.IMREAD_REDUCED_COLOR_2 | cv2.IMREAD_IGNORE_ORIENTATION,
+                  4: cv2.IMREAD_REDUCED_COLOR_4 | cv2.IMREAD_IGNORE_ORIENTATION,
+                  8: cv2.IMREAD_REDUCED_COLOR_8 | cv2.IMREAD_IGNORE_ORIENTATION}
+# ... of single-channel JPEGs, which IMREAD_UNCHANGED keeps single-channel too
+IMREAD_REDUCED_GRAYSCALE = {1: cv2.IMREAD_UNCHANGED,
+                            2: cv2.IMREAD_REDUCED_GRAYSCALE_2 | cv2.IMREAD_IGNORE_ORIENTATION,
+                            4: cv2.IMREAD_REDUCED_GRAYSCALE_4 | cv2.IMREAD_IGNORE_ORIENTATION,
+                            8: cv2.IMREAD_REDUCED_GRAYSCALE_8 | cv2.IMREAD_IGNORE_ORIENTATION}
+
+def open_metadata(input_file):
+    # pyexiv2 image of a file, or of an in-memory buffer (bytes, bytearray, memoryview or mmap) without a disk read
+    if isinstance(input_file, str):
+        return pyexiv2.Image(input_file)
+    return pyexiv2.ImageData(bytes(input_file))
+
+def get_image_size(input_file):
+    # rows, cols of the image, from its header - unit: px
+    try:
+        size = read_jpeg_header(input_file)[2]
+        if size is not None:
+            return size
+    except (ValueError, IndexError, struct.error):
+        pass
+    img = open_metadata(input_file)
+    rows, cols = img.get_pixel_height(), img.get_pixel_width()
+    img.close()
+    return rows, cols
+
+def decode_scale(gsd, pixel_size, flying_height, focal_length):
+    # Largest reduced decode (1, 2, 4 or 8) whose GSD is still not coarser than the gsd of the orthophoto
+    # pixel_size: of the full resolution - unit: m/px, flying_height: above the ground - unit: m
+    if gsd <= 0 or flying_height <= 0:    # native GSD, or no height above the ground
+        return 1
+    native_gsd = pixel_size * flying_height / focal_length
+    scale = 1
+    while scale < 8 and native_gsd * scale * 2 <= gsd:
+        scale *= 2
+    return scale
 
-    exif = img.read_exif()
-    xmp = img.read_xmp()
+def reduced_flags(input_file, scale):
+    # cv2.imread flags of a JPEG decoded at 1/scale, of the bands of the JPEG (its SOF components)
+    if scale == 1:
+        return IMREAD_REDUCED[1]
+    try:
+        components = read_jpeg_header(input_file)[3]
+    except (ValueError, IndexError, struct.error):
+        components = None
+    return (IMREAD_REDUCED_GRAYSCALE if components == 1 else IMREAD_REDUCED)[scale]
+
+def read_image(input_file, scale=1):
+    # Image (a file or an in-memory buffer) decoded at 1/scale of its resolution - only JPEGs are decoded reduced
+    # The bands are the same at every scale: grayscale JPEGs stay single-channel
+    if isinstance(input_file, str):
+        if not input_file.lower().endswith(('.jpg', '.jpeg')):
+            scale = 1
+        return cv2.imread(input_file, reduced_flags(input_file, scale))
+
+    buffer = np.frombuffer(input_file, dtype=np.uint8)
+    if buffer[:2].tobytes() != b'\xff\xd8':   # JPEG SOI marker
+        scale = 1
+    image = cv2.imdecode(buffer, reduced_flags(input_file, scale))
+    if image is None:
+        raise Exception(" * An invalid image!!! Not a buffer of an image format of OpenCV")
+    return image
+
+def read_jpeg_header(input_file):
+    # EXIF_TAGS, XMP_TAGS, the size (rows, cols) and the components (bands) of a JPEG (a path or an in-memory buffer),
+    # from the segments before the image data - the values are strings in the format of pyexiv2
+    if isinstance(input_file, str):
+        f = open(input_file, 'rb')
+    else:
+        f = io.BytesIO(input_file if isinstance(input_file, bytes) else bytes(input_file))
+    with f:
+        if f.read(2) != b'\xff\xd8':
+            raise ValueError(" * An invalid JPEG!!! Not a SOI marker")
+        exif = {}
+        xmp = {}
+        size = None
+        components = None
+        while True:
+            marker, length = struct.unpack('>2sH', f.read(4))
+            if marker[0] != 0xFF or marker[1] in [0xD9, 0xDA]:   # end of the header: EOI, SOS
+                break
+            if marker[1] == 0xE1:   # APP1: EXIF or XMP
+                data = f.read(length - 2)
+                if data.startswith(b'Exif\x00\x00'):
+                    exif.update(read_exif_tags(data[6:]))
+                elif data.startswith(b'http://ns.adobe.com/xap/1.0/\x00'):
+                    xmp.update(read_xmp_tags(data[29:].decode('utf-8', 'replace')))
+            elif 0xC0 <= marker[1] <= 0xCF and marker[1] not in [0xC4, 0xC8, 0xCC]:   # SOF
+                rows, cols, components = struct.unpack('>xHHB', f.read(6))
+                size = rows, cols
+                f.seek(length - 8, 1)
+            else:
+                f.seek(length - 2, 1)
+    return exif, xmp, size, components
+
+def read_exif_tags(tiff):
+    # EXIF_TAGS of the TIFF structure of an EXIF segment
+    endian = '<' if tiff[0:2] == b'II' else '>'
+    tags = {}
+    ifds = [('Image', struct.unpack(endian + 'I', tiff[4:8])[0])]
+    while ifds:
+        ifd, offset = ifds.pop()
+        for n in range(struct.unpack(endian + 'H', tiff[offset:offset + 2])[0]):
+            entry = tiff[offset + 2 + 12 * n:offset + 14 + 12 * n]
+            tag, tiff_type, count = struct.unpack(endian + 'HHI', entry[0:8])
+            if ifd == 'Image' and tag in EXIF_POINTERS:
+                ifds.append((EXIF_POINTERS[tag], struct.unpack(endian + 'I', entry[8:12])[0]))
+            if tag not in EXIF_TAGS[ifd] or tiff_type not in TIFF_TYPE_SIZES:
+                continue
+            size = TIFF_TYPE_SIZES[tiff_type] * count
+            if size > 4:
+                value_offset = struct.unpack(endian + 'I', entry[8:12])[0]
+                value = tiff[value_offset:value_offset + size]
+            else:
+                value = entry[8:8 + size]
+
+            if tiff_type == 2:      # ASCII
+                tags[EXIF_TAGS[ifd][tag]] = value.split(b'\x00')[0].decode('latin-1').strip()
+            elif tiff_type in [5, 10]:  # (S)RATIONAL: "numerator/denominator ..."
+                values = struct.unpack(endian + ('I' if tiff_type == 5 else 'i') * 2 * count, value)
+                tags[EXIF_TAGS[ifd][tag]] = ' '.join('%d/%d' % values[2 * k:2 * k + 2] for k in range(count))
+            else:
+                values = struct.unpack(endian + {1: 'B', 3: 'H', 4: 'I', 6: 'b', 7: 'B', 8: 'h', 9: 'i'}[tiff_type]
+                                       * count, value)
+                tags[EXIF_TAGS[ifd][tag]] = ' '.join(str(v) for v in values)
+    return tags
+
+def read_xmp_tags(packet):
+    # XMP_TAGS of an XMP packet
+    tags = {}
+    for key in XMP_TAGS:
+        name = key[4:].replace('.', ':', 1)
+        start = packet.find(name)
+        while start >= 0:
+            match = XMP_VALUE.match(packet, start + len(name))
+            if match and (start == 0 or packet[start - 1] in ' \t\r\n<'):
+                tags[key] = (match.group(1) if match.group(1) is not None else match.group(2)).strip()
+                break
+            start = packet.find(name, start + len(name))
+    return tags
+
+def get_metadata(input_file):
+    # input_file: a path or an in-memory buffer, see open_metadata()
+    # The tags are read from the header of a JPEG directly, or by pyexiv2 (other formats, or tags not found there)
+    try:
+        exif, xmp = read_jpeg_header(input_file)[0:2]
+        return parse_metadata(exif, xmp)
+    except (KeyError, ValueError, IndexError, struct.error):
+        img = open_metadata(input_file)
+        exif = img.read_exif()
+        xmp = img.read_xmp()
+        img.close()
+        return parse_metadata(exif, xmp)
 
+def parse_metadata(exif, xmp):
     focal_length = convert_string_to_float(exif['Exif.Photo.FocalLength']) / 1000    # unit: m
     orientation = int(exif['Exif.Image.Orientation'])
     maker = exif["Exif.Image.Make"]
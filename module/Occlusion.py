@@ -0,0 +1,99 @@
+import numpy as np
+from numba import jit, prange
+
+# Z-buffer of a DSM in the image, for true orthophotos
+# The DSM cells are projected into the pinhole image coordinates (before the lens distortion), and every cell of
+# the Z-buffer keeps the lowest depth (distance along the optical axis) of the DSM cells projected into it
+# zbuffer_grid: size of the Z-buffer cells - unit: px, and the depth tolerance of the visibility test - unit: m
+# Both come from the DSM, not from the orthophoto: a Z-buffer cell is the image footprint of ZBUFFER_CELLS DSM cells
+# at the lowest depth in the image, so that the projected DSM leaves no holes in the Z-buffer
+
+ZBUFFER_CELLS = 1.5
+
+
+def occlusion_zbuffer(dem, eo, R, focal_length, pixel_size, image_rows, image_cols, tolerance=None):
+    # Z-buffer of the gridded DEM (heights, geotransform) in the image
+    # tolerance: depth below the Z-buffer that is still visible, two Z-buffer cells on the ground by default - unit: m
+    if tolerance is None:
+        tolerance = 2 * ZBUFFER_CELLS * max(abs(dem[1][1]), abs(dem[1][5]))
+    zbuffer, cell = zbuffer_parallel(dem[0], dem[1], eo, R, focal_length, pixel_size, image_rows, image_cols,
+                                     ZBUFFER_CELLS)
+    return zbuffer, np.array([cell, tolerance], dtype=np.float64)
+
+@jit(nopython=True, parallel=True, cache=True, nogil=True)
+def zbuffer_parallel(heights, geotransform, eo, R, focal_length, pixel_size, image_rows, image_cols, cells_per_cell):
+    # Z-buffer and the size of its cells - unit: px, of cells_per_cell DSM cells at the lowest depth in the image
+
+    # 1. Project the DSM cells: image coordinates and depth of each, -1 outside of the image
+    xs = np.empty(heights.size)
+    ys = np.empty(heights.size)
+    depths = np.full(heights.size, -1.)
+    row_depths = np.full(heights.shape[0], np.inf)
+    for row in prange(heights.shape[0]):
+        for col in range(heights.shape[1]):
+            proj_coords_x = geotransform[0] + (col + 0.5) * geotransform[1] - eo[0]
+            proj_coords_y = geotransform[3] + (row + 0.5) * geotransform[5] - eo[1]
+            proj_coords_z = heights[row, col] - eo[2]
+
+            coord_CCS_m_x = R[0, 0] * proj_coords_x + R[0, 1] * proj_coords_y + R[0, 2] * proj_coords_z
+            coord_CCS_m_y = R[1, 0] * proj_coords_x + R[1, 1] * proj_coords_y + R[1, 2] * proj_coords_z
+            coord_CCS_m_z = R[2, 0] * proj_coords_x + R[2, 1] * proj_coords_y + R[2, 2] * proj_coords_z
+            if coord_CCS_m_z >= 0:  # behind the camera
+                continue
+
+            scale = coord_CCS_m_z / (-focal_length)
+            x = image_cols / 2 + coord_CCS_m_x / scale / pixel_size
+            y = image_rows / 2 - coord_CCS_m_y / scale / pixel_size
+            if x < 0 or x >= image_cols or y < 0 or y >= image_rows:
+                continue
+            n = row * heights.shape[1] + col
+            xs[n] = x
+            ys[n] = y
+            depths[n] = -coord_CCS_m_z
+            row_depths[row] = min(row_depths[row], depths[n])
+
+    # The projected size of a DSM cell is the largest at the lowest depth
+    min_depth = np.min(row_depths) if heights.shape[0] > 0 else np.inf
+    cell = 1.
+    if min_depth < np.inf:
+        dem_cell = max(abs(geotransform[1]), abs(geotransform[5]))
+        cell = max(1., np.ceil(cells_per_cell * dem_cell * focal_length / (pixel_size * min_depth)))
+    zbuffer_rows = int(np.ceil(image_rows / cell))
+    zbuffer_cols = int(np.ceil(image_cols / cell))
+    cells = np.full(heights.size, -1, dtype=np.int64)
+    for n in prange(heights.size):
+        if depths[n] >= 0:
+            cells[n] = min(int(ys[n] / cell), zbuffer_rows - 1) * zbuffer_cols + min(int(xs[n] / cell),
+                                                                                       zbuffer_cols - 1)
+
+    # 2. Counting sort of the projected cells by the rows of the Z-buffer
+    starts = np.zeros(zbuffer_rows + 1, dtype=np.int64)
+    for n in range(cells.size):
+        if cells[n] >= 0:
+            starts[cells[n] // zbuffer_cols + 1] += 1
+    for zrow in range(zbuffer_rows):
+        starts[zrow + 1] += starts[zrow]
+    order = np.empty(starts[zbuffer_rows], dtype=np.int64)
+    fill = starts[:-1].copy()
+    for n in range(cells.size):
+        if cells[n] >= 0:
+            order[fill[cells[n] // zbuffer_cols]] = n
+            fill[cells[n] // zbuffer_cols] += 1
+
+    # 3. Lowest depth per cell, a row of the Z-buffer per thread
+    zbuffer = np.full((zbuffer_rows, zbuffer_cols), np.inf)
+    for zrow in prange(zbuffer_rows):
+        for k in range(starts[zrow], starts[zrow + 1]):
+            n = order[k]
+            zcol = cells[n] % zbuffer_cols
+            zbuffer[zrow, zcol] = min(zbuffer[zrow, zcol], depths[n])
+    return zbuffer, cell
+
+@jit(nopython=True, cache=True, inline='always')
+def visible(zbuffer, zbuffer_grid, x, y, depth):
+    # Visibility of a ground point of the depth (unit: m) at the pinhole image coordinates (x, y) - unit: px
+    zrow = int(y / zbuffer_grid[0])
+    zcol = int(x / zbuffer_grid[0])
+    if y < 0 or x < 0 or zrow >= zbuffer.shape[0] or zcol >= zbuffer.shape[1]:
+        return True
+    return depth <= zbuffer[zrow, zcol] + zbuffer_grid[1]
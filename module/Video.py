@@ -0,0 +1,113 @@
+import re
+import csv
+import cv2
+import numpy as np
+
+# Drone videos and their telemetry (DJI SRT subtitles, or CSV flight logs)
+# telemetry: (time, longitude, latitude, altitude, roll, pitch, yaw) per record - unit: s, deg, m, deg
+# The gimbal yaw is unwrapped, so that it is interpolated across +-180 degrees
+
+# SRT fields of the DJI formats: [latitude: 37.1] [longitude: 127.1] [rel_alt: 100.0 abs_alt: 150.0]
+# [gb_yaw: -90.0 gb_pitch: -90.0 gb_roll: 0.0] of the recent drones, and GPS(127.1,37.1,19) BAROMETER:100.0 of older ones
+SRT_TIME = re.compile(r'(\d+):(\d+):(\d+)[,.](\d+)\s*-->')
+SRT_FIELDS = {'longitude': re.compile(r'\blongitude\s*:\s*(-?[\d.]+)'),
+              'latitude': re.compile(r'\blatitude\s*:\s*(-?[\d.]+)'),
+              'altitude': re.compile(r'\brel_alt\s*:\s*(-?[\d.]+)|\bBAROMETER\s*:\s*(-?[\d.]+)|'
+                                     r'\baltitude\s*:\s*(-?[\d.]+)'),
+              'roll': re.compile(r'\bgb_roll\s*:\s*(-?[\d.]+)'),
+              'pitch': re.compile(r'\bgb_pitch\s*:\s*(-?[\d.]+)'),
+              'yaw': re.compile(r'\bgb_yaw\s*:\s*(-?[\d.]+)')}
+SRT_GPS = re.compile(r'GPS\s*\(\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)')
+# Columns of a CSV flight log for the fields of the telemetry
+CSV_COLUMNS = {'time': 'time', 'longitude': 'longitude', 'latitude': 'latitude', 'altitude': 'altitude',
+               'roll': 'gimbal_roll', 'pitch': 'gimbal_pitch', 'yaw': 'gimbal_yaw'}
+TELEMETRY_FIELDS = ['time', 'longitude', 'latitude', 'altitude', 'roll', 'pitch', 'yaw']
+
+
+def srt_value(pattern, text):
+    match = pattern.search(text)
+    if match is None:
+        return np.nan
+    return float(next(group for group in match.groups() if group is not None))
+
+def read_srt(srt_path):
+    # Telemetry of the cues of a DJI SRT, at the start time of each cue
+    with open(srt_path, encoding='utf-8', errors='ignore') as f:
+        cues = re.split(r'\n\s*\n', f.read())
+
+    telemetry = []
+    for cue in cues:
+        match = SRT_TIME.search(cue)
+        if match is None:
+            continue
+        hours, minutes, seconds, milliseconds = match.groups()
+        record = [int(hours) * 3600 + int(minutes) * 60 + int(seconds) + int(milliseconds) / 10 ** len(milliseconds)]
+        record += [srt_value(SRT_FIELDS[field], cue) for field in TELEMETRY_FIELDS[1:]]
+        gps = SRT_GPS.search(cue)
+        if gps is not None and np.isnan(record[1]):
+            record[1:3] = [float(gps.group(1)), float(gps.group(2))]
+        telemetry.append(record)
+    return np.array(telemetry, dtype=np.float64).reshape(-1, len(TELEMETRY_FIELDS))
+
+def read_csv(csv_path, columns=None, time_scale=1.):
+    # Telemetry of a CSV flight log, of the columns (see CSV_COLUMNS) and the time in time_scale s
+    columns = CSV_COLUMNS if columns is None else columns
+    telemetry = []
+    with open(csv_path, newline='', encoding='utf-8', errors='ignore') as f:
+        for row in csv.DictReader(f):
+            telemetry.append([float(row[columns[field]]) if row.get(columns[field], '') != '' else np.nan
+                              for field in TELEMETRY_FIELDS])
+    telemetry = np.array(telemetry, dtype=np.float64).reshape(-1, len(TELEMETRY_FIELDS))
+    telemetry[:, 0] *= time_scale
+    return telemetry
+
+def read_telemetry(telemetry_path, gimbal=None, columns=None, time_scale=1.):
+    # Telemetry of an SRT or a CSV, sorted by time
+    # gimbal: (roll, pitch, yaw) for the records without gimbal angles, e.g. (0, -90, 0) - unit: deg
+    if telemetry_path.lower().endswith('.srt'):
+        telemetry = read_srt(telemetry_path)
+    else:
+        telemetry = read_csv(telemetry_path, columns, time_scale)
+    if gimbal is not None:
+        for n in range(3):
+            telemetry[np.isnan(telemetry[:, 4 + n]), 4 + n] = gimbal[n]
+
+    telemetry = telemetry[~np.isnan(telemetry[:, 0:4]).any(axis=1)]
+    if telemetry.shape[0] == 0:
+        raise Exception(" * An invalid telemetry!!! Not a record of time, position and altitude")
+    if np.isnan(telemetry[:, 4:7]).any():
+        raise Exception(" * An invalid telemetry!!! Not gimbal angles for every record, without a default gimbal")
+    telemetry = telemetry[np.argsort(telemetry[:, 0], kind='stable')]
+    telemetry[:, 6] = np.degrees(np.unwrap(np.radians(telemetry[:, 6])))
+    return telemetry
+
+def interpolate_pose(telemetry, time):
+    # (longitude, latitude, altitude, roll, pitch, yaw) at the time, linear between the records - unit: deg, m
+    # Clamped to the first and the last records
+    return np.array([np.interp(time, telemetry[:, 0], telemetry[:, n]) for n in range(1, len(TELEMETRY_FIELDS))])
+
+def video_frames(video_path, step=1):
+    # Stream every step-th frame of a video: (index, time, frame) - unit: s
+    # The frames in between are only grabbed, not decoded
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise Exception(" * An invalid video!!! Not a video of OpenCV")
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    index = 0
+    try:
+        while capture.grab():
+            if index % step == 0:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                time = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000 if fps <= 0 else index / fps
+                yield index, time, frame
+            index += 1
+    finally:
+        capture.release()
+
+def video_poses(video_path, telemetry, step=1, time_offset=0.):
+    # Stream every step-th frame of a video with its interpolated pose: (index, time, frame, pose)
+    # time_offset: time of the first frame in the telemetry - unit: s
+    for index, time, frame in video_frames(video_path, step):
+        yield index, time, frame, interpolate_pose(telemetry, time + time_offset)
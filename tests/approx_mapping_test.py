@@ -0,0 +1,50 @@
+import time
+import numpy as np
+from module.BackprojectionResample import rectify
+from module.EoData import Rot3D
+
+# Approximate mapping on the control grid against the exact mapping, with a rough DEM and the lens distortion
+# The image is a ramp of its own coordinates, so that the bilinear orthophoto is the mapping itself - unit: px
+# Synthetic terrain around EPSG 5186 (200000, 500000)
+
+if __name__ == '__main__':
+    rows, cols = 1500, 2000
+    y, x = np.mgrid[0:rows, 0:cols].astype(np.float32)
+    image = np.dstack((x, y, np.zeros_like(x)))
+    band_map = np.array([0, 1, 2])
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:400, 0:400]
+    heights = (15 * np.sin(x / 20) * np.cos(y / 25) + rng.normal(0, 0.5, (400, 400))).astype(np.float32)
+    dem = (heights, np.array([199900., 0.5, 0., 500100., 0., -0.5]))  # unit: m
+    distortion = (-0.1, 0.05, -0.01, 0.001, -0.0005)
+    focal_length, pixel_size, gsd = 0.0045, 6.3e-3 / cols, 0.1
+
+    eo = np.array([200000., 500000., 150., np.radians(2), np.radians(-3), np.radians(10)])
+    R = Rot3D(eo)
+    bbox = np.array([[199940.], [200060.], [499955.], [500045.]])
+    boundary_rows, boundary_cols = 900, 1200
+    for name, dem_case, distortion_case in [("DEM", dem, None), ("distortion", None, distortion),
+                                            ("DEM and distortion", dem, distortion)]:
+        for max_error in [None, 0.125]:
+            rectify(bbox, 16, 16, gsd, eo, 0., R, focal_length, pixel_size, image, "bilinear", band_map=band_map,
+                    dem=dem_case, distortion=distortion_case, max_error=max_error)
+        start_time = time.time()
+        exact = rectify(bbox, boundary_rows, boundary_cols, gsd, eo, 0., R, focal_length, pixel_size, image,
+                        "bilinear", band_map=band_map, dem=dem_case, distortion=distortion_case)
+        exact_time = time.time() - start_time
+
+        # Within the image, away from its edges (clamped by the interpolation)
+        inside = (exact[:, :, 3] > 0) & (exact[:, :, 0] > 2) & (exact[:, :, 0] < cols - 3) & \
+                 (exact[:, :, 1] > 2) & (exact[:, :, 1] < rows - 3)
+        for max_error in [0.125, 0.5]:
+            start_time = time.time()
+            approx = rectify(bbox, boundary_rows, boundary_cols, gsd, eo, 0., R, focal_length, pixel_size, image,
+                             "bilinear", band_map=band_map, dem=dem_case, distortion=distortion_case,
+                             max_error=max_error)
+            approx_time = time.time() - start_time
+            error = np.abs(approx[:, :, 0:2] - exact[:, :, 0:2])[inside].max()
+            print('%s, max_error %.3f px: %.4f px, %.4f / %.4f seconds (exact / approximate)'
+                  % (name, max_error, error, exact_time, approx_time))
+            assert error <= max_error
+
+    print('End of Test')
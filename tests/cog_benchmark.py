@@ -0,0 +1,52 @@
+import os
+import time
+import cv2
+import numpy as np
+from osgeo import gdal
+from module.BackprojectionResample import createGeoTiffInterleaved, createCOG, COG_COMPRESSION
+from tabulate import tabulate
+
+# Write time and file size of the output profiles, on an orthophoto-like raster of the sample JPEG
+# (the image with the alpha of a rotated footprint)
+
+if __name__ == '__main__':
+    image = cv2.imread('./20191011_074853.JPG', cv2.IMREAD_COLOR)
+    rows, cols = image.shape[:2]
+    alpha = np.zeros((rows, cols), dtype=np.uint8)
+    box = cv2.boxPoints(((cols / 2, rows / 2), (cols * 0.8, rows * 0.6), 30))
+    cv2.fillPoly(alpha, [box.astype(np.int32)], 255)
+    ortho = np.dstack((image[:, :, ::-1], alpha))  # RGBA
+    ortho[alpha == 0] = 0
+    boundary = np.array([[200000.], [200000. + cols * 0.05], [500000. - rows * 0.05], [500000.]])
+
+    output_folder = './cog_benchmark'
+    if not os.path.exists(output_folder):
+        os.mkdir(output_folder)
+
+    results = []
+    dst = os.path.join(output_folder, 'GTiff')
+    start_time = time.time()
+    createGeoTiffInterleaved(ortho, boundary, 0.05, 5186, dst)
+    gtiff_time = time.time() - start_time
+    gtiff_size = os.path.getsize(dst + '.tif')
+    results.append(['GTiff', gtiff_time, gtiff_size / 2 ** 20, 1.])
+
+    for compression in COG_COMPRESSION:
+        dst = os.path.join(output_folder, 'COG-' + compression)
+        start_time = time.time()
+        createCOG(ortho, boundary, 0.05, 5186, dst, compression)
+        write_time = time.time() - start_time
+        size = os.path.getsize(dst + '.tif')
+        results.append(['COG-' + compression, write_time, size / 2 ** 20, gtiff_size / size])
+
+        # Internal overviews and the 1-bit mask instead of the alpha band
+        ds = gdal.Open(dst + '.tif')
+        assert ds.RasterCount == 3
+        assert ds.GetRasterBand(1).GetOverviewCount() > 0
+        assert ds.GetRasterBand(1).GetMaskFlags() == gdal.GMF_PER_DATASET
+        assert np.array_equal(ds.GetRasterBand(1).GetMaskBand().ReadAsArray() > 0, alpha > 0)
+        ds = None
+
+    print(tabulate(results, headers=["Profile", "Write(s)", "Size(MB)", "Smaller by"], tablefmt='psql',
+                   floatfmt=".3f"))
+    print('End of Test')
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import numpy as np
+import cv2
+from osgeo import gdal
+from main import lens_distortion_params
+from main_dg import orthophoto_process_custom_input
+
+# Lens distortion of the custom endpoints: the coefficients of the query down to the orthophoto
+# A nadir image of a checkerboard, with and without a barrel distortion, which widens the footprint on the ground
+
+if __name__ == '__main__':
+    pinhole = lens_distortion_params(k1=0., k2=0., k3=0., p1=0., p2=0.)
+    distortion = lens_distortion_params(k1=-0.1, k2=0.02, k3=0., p1=0.001, p2=0.)
+    assert distortion == (-0.1, 0.02, 0., 0.001, 0.)
+
+    rows, cols = 600, 800
+    y, x = np.mgrid[0:rows, 0:cols]
+    image = np.dstack([((x // 50 + y // 50) % 2 * 255).astype(np.uint8)] * 3)
+    image_buffer = cv2.imencode('.jpg', image)[1].tobytes()
+
+    folder = tempfile.mkdtemp()
+    gsd = 0.25
+    areas = []
+    for name, coefficients in [("pinhole", pinhole), ("distortion", distortion)]:
+        orthophoto_process_custom_input(image_buffer, 200000., 500000., 150., 0.0045, 0., -90., 0., 0., 6.3, 5186,
+                                        gsd, folder, image_name=name + '.jpg', distortion=coefficients)
+        ortho = gdal.Open(os.path.join(folder, name + '.tif')).ReadAsArray()
+        areas.append(np.count_nonzero(ortho[-1]) * gsd ** 2)
+        print(name, coefficients, 'footprint: %.1f m2' % areas[-1])
+
+    assert areas[1] > 1.05 * areas[0]
+    print('End of Test')
@@ -0,0 +1,81 @@
+import time
+import numpy as np
+from module.BackprojectionResample import rectify, MappingCache, snap_boundary
+from module.EoData import Rot3D
+
+# Approximate mapping of consecutive video-like frames with and without the mapping cache, against the exact mapping
+# The image is a ramp of its own coordinates, so that the bilinear orthophoto is the mapping itself - unit: px
+# Synthetic terrain around EPSG 5186 (200000, 500000)
+
+if __name__ == '__main__':
+    rows, cols = 1500, 2000
+    y, x = np.mgrid[0:rows, 0:cols].astype(np.float32)
+    image = np.dstack((x, y, np.zeros_like(x)))
+    band_map = np.array([0, 1, 2])
+    y, x = np.mgrid[0:400, 0:400]
+    dem = (8 * np.sin(x / 60) * np.cos(y / 70) + 0.05 * x, np.array([199800., 1., 0., 500200., 0., -1.]))
+    focal_length, pixel_size, gsd, max_error = 0.0045, 6.3e-3 / cols, 0.1, 0.125
+
+    cache = MappingCache(16, tolerance=(1., np.radians(1.)))
+    times = [0., 0.]
+    for k in range(10):
+        eo = np.array([200000. + 0.3 * k, 500000. + 0.2 * k, 150.,
+                       np.radians(2 + 0.05 * k), np.radians(-3 + 0.03 * k), np.radians(10 + 0.1 * k)])
+        R = Rot3D(eo)
+        bbox = snap_boundary(np.array([[199920.], [200080.], [499940.], [500060.]]) + 0.25 * k, gsd)
+        boundary_rows = int(round((bbox[3, 0] - bbox[2, 0]) / gsd))
+        boundary_cols = int(round((bbox[1, 0] - bbox[0, 0]) / gsd))
+
+        exact = rectify(bbox, boundary_rows, boundary_cols, gsd, eo, 50., R, focal_length, pixel_size, image,
+                        "bilinear", band_map=band_map, dem=dem)
+        orthos = []
+        for n, mapping_cache in enumerate([None, cache]):
+            start_time = time.time()
+            orthos.append(rectify(bbox, boundary_rows, boundary_cols, gsd, eo, 50., R, focal_length, pixel_size, image,
+                                  "bilinear", band_map=band_map, max_error=max_error, dem=dem,
+                                  mapping_cache=mapping_cache))
+            if k > 0:
+                times[n] += time.time() - start_time
+
+        # Within the image, away from its edges (clamped by the interpolation)
+        inside = (exact[:, :, 3] > 0) & (exact[:, :, 0] > 2) & (exact[:, :, 0] < cols - 3) & \
+                 (exact[:, :, 1] > 2) & (exact[:, :, 1] < rows - 3)
+        errors = [np.abs(ortho[:, :, 0:2] - exact[:, :, 0:2])[inside].max() for ortho in orthos]
+        print(k, 'error without / with the cache: %.4f / %.4f px' % tuple(errors))
+        assert np.array_equal(orthos[0][:, :, 3], orthos[1][:, :, 3])
+        assert errors[1] <= max_error
+
+    print('without / with the cache: %.4f / %.4f seconds per frame' % (times[0] / 9, times[1] / 9), cache.frames)
+    assert cache.frames["incremental"] == 9
+
+    # Benchmark of the video pipeline (orthophoto_process_video with temporal): video frames, nearest, the default
+    # MappingCache against the approximate mapping of every frame on its own - the best of 3 runs of every frame,
+    # e.g. 0.0398 / 0.0340 seconds (x1.17) on 1 CPU: the sampling of the pixels is the same, only the grid is saved
+    rows, cols = 1080, 1920
+    image = (np.random.default_rng(0).random((rows, cols, 3)) * 255).astype(np.uint8)
+    y, x = np.mgrid[0:800, 0:800]
+    dem = ((60 * np.sin(x / 300) * np.cos(y / 350)).astype(np.float32),
+           np.array([199800., 0.5, 0., 500200., 0., -0.5]))
+    pixel_size, gsd = 6.3e-3 / cols, 0.05
+    times = np.full((2, 12), np.inf)
+    for run in range(3):
+        cache = MappingCache(tolerance=(1., np.radians(1.)))
+        for k in range(12):
+            eo = np.array([200000. + 0.3 * k, 500000. + 0.2 * k, 100.,
+                           np.radians(2 + 0.05 * k), np.radians(-3 + 0.03 * k), np.radians(10 + 0.1 * k)])
+            R = Rot3D(eo)
+            bbox = snap_boundary(np.array([[199950.], [200050.], [499970.], [500030.]]) + 0.25 * k, gsd, cache.step)
+            boundary_rows = int(round((bbox[3, 0] - bbox[2, 0]) / gsd))
+            boundary_cols = int(round((bbox[1, 0] - bbox[0, 0]) / gsd))
+            for n, mapping_cache in enumerate([None, cache]):
+                start_time = time.time()
+                rectify(bbox, boundary_rows, boundary_cols, gsd, eo, 0., R, focal_length, pixel_size, image,
+                        "nearest", max_error=max_error, dem=dem, mapping_cache=mapping_cache)
+                times[n, k] = min(times[n, k], time.time() - start_time)
+
+    times = times[:, 1:].sum(axis=1) / 11
+    print('video without / with the cache: %.4f / %.4f seconds per frame, x%.2f'
+          % (times[0], times[1], times[0] / times[1]), cache.frames)
+    assert cache.frames["incremental"] == 11
+    assert times[1] <= times[0]
+    print('End of Test')
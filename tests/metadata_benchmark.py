@@ -0,0 +1,88 @@
+import os
+import time
+import tempfile
+import numpy as np
+import cv2
+import pyexiv2
+from module.ExifData import read_jpeg_header, parse_metadata, open_metadata, EXIF_TAGS, XMP_TAGS
+from tabulate import tabulate
+
+# Metadata of get_metadata(): the JPEG header parser against pyexiv2, on the sample JPEGs
+# and a synthetic DJI JPEG, whose EXIF and XMP (APP1 segments) are written by pyexiv2
+
+# Tags of a DJI image: those of parse_metadata(), and a few others that the header parser skips
+DJI_EXIF = {'Exif.Image.Make': 'DJI', 'Exif.Image.Model': 'FC6310', 'Exif.Image.Orientation': '1',
+            'Exif.Photo.FocalLength': '880/100', 'Exif.GPSInfo.GPSLatitudeRef': 'N',
+            'Exif.GPSInfo.GPSLatitude': '37/1 33/1 5123/100', 'Exif.GPSInfo.GPSLongitudeRef': 'E',
+            'Exif.GPSInfo.GPSLongitude': '126/1 58/1 4567/100', 'Exif.GPSInfo.GPSAltitudeRef': '0',
+            'Exif.GPSInfo.GPSAltitude': '150300/1000'}
+DJI_XMP = {'Xmp.drone-dji.RelativeAltitude': '+100.30', 'Xmp.drone-dji.GimbalRollDegree': '+0.00',
+           'Xmp.drone-dji.GimbalPitchDegree': '-89.90', 'Xmp.drone-dji.GimbalYawDegree': '-12.30'}
+
+
+def synthetic_dji_jpeg(file_path, rows=300, cols=400):
+    y, x = np.mgrid[0:rows, 0:cols]
+    cv2.imwrite(file_path, np.dstack([(x + y).astype(np.uint8)] * 3))
+    pyexiv2.registerNs('http://www.dji.com/drone-dji/1.0/', 'drone-dji')
+    img = pyexiv2.Image(file_path)
+    img.modify_exif(DJI_EXIF)
+    img.modify_xmp(DJI_XMP)
+    img.close()
+
+def pyexiv2_metadata(file_path):
+    img = open_metadata(file_path)
+    exif = img.read_exif()
+    xmp = img.read_xmp()
+    img.close()
+    return parse_metadata(exif, xmp)
+
+def header_metadata(file_path):
+    exif, xmp = read_jpeg_header(file_path)[0:2]
+    return parse_metadata(exif, xmp)
+
+def benchmark(function, file_path, repeat=100):
+    start_time = time.time()
+    for _ in range(repeat):
+        metadata = function(file_path)
+    return metadata, (time.time() - start_time) / repeat
+
+
+if __name__ == '__main__':
+    # The tags of the synthetic image, field by field
+    synthetic_path = os.path.join(tempfile.mkdtemp(), 'DJI_0001.JPG')
+    synthetic_dji_jpeg(synthetic_path)
+    exif, xmp = read_jpeg_header(synthetic_path)[0:2]
+    img = open_metadata(synthetic_path)
+    exiv2_exif, exiv2_xmp = img.read_exif(), img.read_xmp()
+    img.close()
+    for key in [key for tags in EXIF_TAGS.values() for key in tags.values()]:
+        print(key, exif[key], exiv2_exif[key])
+        assert exif[key] == exiv2_exif[key]
+    for key in XMP_TAGS:
+        assert (key in xmp) == (key in exiv2_xmp) == (key in DJI_XMP)
+        if key in xmp:
+            print(key, xmp[key], exiv2_xmp[key])
+            assert xmp[key] == exiv2_xmp[key]
+
+    images = [synthetic_path, './20191011_074853.JPG']
+    for root, dirs, files in os.walk('./query_images'):
+        images += [os.path.join(root, file) for file in sorted(files) if file.lower().endswith('.jpg')]
+
+    results = []
+    for file_path in images:
+        header, header_time = benchmark(header_metadata, file_path)
+        try:
+            exiv2, exiv2_time = benchmark(pyexiv2_metadata, file_path)
+        except RuntimeError as e:   # pyexiv2 rejects some maker notes
+            print(file_path, 'pyexiv2:', e)
+            results.append([os.path.basename(file_path), '-', header_time * 1000, '-'])
+            continue
+
+        assert header[0] == exiv2[0] and header[1] == exiv2[1] and header[3] == exiv2[3]
+        assert np.allclose(header[2], exiv2[2])
+        results.append([os.path.basename(file_path), exiv2_time * 1000, header_time * 1000,
+                        exiv2_time / header_time])
+
+    print(tabulate(results, headers=["Image", "pyexiv2(ms)", "JPEG header(ms)", "Speedup"], tablefmt='psql',
+                   floatfmt=".3f"))
+    print('End of Test')
@@ -0,0 +1,69 @@
+import numpy as np
+from module.EoData import Rot3D
+from module.Boundary import boundary, footprint, footprint_spans
+from module.BackprojectionResample import rectify, projectedCoord, backProjection
+
+# Accuracy of the float32(local origin) rectification against float64
+# Absolute coordinates around EPSG 5186 (200000, 500000)
+
+if __name__ == '__main__':
+    rows, cols = 3000, 4000
+    sensor_width = 6.3  # unit: mm
+    focal_length = 4.7 / 1000  # unit: m
+    pixel_size = sensor_width / cols / 1000  # unit: m/px
+    ground_height = 65  # unit: m
+
+    image = np.random.default_rng(0).integers(0, 256, size=(rows, cols, 3), dtype=np.uint8)
+
+    for opk in [(0, 0, 0), (3, -2, 35), (10, 15, 45)]:
+        eo = np.array([200000., 500000., 215., *np.radians(opk)])
+        R = Rot3D(eo)
+
+        bbox = boundary(image, eo, R, ground_height, pixel_size, focal_length)
+        gsd = (pixel_size * (eo[2] - ground_height)) / focal_length
+        boundary_cols = int((bbox[1, 0] - bbox[0, 0]) / gsd)
+        boundary_rows = int((bbox[3, 0] - bbox[2, 0]) / gsd)
+        spans = footprint_spans(footprint(image, eo, R, ground_height, pixel_size, focal_length),
+                                bbox, boundary_rows, boundary_cols, gsd)
+
+        # 1. Source coordinates of the legacy path - unit: px
+        image_size = np.reshape(image.shape[0:2], (2, 1))
+        coord_f64 = backProjection(projectedCoord(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height),
+                                   R, focal_length, pixel_size, image_size)
+        coord_f32 = backProjection(projectedCoord(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height,
+                                                  np.float32), R, focal_length, pixel_size, image_size)
+        assert coord_f32.dtype == np.float32
+        coord_error = np.max(np.abs(coord_f64 - coord_f32))
+
+        # 2. Orthophotos - bilinear, since nearest neighbor flips wherever a coordinate sits on a pixel border
+        # (e.g. every pixel of a nadir image at the native GSD)
+        ortho_f64 = rectify(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size,
+                            image, "bilinear", backend="numba", spans=spans)
+        ortho_f32 = rectify(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size,
+                            image, "bilinear", backend="numba", spans=spans, precision="float32")
+        # Footprint edges may flip in or out
+        both = (ortho_f64[:, :, 3] > 0) & (ortho_f32[:, :, 3] > 0)
+        edge_error = np.mean(ortho_f64[:, :, 3] != ortho_f32[:, :, 3])
+        pixel_error = np.max(np.abs(ortho_f64[both].astype(np.int16) - ortho_f32[both]))
+
+        print(opk, 'max coordinate error: %.6f px' % coord_error, 'max pixel value error: %d' % pixel_error,
+              'flipped edge pixels: %.6f' % edge_error)
+        assert coord_error < 0.01
+        assert pixel_error <= 1
+        assert edge_error < 0.001
+
+        # 3. The default backend keeps float32 (on numba, not the OpenCV homography)
+        ortho_auto = rectify(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size,
+                             image, "bilinear", spans=spans, precision="float32")
+        assert np.array_equal(ortho_auto, ortho_f32)
+
+    for precision, backend in [("float16", "auto"), ("float32", "opencv")]:
+        try:
+            rectify(bbox, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size, image,
+                    "bilinear", backend, precision=precision)
+        except Exception as e:
+            print(precision, backend, e)
+        else:
+            raise AssertionError(precision + ' on ' + backend)
+
+    print('End of Test')
@@ -0,0 +1,39 @@
+import time
+import numpy as np
+from module.Dem import ray_dem, dem_height
+
+# Ray-DEM intersections of the min/max pyramid against a dense march along the rays
+# Synthetic terrain around EPSG 5186 (200000, 500000)
+
+if __name__ == '__main__':
+    rows, cols = 2000, 2000
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:rows, 0:cols]
+    heights = (30 * np.sin(x / 40) * np.cos(y / 55) + rng.normal(0, 1, (rows, cols)) + 100).astype(np.float32)
+    dem = (heights, np.array([200000., 0.5, 0., 500000., 0., -0.5]))  # unit: m
+
+    n = 100000
+    origins = np.column_stack((rng.uniform(200300, 200700, n), rng.uniform(499300, 499700, n), np.full(n, 300.)))
+    directions = np.column_stack((rng.normal(0, 0.2, n), rng.normal(0, 0.2, n), -np.ones(n)))
+
+    ray_dem(dem, origins[:1], directions[:1])
+    start_time = time.time()
+    hits = ray_dem(dem, origins, directions)
+    print('%d rays' % n, "--- %s seconds ---" % (time.time() - start_time))
+
+    # Dense march: the first sample under the terrain, every 1 mm along the rays
+    t = np.arange(0, 300, 0.001)
+    max_error = 0
+    for k in range(0, n, 5000):
+        samples = origins[k] + t[:, np.newaxis] * directions[k]
+        terrain = np.array([dem_height(heights, dem[1], s[0], s[1]) for s in samples[::100]])
+        first = np.argmax(samples[::100, 2] <= terrain) * 100
+        samples = samples[max(first - 100, 0):first + 1]
+        terrain = np.array([dem_height(heights, dem[1], s[0], s[1]) for s in samples])
+        max_error = max(max_error, np.linalg.norm(samples[np.argmax(samples[:, 2] <= terrain)] - hits[k]))
+
+    print('max error: %.6f m' % max_error)
+    assert not np.any(np.isnan(hits))
+    assert max_error < 0.01
+
+    print('End of Test')
@@ -0,0 +1,33 @@
+import numpy as np
+from module.BackprojectionResample import rectify
+from module.EoData import Rot3D
+
+# Occluded area of a true orthophoto behind a building, at several output GSDs - it depends on the scene only
+# Synthetic DSM around EPSG 5186 (200000, 500000): flat ground with a 20 m x 20 m building of 30 m
+# The camera is 30 m north of the building at 150 m: 394 m2 of the ground is hidden behind it (ray-box intersection)
+
+if __name__ == '__main__':
+    rows, cols = 3000, 4000
+    image = np.full((rows, cols, 3), 128, dtype=np.uint8)
+    focal_length, pixel_size = 0.0045, 6.3e-3 / cols   # native GSD: about 0.05 m on the ground
+    heights = np.zeros((200, 200), dtype=np.float32)
+    heights[90:130, 80:120] = 30.
+    dem = (heights, np.array([199950., 0.5, 0., 500050., 0., -0.5]))  # unit: m
+
+    eo = np.array([200000., 500035., 150., 0., 0., 0.])
+    R = Rot3D(eo)
+    bbox = np.array([[199950.], [200050.], [499950.], [500050.]])
+    areas = []
+    for gsd in [0.05, 0.1, 0.2, 0.4]:
+        boundary_rows = boundary_cols = int(round(100 / gsd))
+        plain = rectify(bbox, boundary_rows, boundary_cols, gsd, eo, 0., R, focal_length, pixel_size, image,
+                        dem=dem)
+        true = rectify(bbox, boundary_rows, boundary_cols, gsd, eo, 0., R, focal_length, pixel_size, image,
+                       dem=dem, true_ortho=True)
+        areas.append(np.count_nonzero((plain[:, :, 3] > 0) & (true[:, :, 3] == 0)) * gsd ** 2)
+        print('GSD %.2f m: %.1f m2 occluded' % (gsd, areas[-1]))
+
+    for area in areas:
+        assert abs(area - 394) < 0.15 * 394
+
+    print('End of Test')
@@ -0,0 +1,34 @@
+import os
+import tempfile
+import numpy as np
+from module.Video import read_telemetry, interpolate_pose
+
+# Telemetry of the DJI SRT formats, and the poses interpolated between its cues
+
+if __name__ == '__main__':
+    folder = tempfile.mkdtemp()
+    srt_path = os.path.join(folder, 'DJI_0001.SRT')
+    with open(srt_path, 'w') as f:
+        for n, yaw in enumerate([179., -179.]):
+            f.write('%d\n00:00:0%d,000 --> 00:00:0%d,033\n<font size="28">FrameCnt: %d, DiffTime: 33ms\n'
+                    '[iso: 100] [latitude: %.6f] [longitude: 127.000000] [rel_alt: %.3f abs_alt: 150.000] '
+                    '[gb_yaw: %.1f gb_pitch: -90.0 gb_roll: 0.0] </font>\n\n'
+                    % (n + 1, n, n, n + 1, 37.5 + n * 0.0001, 100. + n * 10, yaw))
+    telemetry = read_telemetry(srt_path)
+    print(telemetry)
+    assert telemetry.shape == (2, 7)
+
+    pose = interpolate_pose(telemetry, 0.5)
+    print(pose)
+    assert np.allclose(pose, [127., 37.50005, 105., 0., -90., 180.])   # the yaw across +-180 degrees
+
+    # Older format, without the gimbal angles
+    old_path = os.path.join(folder, 'DJI_0002.SRT')
+    with open(old_path, 'w') as f:
+        f.write('1\n00:00:00,000 --> 00:00:01,000\nHOME(127.0000,37.5000) 2020.01.01 12:00:00\n'
+                'GPS(127.0001,37.5001,19) BAROMETER:62.5\n\n')
+    telemetry = read_telemetry(old_path, gimbal=(0., -90., 0.))
+    print(telemetry)
+    assert np.allclose(telemetry[0], [0., 127.0001, 37.5001, 62.5, 0., -90., 0.])
+
+    print('End of Test')
@@ -0,0 +1,101 @@
+import asyncio
+import itertools
+import numpy as np
+import main
+from module import BackprojectionResample, Dem, Occlusion
+from module.BackprojectionResample import rectify, warmup_kernels, MappingCache, snap_boundary, INTERPOLATION
+from module.Dem import ray_dem
+from module.EoData import Rot3D
+
+# Build-time warm-up: every kernel signature that rectify() dispatches in production is compiled by
+# warmup_kernels(), so that no request compiles after it - and /ready reports the warm-up of the app
+
+KERNELS = {
+    "rectify_plane_parallel": BackprojectionResample.rectify_plane_parallel,
+    "rectify_plane_parallel_f32": BackprojectionResample.rectify_plane_parallel_f32,
+    "rectify_dem_parallel": BackprojectionResample.rectify_dem_parallel,
+    "rectify_approx": BackprojectionResample.rectify_approx,
+    "rectify_coherent": BackprojectionResample.rectify_coherent,
+    "zbuffer_parallel": Occlusion.zbuffer_parallel,
+    "pyramid_parallel": Dem.pyramid_parallel,
+    "ray_dem_parallel": Dem.ray_dem_parallel,
+}
+
+def signatures():
+    return {name: set(kernel.signatures) for name, kernel in KERNELS.items()}
+
+if __name__ == '__main__':
+    # 1. /ready before the warm-up
+    main.app.state.ready = False
+    try:
+        asyncio.run(main.ready())
+        raise AssertionError("ready before the warm-up")
+    except main.HTTPException as e:
+        print('/ready before the warm-up:', e.status_code, e.detail)
+        assert e.status_code == 503
+
+    # 2. Warm-up of the app: the kernels, GDAL and the coordinate systems
+    main.warmup_app()
+    assert main.app.state.ready
+    assert asyncio.run(main.ready()) == {"ready": True}
+    print('/ready after the warm-up:', asyncio.run(main.ready()))
+
+    warmed = signatures()
+    for name, kernel_signatures in warmed.items():
+        print('%-28s %d signature(s)' % (name, len(kernel_signatures)))
+        assert len(kernel_signatures) > 0, name
+    # Both image types of the rectify kernels
+    for name in ["rectify_plane_parallel", "rectify_plane_parallel_f32", "rectify_dem_parallel",
+                 "rectify_approx", "rectify_coherent"]:
+        for dtype in ["uint8", "uint16"]:
+            image_type = "array(%s, 3d, C)" % dtype
+            assert any(image_type in map(str, signature) for signature in warmed[name]), (name, dtype)
+
+    # 3. The configurations of production, on sizes other than those of the warm-up, compile nothing new
+    rows, cols = 60, 80
+    gsd = 0.5
+    eo = np.array([200010., 500012., 215., *np.radians((3., -2., 35.))])
+    R = Rot3D(eo)
+    boundary = snap_boundary(np.array([[200000.], [200040.], [500000.], [500030.]]), gsd)
+    boundary_cols = int(round((boundary[1, 0] - boundary[0, 0]) / gsd))
+    boundary_rows = int(round((boundary[3, 0] - boundary[2, 0]) / gsd))
+    spans = np.tile(np.array([0, boundary_cols], dtype=np.int64), (boundary_rows, 1))
+    focal_length = 0.0047
+    pixel_size = 6.3 / cols / 1000
+    ground_height = 65.
+    dem = (np.random.default_rng(0).uniform(60., 70., size=(30, 40)).astype(np.float32),
+           np.array([boundary[0, 0], 1., 0., boundary[3, 0], 0., -1.]))
+
+    for dtype in [np.uint8, np.uint16]:
+        image = np.random.default_rng(0).integers(0, 256, size=(rows, cols, 3)).astype(dtype)
+        buffer = np.zeros(shape=(boundary_rows, boundary_cols, 4), dtype=dtype)
+        for precision, interpolation, distortion, out in itertools.product(["float64", "float32"], INTERPOLATION,
+                                                                            [None, (-0.1, 0.01, 0., 0.001, 0.)],
+                                                                            [None, buffer]):
+            rectify(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size,
+                    image, interpolation, "numba", spans, out, precision, distortion=distortion)
+            for max_error in [None, 0.125]:
+                rectify(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size,
+                        image, interpolation, "numba", spans, out, precision, distortion=distortion,
+                        max_error=max_error, dem=dem)
+            rectify(boundary, boundary_rows, boundary_cols, gsd, eo, ground_height, R, focal_length, pixel_size,
+                    image, interpolation, "numba", spans, out, precision, distortion=distortion, dem=dem,
+                    true_ortho=True)
+            # video frames: the control grid kept between frames, with and without a DEM
+            for frame_dem in [None, dem]:
+                mapping_cache = MappingCache()
+                for shift in [0., 0.1, 5.]:
+                    rectify(boundary, boundary_rows, boundary_cols, gsd, eo + [shift, 0., 0., 0., 0., 0.],
+                            ground_height, R, focal_length, pixel_size, image, interpolation, "numba", spans, out,
+                            precision, distortion=distortion, max_error=0.125, dem=frame_dem,
+                            mapping_cache=mapping_cache)
+    ray_dem(dem, np.tile(eo[0:3], (4, 1)), np.tile([0.1, 0.2, -1.], (4, 1)))
+
+    compiled = signatures()
+    for name in KERNELS:
+        new = compiled[name] - warmed[name]
+        for signature in new:
+            print('Compiled after the warm-up -', name, signature)
+        assert not new, name
+
+    print('End of Test')
@@ -0,0 +1,70 @@
+import os
+import time
+import shutil
+import threading
+import struct
+import numpy as np
+import cv2
+from main_dg import orthophoto_process_watch, warmup, jpeg_complete
+
+# End-to-end latency of the watch mode (file arrival -> GeoTIFF on disk) under a sustained arrival rate
+# The drone images of ./query_images are copied into the ingest folder in chunks, like a downlink would write them
+
+
+def downlink(images, ingest_folder, rate, count, chunk_size=256 * 1024):
+    for n in range(count):
+        start_time = time.time()
+        dst = os.path.join(ingest_folder, 'IMG_%04d.JPG' % n)
+        with open(images[n % len(images)], 'rb') as src, open(dst, 'wb') as f:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                f.flush()
+        time.sleep(max(0., 1 / rate - (time.time() - start_time)))
+
+
+def thumbnail_jpeg(file_path):
+    # A JPEG with an EXIF thumbnail at the end of its APP1 segment - the offset of the end of APP1
+    image = cv2.imencode('.jpg', np.zeros((480, 640, 3), dtype=np.uint8))[1].tobytes()
+    thumbnail = cv2.imencode('.jpg', np.zeros((120, 160, 3), dtype=np.uint8))[1].tobytes()
+    app1 = b'Exif\x00\x00' + thumbnail
+    data = image[0:2] + b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 + image[2:]
+    with open(file_path, 'wb') as f:
+        f.write(data)
+    return 6 + len(app1)
+
+
+if __name__ == '__main__':
+    # A JPEG written up to its thumbnail is not complete
+    end = thumbnail_jpeg('./thumbnail.jpg')
+    assert jpeg_complete('./thumbnail.jpg')
+    with open('./thumbnail.jpg', 'r+b') as f:
+        f.truncate(end)
+    assert not jpeg_complete('./thumbnail.jpg')
+    os.remove('./thumbnail.jpg')
+
+    images = []
+    for root, dirs, files in os.walk('./query_images'):
+        images += [os.path.join(root, file) for file in sorted(files) if file.lower().endswith('.jpg')]
+
+    ingest_folder = './watch_ingest'
+    output_folder = './watch_output'
+    for folder in [ingest_folder, output_folder]:
+        shutil.rmtree(folder, ignore_errors=True)
+        os.mkdir(folder)
+    warmup()
+
+    for rate in [1, 2, 4]:  # unit: images/s
+        for file in os.listdir(ingest_folder):
+            os.remove(os.path.join(ingest_folder, file))
+        sender = threading.Thread(target=downlink, args=(images, ingest_folder, rate, 20 * rate))
+        sender.start()
+        summary = orthophoto_process_watch(ingest_folder, 0, 6.3, 5186, 0, output_folder, idle_timeout=3,
+                                           latency_log=os.path.join(output_folder, 'latency_%d.jsonl' % rate))
+        sender.join()
+        print('%d images/s - p50: %s s, p99: %s s' % (rate, summary['p50'], summary['p99']))
+        assert summary['images'] == 20 * rate
+
+    print('End of Test')